@@ -0,0 +1,44 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Measures the wall clock time of one-shot invocations of main.py, compared to starting a bare interpreter.
+#
+#   python benchmarks/startup.py [-n RUNS] [DATA_DIR]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = (
+    ('interpreter', ['-c', 'pass']),
+    ('ls recipes', ['main.py', '-R', '{data}', 'ls', 'r']),
+    ('ls one recipe', ['main.py', '-R', '{data}', 'ls', '-r', '@wire']),
+    ('tree', ['main.py', '-R', '{data}', 'tree', '@smart_plating', '-r', '10']),
+)
+
+
+def measure(argv: list[str], runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', metavar='DATA_DIR', nargs='?', default='data/satisfactory')
+    parser.add_argument('-n', '--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"case":<16} {"min":>8} {"median":>8} {"mean":>8}  (ms, {args.runs} runs)')
+    for name, argv in CASES:
+        times = measure([a.format(data=args.data_dir) for a in argv], args.runs)
+        print(f'{name:<16} {min(times):8.1f} {statistics.median(times):8.1f} {statistics.mean(times):8.1f}')
+
+
+if __name__ == '__main__':
+    main()
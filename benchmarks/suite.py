@@ -0,0 +1,219 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# also makes the modules of the repository importable
+import synthetic
+
+import chaining
+import parallel
+from render import TreeRenderer
+from repository import load_repository, save_repository
+from search_index import SearchIndex
+
+# Benchmarks the core operations on a synthetic repository (see synthetic.py) and reports the time and peak memory of
+# every case as JSON. Reports of the same spec can be compared: with --baseline, cases which got slower or use more
+# memory than the tolerance allows are listed and the exit status is 1.
+#
+#   python benchmarks/suite.py [-n RUNS] [-T TREES] [-D MAX_DEPTH] [-c CASE,...] [-o REPORT] [-b BASELINE]
+#                              [-t TOLERANCE] [SPEC OPTIONS]
+#
+# SPEC OPTIONS are those of synthetic.py. Trees of specs with loops grow exponentially with their depth, use a lower
+# MAX_DEPTH for them.
+
+# changes below this are noise, regardless of the tolerance
+MIN_DIFF_MS = 0.05
+MIN_DIFF_KIB = 16
+
+
+class Context:
+
+    def __init__(self, spec: synthetic.SyntheticSpec, trees: int, max_depth: int, work_dir: str):
+        self.repo = synthetic.generate_repository(spec)
+        self.res_path, self.rec_path = synthetic.write_repository(self.repo, os.path.join(work_dir, 'data'))
+        self.out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(self.out_dir)
+        self.jobs = [parallel.PlanJob(recipe_id, product_id, 60.0, max_depth=max_depth)
+                     for recipe_id, product_id in synthetic.end_products(self.repo)[:trees]]
+        self.trees = [parallel.build_tree(self.repo, job) for job in self.jobs]
+        self.graphs = [chaining.convert_to_graph(tree, tree.root.production.product) for tree in self.trees]
+        self.queries = [resource.name[:length] for resource in list(self.repo.resources.values())[:20]
+                        for length in (2, 5)]
+
+
+def case_load(ctx: Context):
+    load_repository(ctx.res_path, ctx.rec_path)
+
+
+def case_save(ctx: Context):
+    save_repository(ctx.repo, os.path.join(ctx.out_dir, 'resources.json'), os.path.join(ctx.out_dir, 'recipes.json'),
+                    force=True)
+
+
+def case_lookup(ctx: Context):
+    repo = ctx.repo
+    for resource in repo.resources.values():
+        for recipe in repo.find_recipes_by_product(resource):
+            repo.recipe(recipe.id)
+        repo.resource_by_name(resource.name)
+
+
+def case_search(ctx: Context):
+    index = SearchIndex(ctx.repo.resources)
+    for query in ctx.queries:
+        index.search(query, 50)
+
+
+def case_build(ctx: Context):
+    for job in ctx.jobs:
+        parallel.build_tree(ctx.repo, job)
+
+
+def case_convert(ctx: Context):
+    for tree in ctx.trees:
+        chaining.convert_to_graph(tree, tree.root.production.product)
+
+
+def case_update_scales(ctx: Context):
+    for graph in ctx.graphs:
+        graph.update_scales()
+
+
+def case_aggregate(ctx: Context):
+    for tree in ctx.trees:
+        tree.get_aggregate()
+
+
+def case_render(ctx: Context):
+    for tree in ctx.trees:
+        TreeRenderer(io.StringIO()).render(tree)
+
+
+CASES = (
+    ('load', case_load),
+    ('save', case_save),
+    ('lookup', case_lookup),
+    ('search', case_search),
+    ('build', case_build),
+    ('convert', case_convert),
+    ('update_scales', case_update_scales),
+    ('aggregate', case_aggregate),
+    ('render', case_render),
+)
+
+
+def measure(case, ctx: Context, runs: int) -> dict:
+    case(ctx)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        case(ctx)
+        times.append((time.perf_counter() - start) * 1000)
+    # separate run, tracing slows down the case
+    tracemalloc.start()
+    try:
+        case(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'min_ms': min(times), 'median_ms': statistics.median(times), 'mean_ms': statistics.mean(times),
+            'peak_kib': peak / 1024}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    # names of the cases which regressed
+    regressions = []
+    print(f'{"case":<14} {"min":>9} {"baseline":>9} {"change":>8} {"peak":>9} {"baseline":>9} {"change":>8}')
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name, None)
+        if base is None:
+            print(f'{name:<14} {result["min_ms"]:9.2f} {"-":>9} {"":>8} {result["peak_kib"]:9.0f}')
+            continue
+        # the fastest runs are compared, they are least affected by other load on the machine
+        time_change = result['min_ms'] / base['min_ms'] - 1 if base['min_ms'] > 0 else 0.0
+        peak_change = result['peak_kib'] / base['peak_kib'] - 1 if base['peak_kib'] > 0 else 0.0
+        slower = time_change > tolerance and result['min_ms'] - base['min_ms'] > MIN_DIFF_MS
+        larger = peak_change > tolerance and result['peak_kib'] - base['peak_kib'] > MIN_DIFF_KIB
+        if slower or larger:
+            regressions.append(name)
+        print(f'{name:<14} {result["min_ms"]:9.2f} {base["min_ms"]:9.2f} {time_change:+8.1%} '
+              f'{result["peak_kib"]:9.0f} {base["peak_kib"]:9.0f} {peak_change:+8.1%}'
+              f'{"  REGRESSION" if slower or larger else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    synthetic.add_spec_arguments(parser)
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('-T', '--trees', type=int, default=5, help='number of trees built per run')
+    parser.add_argument('-D', '--max-depth', type=int, default=15,
+                        help='depth limit of the trees')
+    parser.add_argument('-c', '--cases', type=str, default=None, help='comma separated cases to run')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the report to this file, - for stdout')
+    parser.add_argument('-b', '--baseline', type=str, default=None, help='report to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed relative increase of time and memory before a case counts as regression')
+    args = parser.parse_args()
+
+    cases = CASES
+    if args.cases is not None:
+        names = args.cases.split(',')
+        unknown = [name for name in names if name not in dict(CASES)]
+        if len(unknown) > 0:
+            print(f'error: unknown case(s): {", ".join(unknown)}')
+            sys.exit(2)
+        cases = [(name, case) for name, case in CASES if name in names]
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    spec = synthetic.spec_from_args(args)
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            ctx = Context(spec, args.trees, args.max_depth, work_dir)
+        except ValueError as e:
+            print(f'error: {e}')
+            sys.exit(2)
+        report = {
+            'spec': spec.as_dict(),
+            'trees': args.trees,
+            'max_depth': args.max_depth,
+            'runs': args.runs,
+            'python': platform.python_version(),
+            'results': {name: measure(case, ctx, args.runs) for name, case in cases}
+        }
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is None:
+        if args.output != '-':
+            print(f'{"case":<14} {"min":>9} {"median":>9} {"peak":>9}  (ms, KiB, {args.runs} runs)')
+            for name, result in report['results'].items():
+                print(f'{name:<14} {result["min_ms"]:9.2f} {result["median_ms"]:9.2f} {result["peak_kib"]:9.0f}')
+        return
+    if baseline['spec'] != report['spec'] or any(baseline.get(k, None) != report[k] for k in ('trees', 'max_depth')):
+        print('error: baseline was measured with a different spec, results are not comparable')
+        sys.exit(2)
+    regressions = compare(report, baseline, args.tolerance)
+    if len(regressions) > 0:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
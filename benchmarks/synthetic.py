@@ -0,0 +1,139 @@
+import argparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository import RecipeRepository, save_repository, generate_id
+
+# Deterministic generator of synthetic repositories, for benchmarks with more recipes than the bundled data. Resources
+# are split into depth + 1 layers: layer 0 holds the end products, the last layer the raw resources. Every recipe
+# produces one resource of a layer from fan_in resources of the next layer, optionally (with probability loops) also
+# consuming a product of the previous layer, which creates cycles. The same spec and seed always give the same data.
+#
+#   python benchmarks/synthetic.py [-r RESOURCES] [-d DEPTH] [-a ALTERNATES] [-f FAN_IN] [-l LOOPS] [-s SEED] OUT_DIR
+
+_ADJECTIVES = ('Heavy', 'Light', 'Reinforced', 'Modular', 'Compact', 'Fused', 'Coated', 'Polished', 'Refined',
+               'Encased', 'Automated', 'Adaptive', 'Thermal', 'Pressure', 'Magnetic', 'Crystal')
+_NOUNS = ('Plate', 'Frame', 'Rod', 'Wire', 'Beam', 'Rotor', 'Stator', 'Motor', 'Casing', 'Filter', 'Circuit', 'Cell',
+          'Panel', 'Pipe', 'Screw', 'Core', 'Ingot', 'Sheet', 'Coil', 'Module')
+
+
+class SyntheticSpec:
+    __slots__ = ('resources', 'recipes', 'depth', 'alternates', 'fan_in', 'loops', 'seed')
+
+    def __init__(self, resources: int = 200, recipes: int | None = None, depth: int = 5, alternates: int = 1,
+                 fan_in: int = 2, loops: float = 0.0, seed: int = 0):
+        # resources: total number of resources, recipes: total number of recipes, by default one per product plus
+        # alternates per product
+        self.resources = resources
+        self.recipes = recipes
+        self.depth = depth
+        self.alternates = alternates
+        self.fan_in = fan_in
+        self.loops = loops
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def generate_records(spec: SyntheticSpec) -> tuple[list[dict], list[dict]]:
+    # resources and recipes in the format of resources.json and recipes.json
+    if spec.depth < 1 or spec.resources < spec.depth + 1:
+        raise ValueError(f'need at least {spec.depth + 1} resources for depth {spec.depth}')
+    rng = random.Random(spec.seed)
+    layer_count = spec.depth + 1
+    layers: list[list[str]] = [[] for _ in range(layer_count)]
+    resources = []
+    for i in range(spec.resources):
+        layer = i % layer_count
+        name = f'{_ADJECTIVES[rng.randrange(len(_ADJECTIVES))]} {_NOUNS[rng.randrange(len(_NOUNS))]} {i}'
+        resources.append({'name': name, 'id': generate_id(name), 'raw': layer == layer_count - 1})
+        layers[layer].append(resources[-1]['id'])
+
+    products = [(layer, res_id) for layer in range(spec.depth) for res_id in layers[layer]]
+    if spec.recipes is None:
+        producing = [p for p in products for _ in range(1 + spec.alternates)]
+    else:
+        # every product gets one recipe as far as possible, the rest are alternates of random products
+        producing = products[:spec.recipes]
+        producing += [products[rng.randrange(len(products))] for _ in range(spec.recipes - len(producing))]
+
+    recipes = []
+    names = {res['id']: res['name'] for res in resources}
+    alternate = dict()
+    for layer, product_id in producing:
+        number = alternate.get(product_id, 0)
+        alternate[product_id] = number + 1
+        name = names[product_id] if number == 0 else f'Alternate {names[product_id]} {number}'
+        ingredients = rng.sample(layers[layer + 1], min(spec.fan_in, len(layers[layer + 1])))
+        if layer > 0 and rng.random() < spec.loops:
+            ingredients.append(layers[layer - 1][rng.randrange(len(layers[layer - 1]))])
+        recipes.append({
+            'name': name,
+            'id': generate_id(name),
+            'cycle_secs': float(rng.choice((1, 2, 3, 4, 6, 8, 10, 12))),
+            'products': [{'id': product_id, 'quantity': float(rng.randint(1, 3))}],
+            'resources': [{'id': res_id, 'quantity': float(rng.randint(1, 5))} for res_id in ingredients]
+        })
+    return resources, recipes
+
+
+def generate_repository(spec: SyntheticSpec) -> RecipeRepository:
+    resources, recipes = generate_records(spec)
+    repo = RecipeRepository()
+    for d in resources:
+        repo.load_resource(d)
+    for d in recipes:
+        repo.load_recipe(d)
+    return repo
+
+
+def end_products(repo: RecipeRepository) -> list[tuple[str, str]]:
+    # (recipe id, product id) of all recipes whose product is not consumed by any recipe
+    consumed = {res_id for recipe in repo.recipes.values() for res_id in recipe.resources.keys()}
+    return sorted((recipe.id, product_id) for recipe in repo.recipes.values()
+                  for product_id in recipe.products.keys() if product_id not in consumed)
+
+
+def write_repository(repo: RecipeRepository, out_dir: str) -> tuple[str, str]:
+    os.makedirs(out_dir, exist_ok=True)
+    res_path = os.path.join(out_dir, 'resources.json')
+    rec_path = os.path.join(out_dir, 'recipes.json')
+    save_repository(repo, res_path, rec_path, force=True)
+    return res_path, rec_path
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-r', '--resources', type=int, default=200)
+    parser.add_argument('-R', '--recipes', type=int, default=None)
+    parser.add_argument('-d', '--depth', type=int, default=5)
+    parser.add_argument('-a', '--alternates', type=int, default=1)
+    parser.add_argument('-f', '--fan-in', type=int, default=2)
+    parser.add_argument('-l', '--loops', type=float, default=0.0)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+
+
+def spec_from_args(args: argparse.Namespace) -> SyntheticSpec:
+    return SyntheticSpec(args.resources, args.recipes, args.depth, args.alternates, args.fan_in, args.loops, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', metavar='OUT_DIR')
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+    try:
+        repo = generate_repository(spec_from_args(args))
+    except ValueError as e:
+        print(f'error: {e}')
+        sys.exit(1)
+    write_repository(repo, args.out_dir)
+    print(f'{len(repo.resources)} resources, {len(repo.recipes)} recipes written to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
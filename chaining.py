@@ -1,6 +1,8 @@
+import contextlib
+import time
 import typing
 from abc import ABC, abstractmethod
-from typing import Iterator, Optional
+from typing import Collection, Iterable, Iterator, Optional
 
 from data import Resource, TargetedProduction, ResourceQuantity, Recipe, ScaledRecipe, ResourceQuantities
 from repository import RecipeRepository
@@ -26,7 +28,8 @@ class ResourceAggregate:
             if existing is not None:
                 existing.quantity += res_qt.quantity
             else:
-                self.raw[res_qt.resource.id] = res_qt
+                # copied, the quantity is accumulated and res_qt belongs to a tree node
+                self.raw[res_qt.resource.id] = ResourceQuantity(res_qt.resource, res_qt.quantity)
         else:
             existing = self.recipes.get(recipe.id, None)
             if existing is not None:
@@ -49,6 +52,70 @@ class ResourceAggregate:
 
 
 
+class BuildCancelled(Exception):
+    pass
+
+
+class BuildMonitor:
+    # Progress of building a tree, shared with the thread building it: the number of recipe nodes expanded so far, and
+    # a flag to stop building at the next node.
+    __slots__ = ('expanded', 'cancelled')
+
+    def __init__(self):
+        self.expanded = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class PlanStats:
+    # Counters and phase timings of planning a tree, e.g. for "tree --stats". They are only collected if a stats object
+    # is given to ProductionTree.build and convert_to_graph, the hot paths just test for None otherwise.
+    __slots__ = ('prod_nodes', 'alt_nodes', 'end_nodes', 'recipe_lookups', 'max_depth', 'depth_limited',
+                 'pruned_parent', 'pruned_excluded', 'graph_nodes', 'graph_edges', 'scale_visits', 'times')
+
+    def __init__(self):
+        # tree nodes created per type
+        self.prod_nodes = 0
+        self.alt_nodes = 0
+        self.end_nodes = 0
+        # calls of find_recipes_by_product
+        self.recipe_lookups = 0
+        # deepest level below the root and recipe nodes left unexpanded because of the depth limit
+        self.max_depth = 0
+        self.depth_limited = 0
+        # recipes not used as alternative because they already occur in the chain above or are excluded
+        self.pruned_parent = 0
+        self.pruned_excluded = 0
+        self.graph_nodes = 0
+        self.graph_edges = 0
+        # scale calculations of graph nodes
+        self.scale_visits = 0
+        # phase -> seconds
+        self.times: dict[str, float] = dict()
+
+    @contextlib.contextmanager
+    def timed(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[phase] = self.times.get(phase, 0.0) + time.perf_counter() - started
+
+    def count_graph(self, graph: 'ProductionGraph'):
+        self.graph_nodes = len(graph.nodes)
+        self.graph_edges = sum(len(node.producers) for node in graph.nodes.values())
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def timed(stats: typing.Optional[PlanStats], phase: str) -> typing.ContextManager:
+    # times the phase if stats are collected
+    return stats.timed(phase) if stats is not None else contextlib.nullcontext()
+
+
 class BaseNode(ABC):
     __slots__ = ('parent', 'children', 'tree')
 
@@ -61,10 +128,10 @@ class BaseNode(ABC):
         pass
 
     @abstractmethod
-    def print_node(self): ...
+    def label(self) -> str: ...
 
     @abstractmethod
-    def print_children(self, level: int, pfx: str): ...
+    def display_children(self) -> list['BaseNode']: ...
 
     @abstractmethod
     def aggregate_resources(self, aggregate: ResourceAggregate): ...
@@ -86,11 +153,11 @@ class EndNode(BaseNode):
     def __iter__(self) -> Iterator:
         return list().__iter__()
 
-    def print_node(self):
-        print(f'{self.resource.resource.name}: {self.resource.quantity:.1f}')
+    def label(self) -> str:
+        return f'{self.resource.resource.name}: {self.resource.quantity:.1f}'
 
-    def print_children(self, level: int, pfx: str):
-        return
+    def display_children(self) -> list['BaseNode']:
+        return []
 
     def aggregate_resources(self, aggregate: ResourceAggregate):
         aggregate.add(self.resource, None)
@@ -130,19 +197,18 @@ class AltNode(BaseNode):
         else:
             return active.__iter__()
 
-    def print_node(self):
+    def label(self) -> str:
         if len(self.slots) > 0:
             node = self.active
             production = node.production.str_for_rpm(node.rpm)
         else:
             production = '<n/a>'
-        print(f'[{self.active_slot}] {production}')
+        return f'[{self.active_slot}] {production}'
 
-    def print_children(self, level: int, pfx: str):
-        if len(self.slots) > 0:
-            node = self.active
-            if node is not None:
-                node.print_children(level + 1, pfx)
+    def display_children(self) -> list['BaseNode']:
+        # an alternative is displayed as one line together with its active recipe
+        active = self.active
+        return active.children if active is not None else []
 
     def aggregate_resources(self, aggregate: ResourceAggregate):
         active = self.active
@@ -160,6 +226,12 @@ class ProdNode(BaseNode):
         self.children = []
 
     def resolve_children(self, repository: RecipeRepository, level: int, max_level: int, parent_recipes: set[str], excluded_recipes: set[str]):
+        monitor = self.tree.monitor
+        if monitor is not None:
+            if monitor.cancelled:
+                raise BuildCancelled()
+            monitor.expanded += 1
+        stats = self.tree.stats
         for dependency in self.production.for_rpm(self.rpm).resources:
             alternatives = AltNode(dependency.resource, self, self.tree)
             recipes_unfiltered = repository.find_recipes_by_product(dependency.resource)
@@ -167,10 +239,22 @@ class ProdNode(BaseNode):
             for recipe in recipes_unfiltered:
                 if recipe.id not in parent_recipes and recipe.id not in excluded_recipes:
                     recipes.append(recipe)
+            if stats is not None:
+                stats.recipe_lookups += 1
+                stats.max_depth = max(stats.max_depth, level + 1)
+                if len(recipes) < len(recipes_unfiltered):
+                    excluded = sum(1 for recipe in recipes_unfiltered if recipe.id in excluded_recipes)
+                    stats.pruned_excluded += excluded
+                    stats.pruned_parent += len(recipes_unfiltered) - len(recipes) - excluded
 
             if len(recipes) == 0:
+                if stats is not None:
+                    stats.end_nodes += 1
                 self.children.append(EndNode(dependency, self, self.tree))
                 continue
+            if stats is not None:
+                stats.alt_nodes += 1
+                stats.prod_nodes += len(recipes)
 
             for recipe in recipes:
                 production = recipe.production(dependency.resource)
@@ -180,6 +264,8 @@ class ProdNode(BaseNode):
                     parents = parent_recipes.copy()
                     parents.add(self.recipe.id)
                     child_node.resolve_children(repository, level + 1, max_level, parents, excluded_recipes)
+                elif stats is not None:
+                    stats.depth_limited += 1
 
                 alternatives.add(child_node)
 
@@ -192,26 +278,11 @@ class ProdNode(BaseNode):
     def __str__(self):
         return f'Product="{self.production.product.name}" rpm={self.rpm}'
 
-    def print_node(self):
-        print(f'{self.production.str_for_rpm(self.rpm)}')
+    def label(self) -> str:
+        return self.production.str_for_rpm(self.rpm)
 
-    def print_children(self, level: int, pfx: str):
-        # ├ └ ─
-
-        i = 1
-        for child_node in self.children:
-            last_child = i < len(self.children)
-            w_str = '{}── '.format('├' if last_child else '└',
-                                             width=level * 2)
-            c_pfx = '{pfx}{}   '.format(
-                '│' if last_child else ' ',
-                pfx=pfx
-            )
-            print(pfx, end='')
-            print(w_str, end='')
-            child_node.print_node()
-            child_node.print_children(level + 1, c_pfx)
-            i += 1
+    def display_children(self) -> list['BaseNode']:
+        return self.children
 
     def aggregate_resources(self, aggregate: ResourceAggregate):
         aggregate.add(ResourceQuantity(self.production.product, self.rpm), self.recipe)
@@ -224,15 +295,30 @@ class ProductionTree:
 
     def __init__(self, root_recipe: Recipe, target_product: Resource, target_rpm: float):
         self.root = ProdNode(root_recipe, root_recipe.production(target_product), target_rpm, None, self)
+        self.monitor: typing.Optional[BuildMonitor] = None
+        self.stats: typing.Optional[PlanStats] = None
 
-    def build(self, repository: RecipeRepository, max_depth: int = 15, excluded_recipes=None):
+    def build(self, repository: RecipeRepository, max_depth: int = 15, excluded_recipes=None,
+              monitor: typing.Optional[BuildMonitor] = None, stats: typing.Optional[PlanStats] = None):
+        # raises BuildCancelled if the monitor was cancelled while building
         if excluded_recipes is None:
             excluded_recipes = set()
-        self.root.resolve_children(repository, 0, max_depth, set(), excluded_recipes)
-
-    def print_tree(self):
-        self.root.print_node()
-        self.root.print_children(0, '')
+        self.monitor = monitor
+        self.stats = stats
+        if stats is not None:
+            stats.prod_nodes += 1
+        try:
+            with timed(stats, 'build'):
+                self.root.resolve_children(repository, 0, max_depth, set(), excluded_recipes)
+        finally:
+            self.monitor = None
+            self.stats = None
+
+    def print_tree(self, out: typing.Optional[typing.TextIO] = None, max_depth: typing.Optional[int] = None,
+                   max_width: typing.Optional[int] = None, collapse: bool = False):
+        # imported here as render depends on this module
+        from render import TreeRenderer
+        TreeRenderer(out, max_depth, max_width, collapse).render(self)
 
     def get_aggregate(self) -> ResourceAggregate:
         aggregate = ResourceAggregate()
@@ -240,6 +326,152 @@ class ProductionTree:
 
         return aggregate
 
+    def reset_alternatives(self):
+        stack: list[BaseNode] = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, AltNode):
+                node.active_slot = 0
+                stack.extend(node.slots)
+            elif isinstance(node, ProdNode):
+                stack.extend(node.children)
+
+
+def active_alternatives(tree: ProductionTree) -> list[AltNode]:
+    # alternatives with more than one recipe which are part of the plan, i.e. not below an inactive recipe
+    result = []
+    stack: list[BaseNode] = [tree.root]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, AltNode):
+            if len(node.slots) > 1:
+                result.append(node)
+            if node.active is not None:
+                stack.append(node.active)
+        elif isinstance(node, ProdNode):
+            stack.extend(reversed(node.children))
+    return result
+
+
+def _active_depth(node: ProdNode) -> Optional[int]:
+    # depth of the node in the plan (recipe nodes above it), None if it is below an inactive recipe
+    depth = 0
+    while node.parent is not None:
+        alternatives = node.parent
+        if alternatives.active is not node:
+            return None
+        node = alternatives.parent
+        depth += 1
+    return depth
+
+
+def reachable_products(tree: ProductionTree) -> set[str]:
+    # ids of all products for which recipes were looked up while building the tree, including inactive alternatives
+    products = set()
+    stack: list[BaseNode] = [tree.root]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, AltNode):
+            products.add(node.product.id)
+            stack.extend(node.slots)
+        elif isinstance(node, ProdNode):
+            stack.extend(node.children)
+        elif isinstance(node, EndNode):
+            products.add(node.resource.resource.id)
+    return products
+
+
+def rescaled_tree(tree: ProductionTree, rpm: float, dropped: Collection[str] = (),
+                  monitor: typing.Optional[BuildMonitor] = None) -> ProductionTree:
+    # Copy of the tree for another target RPM, without the alternatives of the dropped recipes (an alternative left
+    # without recipes becomes an end node). The structure and active alternatives are kept and the quantities are
+    # computed from the recipes as when building, so the result equals a tree built with the dropped recipes excluded.
+    # Raises BuildCancelled if the monitor is cancelled.
+    root = tree.root
+    copy = ProductionTree(root.recipe, root.production.product, rpm)
+    stack: list[tuple[ProdNode, ProdNode]] = [(root, copy.root)]
+    while len(stack) > 0:
+        source, target = stack.pop()
+        if len(source.children) == 0:
+            continue
+        if monitor is not None and monitor.cancelled:
+            raise BuildCancelled()
+        for child, dependency in zip(source.children, target.production.for_rpm(target.rpm).resources):
+            if isinstance(child, EndNode):
+                target.children.append(EndNode(dependency, target, copy, child.end_type))
+                continue
+            alternatives = AltNode(child.product, target, copy)
+            active = child.active
+            for slot in child.slots:
+                if slot.recipe.id in dropped:
+                    continue
+                node = ProdNode(slot.recipe, slot.production, dependency.quantity, None, copy)
+                if slot is active:
+                    alternatives.active_slot = len(alternatives.slots)
+                alternatives.add(node)
+                stack.append((slot, node))
+            if len(alternatives.slots) > 0:
+                target.children.append(alternatives)
+            else:
+                target.children.append(EndNode(dependency, target, copy))
+    return copy
+
+
+def extend_tree(tree: ProductionTree, repository: RecipeRepository, recipes: Collection[str], max_depth: int,
+                excluded_recipes: Collection[str] = (), monitor: typing.Optional[BuildMonitor] = None) -> int:
+    # Adds the given recipes, which were excluded when the tree was built, as alternatives wherever building would have
+    # used them, and builds their subtrees. Returns the number of alternatives added. Raises BuildCancelled if the
+    # monitor is cancelled, the tree is left partially extended then.
+    # (node, level, recipes of its ancestors) of all nodes whose children were resolved
+    stack: list[tuple[ProdNode, int, frozenset[str]]] = [(tree.root, 0, frozenset())]
+    insertions = []
+    while len(stack) > 0:
+        node, level, parents = stack.pop()
+        if monitor is not None and monitor.cancelled:
+            raise BuildCancelled()
+        child_parents = parents | {node.recipe.id}
+        for index, (child, dependency) in enumerate(zip(node.children, node.production.for_rpm(node.rpm).resources)):
+            present = {slot.recipe.id for slot in child.slots} if isinstance(child, AltNode) else ()
+            added = [recipe for recipe in repository.find_recipes_by_product(dependency.resource)
+                     if recipe.id in recipes and recipe.id not in parents and recipe.id not in excluded_recipes
+                     and recipe.id not in present]
+            if len(added) > 0:
+                insertions.append((node, index, dependency, added, level, child_parents))
+            if isinstance(child, AltNode) and level < max_depth:
+                stack.extend((slot, level + 1, child_parents) for slot in child.slots)
+
+    # the subtrees of the added recipes are built with the monitor, as by ProductionTree.build
+    tree.monitor = monitor
+    try:
+        _insert_alternatives(tree, repository, insertions, max_depth, excluded_recipes)
+    finally:
+        tree.monitor = None
+    return sum(len(added) for _, _, _, added, _, _ in insertions)
+
+
+def _insert_alternatives(tree: ProductionTree, repository: RecipeRepository, insertions: list, max_depth: int,
+                         excluded_recipes: Collection[str]):
+    for node, index, dependency, added, level, child_parents in insertions:
+        child = node.children[index]
+        if isinstance(child, AltNode):
+            alternatives = child
+            # only a recipe switched to is kept active, otherwise the first one is as when building
+            active = child.active if child.active_slot != 0 else None
+        else:
+            alternatives = AltNode(dependency.resource, node, tree)
+            node.children[index] = alternatives
+            active = None
+        for recipe in added:
+            slot = ProdNode(recipe, recipe.production(dependency.resource), dependency.quantity, None, tree)
+            if level < max_depth:
+                slot.resolve_children(repository, level + 1, max_depth, set(child_parents), set(excluded_recipes))
+            alternatives.add(slot)
+        # same order as when building: by the repository's order, then sorted
+        order = {recipe.id: i for i, recipe in enumerate(repository.find_recipes_by_product(dependency.resource))}
+        alternatives.slots.sort(key=lambda slot: order[slot.recipe.id])
+        alternatives.sort()
+        alternatives.active_slot = alternatives.slots.index(active) if active is not None else 0
+
 
 #----------------------------------------------------------------------------------------------------------------------#
 #   Graph                                                                                                              #
@@ -284,11 +516,14 @@ class GraphNode:
             if int_scale:
                 self.recipe.ceil_scale()
 
-    def update_scale_rec(self, level: int, max_level: int=20, int_scale=False):
+    def update_scale_rec(self, level: int, max_level: int=20, int_scale=False,
+                         stats: typing.Optional[PlanStats] = None):
         self.update_scale(int_scale)
+        if stats is not None:
+            stats.scale_visits += 1
         if level < max_level:
             for producer in self.producers.values():
-                producer.update_scale_rec(level + 1, max_level=max_level, int_scale=int_scale)
+                producer.update_scale_rec(level + 1, max_level=max_level, int_scale=int_scale, stats=stats)
 
     def set_scale(self, scale: float):
         self.recipe.scale = max(scale, 1.0)
@@ -304,53 +539,566 @@ class GraphNode:
 
 
 class ProductionGraph:
-    __slots__ = ('nodes', 'root', 'integer_scales', 'root_product')
+    __slots__ = ('nodes', 'root', 'roots', 'integer_scales', 'root_product', 'targets', 'stats',
+                 '_product_consumers', '_depths', '_edges')
 
     def __init__(self, root_recipe: Recipe, scale: float, target_product: Optional[Resource]):
         root_node = GraphNode(ScaledRecipe(root_recipe, scale), 0)
         self.root_product = target_product
         self.nodes: dict[str, GraphNode] = {root_recipe.id: root_node}
         self.root = root_node
+        self.roots: list[GraphNode] = [root_node]
+        # product id -> requested RPM of each end product
+        self.targets: dict[str, float] = dict()
+        if target_product is not None:
+            self.targets[target_product.id] = scale * root_recipe.scaled(1.0).products[target_product.id].quantity
         self.integer_scales = False
+        # counts scale calculations if set
+        self.stats: Optional[PlanStats] = None
+        # resource id -> nodes consuming it, built lazily and dropped when nodes are added
+        self._product_consumers: Optional[dict[str, list[GraphNode]]] = None
+        # Occurrences of the recipes in the tree the graph was converted from: recipe id -> {depth: count} and
+        # (producer id, consumer id) -> count. They allow to update the graph when a part of the tree is replaced.
+        self._depths: dict[str, dict[int, int]] = {root_recipe.id: {0: 1}}
+        self._edges: dict[tuple[str, str], int] = dict()
+
+    def is_target(self, product_id: str) -> bool:
+        return product_id in self.targets
 
     def add_recipe(self, recipe: Recipe, consumer: GraphNode, level: int) -> GraphNode:
+        node = self._add_occurrence(recipe, consumer, level)
+        node.update_scale(self.integer_scales)
+        if self.stats is not None:
+            self.stats.scale_visits += 1
+        return node
+
+    def _add_occurrence(self, recipe: Recipe, consumer: GraphNode, level: int) -> GraphNode:
         recipe_id = recipe.id
         if recipe_id not in self.nodes:
             node = GraphNode(ScaledRecipe(recipe, 1.0), level)
             self.nodes[recipe_id] = node
+            self._product_consumers = None
         else:
             node = self.nodes[recipe_id]
             if level < node.level:
                 node.level = level
         node.register_consumer(consumer)
-        node.update_scale(self.integer_scales)
+        depths = self._depths.setdefault(recipe_id, dict())
+        depths[level] = depths.get(level, 0) + 1
+        edge = (recipe_id, consumer.recipe_id())
+        self._edges[edge] = self._edges.get(edge, 0) + 1
         return node
 
+    def _remove_occurrence(self, recipe_id: str, consumer_id: str, level: int):
+        depths = self._depths[recipe_id]
+        depths[level] -= 1
+        if depths[level] == 0:
+            del depths[level]
+        node = self.nodes[recipe_id]
+        edge = (recipe_id, consumer_id)
+        self._edges[edge] -= 1
+        if self._edges[edge] == 0:
+            del self._edges[edge]
+            consumer = node.consumers.pop(consumer_id)
+            consumer.producers.pop(recipe_id, None)
+        if len(depths) == 0:
+            del self._depths[recipe_id]
+            del self.nodes[recipe_id]
+            self._product_consumers = None
+        else:
+            node.level = min(depths)
+
+    def replace_subtree(self, consumer: ProdNode, old: ProdNode, new: ProdNode, level: int) -> set[str]:
+        # Replaces the recipes of the tree below old, consumed by consumer at the given depth, by those below new.
+        # Returns the ids of the recipes which are still in the graph and whose consumers changed.
+        changed = set()
+        stack = [(old, consumer.recipe.id, level)]
+        while len(stack) > 0:
+            node, consumer_id, depth = stack.pop()
+            self._remove_occurrence(node.recipe.id, consumer_id, depth)
+            changed.add(node.recipe.id)
+            stack.extend((child.active, node.recipe.id, depth + 1) for child in node.children
+                         if isinstance(child, AltNode) and child.active is not None)
+        stack = [(new, self.nodes[consumer.recipe.id], level)]
+        while len(stack) > 0:
+            node, consumer_node, depth = stack.pop()
+            graph_node = self._add_occurrence(node.recipe, consumer_node, depth)
+            changed.add(node.recipe.id)
+            stack.extend((child.active, graph_node, depth + 1) for child in node.children
+                         if isinstance(child, AltNode) and child.active is not None)
+        return {recipe_id for recipe_id in changed if recipe_id in self.nodes}
+
+    def rescale(self, changed: Iterable[str]):
+        # Recalculates the scales of the given recipes and all recipes producing for them, consumers before their
+        # producers. Scales of roots are kept.
+        affected = set()
+        stack = [self.nodes[recipe_id] for recipe_id in changed]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.recipe_id() not in affected:
+                affected.add(node.recipe_id())
+                stack.extend(node.producers.values())
+        # number of affected consumers which were not rescaled yet
+        pending = {recipe_id: sum(1 for consumer_id in self.nodes[recipe_id].consumers if consumer_id in affected)
+                   for recipe_id in affected}
+        ready = [recipe_id for recipe_id, count in pending.items() if count == 0]
+        ordered = []
+        while len(ready) > 0:
+            recipe_id = ready.pop()
+            ordered.append(self.nodes[recipe_id])
+            for producer_id in self.nodes[recipe_id].producers:
+                pending[producer_id] -= 1
+                if pending[producer_id] == 0:
+                    ready.append(producer_id)
+        if len(ordered) < len(affected):
+            # cyclic dependencies, all scales are calculated again
+            for node in self.nodes.values():
+                if node not in self.roots:
+                    node.recipe.scale = 1.0
+            self.update_scales()
+            return
+        for node in ordered:
+            if node not in self.roots:
+                node.recipe.scale = 1.0
+                node.update_scale(self.integer_scales)
+                if self.stats is not None:
+                    self.stats.scale_visits += 1
+
+    def product_consumers(self, product_id: str) -> list[GraphNode]:
+        if self._product_consumers is None:
+            index: dict[str, list[GraphNode]] = dict()
+            for node in self.nodes.values():
+                for resource_id in node.recipe.recipe.resources.keys():
+                    index.setdefault(resource_id, []).append(node)
+            self._product_consumers = index
+        return self._product_consumers.get(product_id, [])
+
+    def consumers_of(self, producer: GraphNode, product_id: str) -> list[GraphNode]:
+        # consumers of the producer which use the given product of it
+        return [node for node in self.product_consumers(product_id) if node.recipe_id() in producer.consumers]
+
     def update_scales(self):
-        self.root.update_scale_rec(0, int_scale=self.integer_scales)
+        with timed(self.stats, 'scale'):
+            for root in self.roots:
+                root.update_scale_rec(0, int_scale=self.integer_scales, stats=self.stats)
 
     def as_list(self) -> list[GraphNode]:
         result = list(self.nodes.values())
         result.sort(key=lambda node: node.level)
         return result
 
+    def external_inputs(self) -> ResourceQuantities:
+        produced = set()
+        for node in self.nodes.values():
+            produced.update(node.recipe.recipe.products.keys())
+        inputs = ResourceQuantities([])
+        for node in self.nodes.values():
+            for res_id, res_qt in node.recipe.scaled_components().resources.pairs():
+                if res_id not in produced:
+                    inputs.add(res_qt)
+        return inputs
+
 
-def _add_tree_node(graph: ProductionGraph, tree_node: BaseNode,  consumer_node: GraphNode, level: int):
+def _add_tree_node(graph: ProductionGraph, tree_node: BaseNode,  consumer_node: GraphNode, level: int,
+                   monitor: Optional[BuildMonitor] = None):
     if isinstance(tree_node, ProdNode):
+        if monitor is not None and monitor.cancelled:
+            raise BuildCancelled()
         current_node = graph.add_recipe(tree_node.recipe, consumer_node, level)
         for child_tree_node in tree_node:
-            _add_tree_node(graph, child_tree_node, current_node, level + 1)
+            _add_tree_node(graph, child_tree_node, current_node, level + 1, monitor)
     elif isinstance(tree_node, AltNode):
-        _add_tree_node(graph, tree_node.active, consumer_node, level)
+        _add_tree_node(graph, tree_node.active, consumer_node, level, monitor)
     elif isinstance(tree_node, EndNode):
         pass
 
 
-def convert_to_graph(tree: ProductionTree, target_product: Optional[Resource]) -> ProductionGraph:
+def switch_alternative(tree: ProductionTree, graph: ProductionGraph, product_id: str, recipe_id: str) -> int:
+    # Makes the recipe the active one for the product wherever it is an alternative in the plan, and updates the graph
+    # converted from the tree: only the recipes of the replaced subtrees are changed and only the recipes producing for
+    # them are rescaled. Returns the number of switched alternatives.
+    switched = 0
+    changed: set[str] = set()
+    while True:
+        # switching can make other alternatives of the product part of the plan
+        pending = [node for node in active_alternatives(tree) if node.product.id == product_id
+                   and node.active.recipe.id != recipe_id and any(slot.recipe.id == recipe_id for slot in node.slots)]
+        if len(pending) == 0:
+            break
+        for node in pending:
+            consumer = node.parent
+            depth = _active_depth(consumer)
+            if depth is None:
+                continue
+            old = node.active
+            node.active_slot = next(i for i, slot in enumerate(node.slots) if slot.recipe.id == recipe_id)
+            changed.update(graph.replace_subtree(consumer, old, node.active, depth + 1))
+            switched += 1
+    if switched > 0:
+        graph.rescale(recipe for recipe in changed if recipe in graph.nodes)
+    return switched
+
+
+def convert_to_graph(tree: ProductionTree, target_product: Optional[Resource],
+                     stats: Optional[PlanStats] = None, monitor: Optional[BuildMonitor] = None) -> ProductionGraph:
+    # the graph keeps counting scale calculations into stats; raises BuildCancelled if the monitor is cancelled
     scale = tree.root.rpm / tree.root.production.base_rpm
     graph = ProductionGraph(tree.root.recipe, scale, target_product)
-    for node in tree.root:
-        _add_tree_node(graph, node, graph.root, 1)
+    graph.stats = stats
+    with timed(stats, 'convert'):
+        for node in tree.root:
+            _add_tree_node(graph, node, graph.root, 1, monitor)
 
     graph.update_scales()
+    if stats is not None:
+        stats.count_graph(graph)
+    return graph
+
+
+class PlanTarget:
+    __slots__ = ('product', 'rpm')
+
+    def __init__(self, product: Resource, rpm: float):
+        self.product = product
+        self.rpm = rpm
+
+    def __repr__(self):
+        return f'PlanTarget[{self.rpm:.1f}x "{self.product.name}"]'
+
+
+class _BatchPlanner:
+
+    def __init__(self, repository: RecipeRepository, excluded_recipes: set[str], max_depth: int):
+        self.repository = repository
+        self.excluded_recipes = excluded_recipes
+        self.max_depth = max_depth
+        # product id -> selected recipe (None: external input)
+        self.selection: dict[str, Optional[Recipe]] = dict()
+        # recipe id -> (recipe, product ids it is selected for)
+        self.recipes: dict[str, tuple[Recipe, set[str]]] = dict()
+        # recipe id -> {input product id -> producing recipe id}
+        self.producers: dict[str, dict[str, str]] = dict()
+        self.visited: set[str] = set()
+
+    def select(self, product: Resource) -> Optional[Recipe]:
+        if product.id in self.selection:
+            return self.selection[product.id]
+        recipe = None
+        # same order as AltNode.sort('stations'): highest output first
+        candidates = [r for r in self.repository.find_recipes_by_product(product) if r.id not in self.excluded_recipes]
+        if len(candidates) > 0:
+            recipe = max(candidates, key=lambda r: r.production(product).get_base_rpm())
+        self.selection[product.id] = recipe
+        return recipe
+
+    def expand(self, recipe: Recipe, product: Resource):
+        # iterative DFS expanding every recipe once; a selected recipe already on the current path is treated as an
+        # external input to break loops
+        self.recipes.setdefault(recipe.id, (recipe, set()))[1].add(product.id)
+        if recipe.id in self.visited:
+            return
+        self.visited.add(recipe.id)
+        on_path = {recipe.id}
+        stack = [(recipe, 0, iter(recipe.resources))]
+        while len(stack) > 0:
+            current, depth, dependencies = stack[-1]
+            dependency = next(dependencies, None)
+            if dependency is None:
+                stack.pop()
+                on_path.discard(current.id)
+                continue
+            if depth >= self.max_depth:
+                continue
+            producer = self.select(dependency.resource)
+            if producer is None or producer.id in on_path:
+                continue
+            self.producers.setdefault(current.id, dict())[dependency.resource.id] = producer.id
+            self.recipes.setdefault(producer.id, (producer, set()))[1].add(dependency.resource.id)
+            if producer.id not in self.visited:
+                self.visited.add(producer.id)
+                on_path.add(producer.id)
+                stack.append((producer, depth + 1, iter(producer.resources)))
+
+    def topological_order(self) -> list[str]:
+        consumer_count = {recipe_id: 0 for recipe_id in self.recipes}
+        for consumer_id, inputs in self.producers.items():
+            for producer_id in set(inputs.values()):
+                consumer_count[producer_id] += 1
+        ready = [recipe_id for recipe_id, count in consumer_count.items() if count == 0]
+        order = []
+        while len(ready) > 0:
+            recipe_id = ready.pop()
+            order.append(recipe_id)
+            for producer_id in set(self.producers.get(recipe_id, dict()).values()):
+                consumer_count[producer_id] -= 1
+                if consumer_count[producer_id] == 0:
+                    ready.append(producer_id)
+        return order
+
+
+def build_batch_graph(repository: RecipeRepository, targets: list[PlanTarget], excluded_recipes: Optional[set[str]] = None,
+                      max_depth: int = 15, integer_scales: bool = False) -> ProductionGraph:
+    # one graph for all targets: each product gets one recipe, demands of shared intermediates are summed and every
+    # recipe is expanded and scaled exactly once
+    if len(targets) == 0:
+        raise ValueError('at least one target is required')
+    planner = _BatchPlanner(repository, excluded_recipes if excluded_recipes is not None else set(), max_depth)
+    demands: dict[str, float] = dict()
+    target_recipes = []
+    for target in targets:
+        recipe = planner.select(target.product)
+        if recipe is None:
+            raise ValueError(f'no recipe for target product "{target.product.name}"')
+        demands[target.product.id] = demands.get(target.product.id, 0.0) + target.rpm
+        target_recipes.append((recipe, target))
+        planner.expand(recipe, target.product)
+
+    consumed = set()
+    for inputs in planner.producers.values():
+        consumed.update(inputs.values())
+
+    scales: dict[str, float] = dict()
+    for recipe_id in planner.topological_order():
+        recipe, products = planner.recipes[recipe_id]
+        base = recipe.scaled(1.0)
+        scale = 0.0
+        for product_id in products:
+            scale = max(scale, demands.get(product_id, 0.0) / base.products[product_id].quantity)
+        scaled = ScaledRecipe(recipe, scale)
+        if recipe_id in consumed:
+            scaled.scale = max(scaled.scale, 1.0)
+            if integer_scales:
+                scaled.ceil_scale()
+        scales[recipe_id] = scaled.scale
+        for res_id, res_qt in base.resources.pairs():
+            if res_id in planner.producers.get(recipe_id, dict()):
+                demands[res_id] = demands.get(res_id, 0.0) + res_qt.quantity * scaled.scale
+
+    first_recipe, first_target = target_recipes[0]
+    graph = ProductionGraph(first_recipe, scales[first_recipe.id], first_target.product)
+    graph.integer_scales = integer_scales
+    graph.targets = dict()
+    for recipe_id, (recipe, _) in planner.recipes.items():
+        if recipe_id not in graph.nodes:
+            graph.nodes[recipe_id] = GraphNode(ScaledRecipe(recipe, scales[recipe_id]), 0)
+    for recipe, target in target_recipes:
+        graph.targets[target.product.id] = graph.targets.get(target.product.id, 0.0) + target.rpm
+        node = graph.nodes[recipe.id]
+        if node not in graph.roots:
+            graph.roots.append(node)
+    for consumer_id, inputs in planner.producers.items():
+        consumer = graph.nodes[consumer_id]
+        for producer_id in set(inputs.values()):
+            graph.nodes[producer_id].register_consumer(consumer)
+
+    # level: shortest distance from any target recipe
+    levels = {node.recipe_id(): 0 for node in graph.roots}
+    queue = list(graph.roots)
+    for node in queue:
+        for producer in node.producers.values():
+            if producer.recipe_id() not in levels:
+                levels[producer.recipe_id()] = levels[node.recipe_id()] + 1
+                queue.append(producer)
+    for recipe_id, node in graph.nodes.items():
+        node.level = levels.get(recipe_id, 0)
     return graph
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Alternatives                                                                                                       #
+#----------------------------------------------------------------------------------------------------------------------#
+
+class PlanAlternative:
+    __slots__ = ('stations', 'raw_input', 'recipes', 'choices')
+
+    def __init__(self, stations: float, raw_input: float, recipes: frozenset[str], choices: tuple[int, ...]):
+        self.stations = stations
+        self.raw_input = raw_input
+        self.recipes = recipes
+        self.choices = choices
+
+    @property
+    def recipe_count(self) -> int:
+        return len(self.recipes)
+
+    def metrics(self) -> tuple[float, float, int]:
+        return self.stations, self.raw_input, len(self.recipes)
+
+    def dominates(self, other: 'PlanAlternative') -> bool:
+        mine = self.metrics()
+        theirs = other.metrics()
+        return all(a <= b + 1e-9 for a, b in zip(mine, theirs)) and any(a < b - 1e-9 for a, b in zip(mine, theirs))
+
+    def combine(self, other: 'PlanAlternative', factor: float) -> 'PlanAlternative':
+        return PlanAlternative(self.stations + factor * other.stations,
+                               self.raw_input + factor * other.raw_input,
+                               self.recipes | other.recipes,
+                               self.choices + other.choices)
+
+    def scaled(self, factor: float) -> 'PlanAlternative':
+        return PlanAlternative(self.stations * factor, self.raw_input * factor, self.recipes, self.choices)
+
+    def __repr__(self):
+        return f'PlanAlternative[stations={self.stations:.2f} raw={self.raw_input:.2f} recipes={len(self.recipes)}]'
+
+
+# Enumerates assignments of AltNode.active_slot over an already built tree. Candidates are calculated per unit of a
+# node's RPM, so identical subtrees (same recipes and structure, regardless of their RPM) share one cached result.
+# Stations and raw input of subtrees add up, but their recipe sets are merged, so a subtree's candidates are only pruned
+# if they are worse in every plan containing them (see covers); the final ranking and the limit are applied to the
+# plans of the root. Both the top k and the Pareto frontier are exact. Recipes used by a single node of the tree
+# (local recipes) cannot be merged with those of another subtree, which lets covers compare their counts instead of
+# requiring the sets to be contained in each other.
+class _AlternativeSearch:
+
+    def __init__(self, k: int, mode: str, limit: typing.Optional[int], monitor: typing.Optional[BuildMonitor]):
+        if mode not in ('top', 'pareto'):
+            raise ValueError(f'invalid alternative search mode: {mode}')
+        self.k = k
+        self.mode = mode
+        self.limit = limit
+        self.monitor = monitor
+        # recipes used by more than one node of the tree
+        self.shared: frozenset[str] = frozenset()
+        self.signatures: dict[tuple, int] = dict()
+        self.cache: dict[int, list[PlanAlternative]] = dict()
+
+    def covers(self, kept: PlanAlternative, candidate: PlanAlternative) -> bool:
+        # kept is strictly better than candidate in every plan containing either of them: both add their stations and
+        # raw input to the rest of the plan, kept needs no more of either and less of one. The top k are ranked by
+        # stations and raw input first, for the Pareto frontier kept must also need no more recipes in any plan: the
+        # rest of a plan can only contain shared recipes of candidate, so those kept lacks do not count for candidate.
+        if not (kept.stations <= candidate.stations + 1e-9 and kept.raw_input <= candidate.raw_input + 1e-9
+                and (kept.stations < candidate.stations - 1e-9 or kept.raw_input < candidate.raw_input - 1e-9)):
+            return False
+        if self.mode == 'top' or kept.recipes <= candidate.recipes:
+            return True
+        added = len((kept.recipes & self.shared) - candidate.recipes) + len(kept.recipes - self.shared)
+        return added <= len(candidate.recipes - self.shared)
+
+    def count_recipes(self, root: ProdNode):
+        nodes: dict[str, int] = dict()
+        stack: list[BaseNode] = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, ProdNode):
+                nodes[node.recipe.id] = nodes.get(node.recipe.id, 0) + 1
+                stack.extend(node.children)
+            elif isinstance(node, AltNode):
+                stack.extend(node.slots)
+        self.shared = frozenset(recipe_id for recipe_id, count in nodes.items() if count > 1)
+
+    def prune(self, candidates: list[PlanAlternative]) -> list[PlanAlternative]:
+        # drops candidates covered by k others (top) or by one other (pareto)
+        required = self.k if self.mode == 'top' else 1
+        kept = []
+        for candidate in sorted(candidates, key=PlanAlternative.metrics):
+            covering = 0
+            for other in kept:
+                if self.covers(other, candidate):
+                    covering += 1
+                    if covering >= required:
+                        break
+            if covering < required:
+                kept.append(candidate)
+        return kept
+
+    def select(self, candidates: list[PlanAlternative]) -> list[PlanAlternative]:
+        # final ranking of the complete plans
+        candidates = sorted(candidates, key=PlanAlternative.metrics)
+        if self.mode == 'top':
+            return candidates[:self.k]
+        frontier = []
+        for candidate in candidates:
+            if not any(kept.dominates(candidate) for kept in frontier):
+                frontier.append(candidate)
+        if self.limit is not None:
+            return frontier[:self.limit]
+        return frontier
+
+    def signature(self, node: BaseNode) -> int:
+        if isinstance(node, ProdNode):
+            sig = ('P', node.recipe.id, node.production.product.id, tuple(self.signature(c) for c in node.children))
+        elif isinstance(node, AltNode):
+            sig = ('A', tuple(self.signature(s) for s in node.slots))
+        else:
+            sig = ('E',)
+        sig_id = self.signatures.get(sig, None)
+        if sig_id is None:
+            sig_id = len(self.signatures)
+            self.signatures[sig] = sig_id
+        return sig_id
+
+    def candidates(self, node: BaseNode) -> list[PlanAlternative]:
+        sig_id = self.signature(node)
+        cached = self.cache.get(sig_id, None)
+        if cached is not None:
+            return cached
+        if self.monitor is not None and self.monitor.cancelled:
+            raise BuildCancelled()
+
+        if isinstance(node, AltNode):
+            results = []
+            for i, slot in enumerate(node.slots):
+                for candidate in self.candidates(slot):
+                    results.append(PlanAlternative(candidate.stations, candidate.raw_input, candidate.recipes,
+                                                   (i,) + candidate.choices))
+            results = self.prune(results)
+        elif isinstance(node, ProdNode):
+            source = 1.0 if len(node.production.resources) == 0 else 0.0
+            results = [PlanAlternative(1 / node.production.base_rpm, source, frozenset((node.recipe.id,)), ())]
+            for dependency, child in zip(node.production.resources, node.children):
+                if isinstance(child, EndNode):
+                    results = [PlanAlternative(r.stations, r.raw_input + dependency.quantity, r.recipes, r.choices)
+                               for r in results]
+                else:
+                    child_candidates = self.candidates(child)
+                    results = self.prune([r.combine(c, dependency.quantity)
+                                          for r in results for c in child_candidates])
+        else:
+            results = [PlanAlternative(0.0, 1.0, frozenset(), ())]
+
+        self.cache[sig_id] = results
+        return results
+
+
+def find_alternatives(tree: ProductionTree, k: int = 5, mode: str = 'top', limit: typing.Optional[int] = None,
+                      monitor: typing.Optional[BuildMonitor] = None) -> list[PlanAlternative]:
+    # k best assignments (mode='top') or the Pareto frontier (mode='pareto') over (stations, raw input, recipe count).
+    # Station counts are not rounded to integers here. Raises BuildCancelled if the monitor is cancelled.
+    search = _AlternativeSearch(k, mode, limit, monitor)
+    if mode == 'pareto':
+        search.count_recipes(tree.root)
+    return [c.scaled(tree.root.rpm) for c in search.select(search.candidates(tree.root))]
+
+
+def apply_alternative(tree: ProductionTree, alternative: PlanAlternative):
+    choices = iter(alternative.choices)
+
+    def _apply(node: BaseNode):
+        if isinstance(node, AltNode):
+            node.active_slot = next(choices)
+            _apply(node.active)
+        elif isinstance(node, ProdNode):
+            for child in node.children:
+                _apply(child)
+
+    _apply(tree.root)
+
+
+def alternative_selections(tree: ProductionTree, alternative: PlanAlternative) -> list[tuple[Resource, Recipe]]:
+    choices = iter(alternative.choices)
+    selections: dict[tuple[str, str], tuple[Resource, Recipe]] = dict()
+
+    def _collect(node: BaseNode):
+        if isinstance(node, AltNode):
+            slot = node.slots[next(choices)]
+            if len(node.slots) > 1:
+                selections.setdefault((node.product.id, slot.recipe.id), (node.product, slot.recipe))
+            _collect(slot)
+        elif isinstance(node, ProdNode):
+            for child in node.children:
+                _collect(child)
+
+    _collect(tree.root)
+    return list(selections.values())
@@ -1,32 +1,19 @@
-import readline
+import json
+import os
 import shlex
+import sys
 import typing
 from abc import ABC, abstractmethod
-from argparse import ArgumentParser, ArgumentError
-from collections.abc import Iterator, Callable
+from argparse import ArgumentParser, ArgumentError, REMAINDER
+from collections.abc import Iterator, Iterable, Callable
 from datetime import timedelta
-from symtable import Function
-from typing import Any
 
 import chaining
 import repository
 from chaining import ProductionTree
 from config import MainConfig
 from data import Resource
-from repository import RecipeRepository, DuplicateKeyError, RecipeBuilder
-
-
-def generate_id(name: str) -> str:
-    return name.lower().replace(' ', '_') \
-        .replace('(', '') \
-        .replace(')', '') \
-        .replace('[', '') \
-        .replace(']', '') \
-        .replace('{', '') \
-        .replace('}', '') \
-        .replace('"', '') \
-        .replace("'", '') \
-        .replace('__', '_')
+from repository import RecipeRepository, DuplicateKeyError, InvalidDataError, ReadOnlyError, RecipeBuilder, generate_id
 
 
 class ObjectStub:
@@ -50,29 +37,56 @@ class ObjectStub:
         return f'ObjectStub[id={self.id} name={self.name}]'
 
 
-def noopt() -> Any:
-    pass
+class CommandExit(Exception):
+    # raised instead of exiting the process when argparse is done with a command line, e.g. after printing the help
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+def parser_exit(status: int = 0, message: typing.Optional[str] = None):
+    if message:
+        sys.stderr.write(message)
+    raise CommandExit(status)
 
 
 class CliCommand(ABC):
 
-    def __init__(self, config: MainConfig, parser: ArgumentParser):
+    def __init__(self, config: MainConfig):
         self.main_config = config
-        self.parser = parser
-        self.parser.exit_on_error = False
-        self.parser.exit = noopt
+        self._parser: typing.Optional[ArgumentParser] = None
 
     @abstractmethod
     def command_name(self) -> str:
         pass
 
+    @abstractmethod
+    def build_parser(self) -> ArgumentParser:
+        pass
+
+    @property
+    def parser(self) -> ArgumentParser:
+        # parsers are only built when a command is used for the first time
+        if self._parser is None:
+            self._parser = self.build_parser()
+            self._parser.exit_on_error = False
+            self._parser.exit = parser_exit
+            self._parser.error = self._parse_error
+        return self._parser
+
+    def _parse_error(self, message: str):
+        # argparse would otherwise continue with a partially parsed namespace as exit() is disabled
+        self.parser.print_usage()
+        raise ArgumentError(None, message)
+
     def parse_arguments(self, arg_str: str):
         if self.main_config.debug:
             print(f'{self.command_name()}: invoked with "{arg_str}"')
         return self.parser.parse_args(shlex.split(arg_str))
 
     @abstractmethod
-    def execute(self, command_str: str):
+    def execute(self, command_str: str) -> typing.Optional[bool]:
+        # returns False if the command failed
         pass
 
 
@@ -83,14 +97,16 @@ class AddResourceCommand(CliCommand):
         return AddResourceCommand.cmd_name
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=AddResourceCommand.cmd_name)
         parser.add_argument('-i', '--id', metavar='NAME', dest='resource_id', help='Set resource id.', default='')
         parser.add_argument('-r', '--raw', action='store_true', dest='is_raw',
                             help='Make resource a raw base resource.')
         parser.add_argument('name', metavar='NAME', help='Name of the resource', default='')
-
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def execute(self, command_str: str):
         args = self.parse_arguments(command_str)
@@ -104,21 +120,24 @@ class AddResourceCommand(CliCommand):
             print(f'{resource_id}: {resource}')
         except DuplicateKeyError as e:
             print(f'Failed to add resource: {e}')
+            return False
 
 
 class AddRawResourceRecipe(CliCommand):
     cmd_name = 'add-source'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=AddRawResourceRecipe.cmd_name)
         parser.add_argument('-i', '--id', metavar='NAME', dest='recipe_id', help='Set recipe id.')
         parser.add_argument('-p', '--product', help='Resource produced by executing the recipe.', nargs=2,
                             action='extend', dest='products')
         parser.add_argument('-s', '--source', metavar='NAME', dest='source_name', required=True)
         parser.add_argument('name', metavar='NAME', help='Name of the recipe.')
-
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def command_name(self) -> str:
         return AddRawResourceRecipe.cmd_name
@@ -147,7 +166,7 @@ class AddRawResourceRecipe(CliCommand):
 
         if self.repository.recipe(recipe_id) is not None:
             print(f'Error: a recipe with the id {recipe_id} already exists!')
-            return
+            return False
 
         product_stub = self.parse_resources(args.products)
         prod_name = product_stub[0].name
@@ -168,12 +187,17 @@ class AddRawResourceRecipe(CliCommand):
             print(recipe)
         except DuplicateKeyError as e:
             print(f'Failed to add recipe "{recipe_name}": {e}')
+            return False
 
 
 class AddRecipeCommand(CliCommand):
     cmd_name = 'add-recipe'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=AddRecipeCommand.cmd_name)
         parser.add_argument('-i', '--id', metavar='NAME', dest='recipe_id', help='Set recipe id.')
         parser.add_argument('-t', '--time', metavar='DURATION', dest='cycle_time',
@@ -183,9 +207,7 @@ class AddRecipeCommand(CliCommand):
         parser.add_argument('-r', '--resource', help='Resource produced by executing the recipe.', nargs='+',
                             action='extend', dest='resources')
         parser.add_argument('name', metavar='NAME', help='Name of the recipe.')
-
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def command_name(self) -> str:
         return AddRecipeCommand.cmd_name
@@ -221,7 +243,7 @@ class AddRecipeCommand(CliCommand):
 
         if self.repository.recipe(recipe_id) is not None:
             print(f'Error: a recipe with the id {recipe_id} already exists!')
-            return
+            return False
 
         time_parts: list[str] = args.cycle_time.split(':')
         time_parts.reverse()
@@ -240,10 +262,10 @@ class AddRecipeCommand(CliCommand):
 
         product_stubs = self.parse_resources(args.products)
         if len(args.products) > 0 and len(product_stubs) == 0:
-            return
+            return False
         resource_stubs = self.parse_resources(args.resources)
         if len(args.resources) > 0 and len(resource_stubs) == 0:
-            return
+            return False
 
         builder = RecipeBuilder(self.repository) \
             .cycle_time(timedelta(hours=cycle_hours, minutes=cycle_mins, seconds=cycle_secs)) \
@@ -257,7 +279,7 @@ class AddRecipeCommand(CliCommand):
                 builder.product(product, qt)
             except ArgumentError as e:
                 print(f'Error: {e.message}')
-                return
+                return False
 
         for res_spec, qt in resource_stubs:
             resource = self.repository.resource_by_name(
@@ -266,7 +288,7 @@ class AddRecipeCommand(CliCommand):
                 builder.resource(resource, qt)
             except ArgumentError as e:
                 print(f'Error: {e.message}')
-                return
+                return False
 
         recipe = builder.build()
         try:
@@ -274,6 +296,7 @@ class AddRecipeCommand(CliCommand):
             print(recipe)
         except DuplicateKeyError as e:
             print(f'Failed to add recipe "{recipe_name}": {e}')
+            return False
 
 
 class FindRecipes(CliCommand):
@@ -290,7 +313,7 @@ class FindRecipes(CliCommand):
         if args.product is not None:
             product_spec = ObjectStub.parse(args.product)
             if product_spec is None:
-                return
+                return False
             product = self.repository.resource_by_name(product_spec.name) if product_spec.name is not None \
                 else self.repository.resource(product_spec.id)
             recipes = self.repository.find_recipes_by_product(product)
@@ -310,19 +333,27 @@ class FindRecipes(CliCommand):
                 print(f'└──⏵ {production}')
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=FindRecipes.cmd_name)
         parser.add_argument('-p', '--product', metavar="NAME | @<ID>", dest='product',
                             help='Find recipes by producing product')
         parser.add_argument('-n', '--name', metavar="NAME", dest='recipe_name', help='Find recipes by name')
         parser.add_argument('-i', '--id', metavar="RECIPE_ID", dest='recipe_id', help='Find recipes by id')
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
 
 class BuildDependencyTree(CliCommand):
     cmd_name = 'tree'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
+        import render
         parser = ArgumentParser(prog=self.cmd_name)
         parser.add_argument('recipe_sel', metavar='RECIPE')
         parser.add_argument('-l', '--limit', type=int, dest='limit', default=None,
@@ -333,20 +364,41 @@ class BuildDependencyTree(CliCommand):
                             help='Target RPM of the selected product. If not set, the default RPM for the product in the recipe will be used.')
 
         parser.add_argument('-R', '--exclude', metavar='RECIPE', dest='excluded', action='extend', nargs='+', help='Exclude the recipe from the dependency tree.')
-
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        parser.add_argument('--top', metavar='K', type=int, dest='top', default=None,
+                            help='List the K best assignments of alternative recipes.')
+        parser.add_argument('--pareto', action='store_true', dest='pareto',
+                            help='List the Pareto frontier over (stations, raw input, number of recipes).')
+        parser.add_argument('--use', metavar='N', type=int, dest='use_alt', default=None,
+                            help='Display the N-th listed alternative instead of the default plan (requires --top or --pareto).')
+        parser.add_argument('--format', choices=render.FORMATS, dest='fmt', default='text',
+                            help='Output format. "json" and "jsonl" write the tree nodes, aggregated resources and '
+                                 'stages as records.')
+        parser.add_argument('--depth', metavar='N', type=int, dest='max_depth', default=None,
+                            help='Only display N levels below the root of the tree.')
+        parser.add_argument('--width', metavar='N', type=int, dest='max_width', default=None,
+                            help='Only display the first N inputs of each recipe.')
+        parser.add_argument('--collapse', action='store_true', dest='collapse',
+                            help='Display subtrees which are identical to one displayed before as a single line.')
+        parser.add_argument('--stats', action='store_true', dest='stats',
+                            help='Report node counts, pruned recipes, scale calculations and the time of each phase. '
+                                 'The tree is built even if it is cached.')
+        return parser
 
     def command_name(self) -> str:
         return self.cmd_name
 
     def execute(self, command_str: str):
+        import parallel
+        import render
 
         args = self.parse_arguments(command_str)
+        if args.use_alt is not None and args.top is None and not args.pareto:
+            print('Error: --use requires --top or --pareto')
+            return False
         recipe_sel = ObjectStub.parse(args.recipe_sel)
         if recipe_sel is None:
             print(f'invalid recipe selection: {args.recipe_sel}')
-            return
+            return False
 
         recipe = None
         if recipe_sel.name is not None:
@@ -356,26 +408,29 @@ class BuildDependencyTree(CliCommand):
 
         if recipe is None:
             print(f'Cannot find recipe "{recipe_sel}"')
-            return
+            return False
 
         exclusions = []
-        for exclusion in args.excluded:
+        for exclusion in args.excluded if args.excluded is not None else []:
             excl_sel = ObjectStub.parse(exclusion)
             if excl_sel.id is not None:
                 excl_recipe = self.repository.recipe(excl_sel.id)
             else:
                 excl_recipe = self.repository.recipe_by_name(excl_sel.name)
+            if excl_recipe is None:
+                print(f'Cannot find excluded recipe "{excl_sel}"')
+                return False
             exclusions.append(excl_recipe.id)
 
         if len(recipe.products) > 1:
             if args.product is None:
                 print(f'Error: recipe "{recipe.name}" has more than one product. Please use the option "-p PRODUCT" '
                       f'to select the product for which the production tree should be generated.')
-                return
+                return False
             product_sel = ObjectStub.parse(args.product)
             if product_sel is None:
                 print(f'Invalid product selection: {args.product}')
-                return
+                return False
             else:
                 if product_sel.name is not None:
                     product = self.repository.resource_by_name(product_sel.name)
@@ -386,84 +441,425 @@ class BuildDependencyTree(CliCommand):
 
         if product is None:
             print(f'Failed to select product')
-            return
+            return False
 
         if args.rpm is not None:
             rpm = args.rpm
         else:
             rpm = recipe.production(product).get_base_rpm()
 
-        tree = ProductionTree(recipe, product, rpm)
-        if args.limit is None:
-            tree.build(self.repository, excluded_recipes=set(exclusions))
-        else:
-            tree.build(self.repository, args.limit, excluded_recipes=set(exclusions))
+        job = parallel.PlanJob(recipe.id, product.id, rpm, exclusions, args.limit if args.limit is not None else 15)
+        stats = chaining.PlanStats() if args.stats else None
+        tree = self.main_config.plan_cache.plan_tree(self.repository, job, stats)
+
+        alternatives = None
+        if args.top is not None or args.pareto:
+            with chaining.timed(stats, 'alternatives'):
+                if args.pareto:
+                    alternatives = chaining.find_alternatives(tree, mode='pareto', limit=args.top)
+                else:
+                    alternatives = chaining.find_alternatives(tree, k=args.top)
+            if args.use_alt is not None:
+                if not 1 <= args.use_alt <= len(alternatives):
+                    print(f'Error: no alternative #{args.use_alt}, found {len(alternatives)}')
+                    return False
+                chaining.apply_alternative(tree, alternatives[args.use_alt - 1])
+
+        if args.fmt != 'text':
+            try:
+                self.write_records(tree, product, alternatives, args.fmt, stats)
+            except BrokenPipeError:
+                render.handle_broken_pipe()
+            return
 
         print('Dependency tree:')
-        tree.print_tree()
+        try:
+            with chaining.timed(stats, 'render'):
+                render.TreeRenderer(sys.stdout, args.max_depth, args.max_width, args.collapse).render(tree)
+        except BrokenPipeError:
+            render.handle_broken_pipe()
+            return
         print('\nAggregated resources:')
-        aggregate = tree.get_aggregate()
+        with chaining.timed(stats, 'aggregate'):
+            aggregate = tree.get_aggregate()
         for rtpl in aggregate.calculate_productions():
             print(f'{rtpl[0]} ({rtpl[2]:.1f}) => {rtpl[1]}  ==> {rtpl[2] * rtpl[1].base_rpm} p.m.')
 
-        graph = chaining.convert_to_graph(tree, product)
+        graph = chaining.convert_to_graph(tree, product, stats)
         graph.integer_scales = True
         graph.update_scales()
         print('\nStages & stations to build:')
         for stage in graph.as_list():
             print(f'stage {stage.level: 2}: {stage}')
 
+        if alternatives is not None:
+            print('\nAlternatives:')
+            for i, alternative in enumerate(alternatives, 1):
+                print(f'#{i}: {alternative.stations:.1f} stations, {alternative.raw_input:.1f} raw input p.m., '
+                      f'{alternative.recipe_count} recipes')
+                for product, selected in chaining.alternative_selections(tree, alternative):
+                    print(f'    {product.name} <- {selected.name}')
+
+        if stats is not None:
+            print('\nStatistics:')
+            self.print_stats(stats, job.max_depth)
+
+    @staticmethod
+    def print_stats(stats: chaining.PlanStats, max_depth: int):
+        print(f'tree nodes:      {stats.prod_nodes} recipes, {stats.alt_nodes} alternatives, {stats.end_nodes} end '
+              f'resources')
+        print(f'recipe lookups:  {stats.recipe_lookups}')
+        print(f'depth:           {stats.max_depth} (limit {max_depth}), {stats.depth_limited} recipes not expanded at '
+              f'the limit')
+        print(f'pruned recipes:  {stats.pruned_parent} already in the chain, {stats.pruned_excluded} excluded')
+        print(f'graph:           {stats.graph_nodes} stages, {stats.graph_edges} links, {stats.scale_visits} scale '
+              f'calculations')
+        print('time:            ' + ', '.join(f'{phase} {seconds * 1000:.1f}ms'
+                                              for phase, seconds in stats.times.items()))
+
+    @staticmethod
+    def write_records(tree: ProductionTree, product: Resource,
+                      alternatives: typing.Optional[list[chaining.PlanAlternative]], fmt: str,
+                      stats: typing.Optional[chaining.PlanStats] = None):
+        import render
+        writer = render.RecordWriter(sys.stdout, fmt)
+        # the aggregate is collected while the nodes are written
+        aggregate = chaining.ResourceAggregate()
+        with chaining.timed(stats, 'render'):
+            writer.section('nodes', render.tree_records(tree, aggregate))
+        writer.section('aggregate', render.aggregate_records(aggregate))
+        graph = chaining.convert_to_graph(tree, product, stats)
+        graph.integer_scales = True
+        graph.update_scales()
+        writer.section('stages', render.stage_records(graph))
+        if alternatives is not None:
+            writer.section('alternatives', render.alternative_records(tree, alternatives))
+        if stats is not None:
+            writer.section('stats', [render.stats_record(stats)])
+        writer.close()
+
+
+class BatchPlan(CliCommand):
+    cmd_name = 'batch'
+
+    def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
+        parser = ArgumentParser(prog=self.cmd_name)
+        parser.add_argument('-t', '--target', metavar=('PRODUCT', 'RPM'), dest='targets', action='append', nargs=2,
+                            default=[], help='End product and its target RPM. May be given multiple times.')
+        parser.add_argument('-f', '--file', metavar='FILE', dest='targets_file', default=None,
+                            help='Read targets from FILE, one "PRODUCT RPM" per line.')
+        parser.add_argument('-l', '--limit', type=int, dest='limit', default=15,
+                            help='Maximum dependency depth (recursion)')
+        parser.add_argument('-R', '--exclude', metavar='RECIPE', dest='excluded', action='extend', nargs='+',
+                            help='Exclude the recipe from the plan.')
+        parser.add_argument('--fractional', action='store_true', dest='fractional',
+                            help='Do not round the number of stations to integers.')
+        return parser
+
+    def command_name(self) -> str:
+        return self.cmd_name
+
+    def read_targets_file(self, path: str) -> list[list[str]]:
+        targets = []
+        with open(path, 'r') as targets_file:
+            for line in targets_file:
+                line = line.strip()
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+                targets.append(shlex.split(line))
+        return targets
+
+    def execute(self, command_str: str):
+        args = self.parse_arguments(command_str)
+        target_specs = list(args.targets)
+        if args.targets_file is not None:
+            try:
+                target_specs.extend(self.read_targets_file(args.targets_file))
+            except OSError as e:
+                print(f'Error: failed to read targets file: {e}')
+                return False
+        if len(target_specs) == 0:
+            print(f'Error: no targets given, use "-t PRODUCT RPM" or "-f FILE"')
+            return False
+
+        targets = []
+        for spec in target_specs:
+            if len(spec) != 2:
+                print(f'Error: invalid target "{" ".join(spec)}": must be specified as "<product> <rpm>"')
+                return False
+            product_sel = ObjectStub.parse(spec[0])
+            if product_sel is None:
+                return False
+            if product_sel.name is not None:
+                product = self.repository.resource_by_name(product_sel.name)
+            else:
+                product = self.repository.resource(product_sel.id)
+            if product is None:
+                print(f'Cannot find product "{product_sel}"')
+                return False
+            try:
+                targets.append(chaining.PlanTarget(product, float(spec[1])))
+            except ValueError:
+                print(f'Error: invalid RPM for "{spec[0]}": {spec[1]}')
+                return False
+
+        exclusions = set()
+        for exclusion in args.excluded if args.excluded is not None else []:
+            excl_sel = ObjectStub.parse(exclusion)
+            if excl_sel.id is not None:
+                excl_recipe = self.repository.recipe(excl_sel.id)
+            else:
+                excl_recipe = self.repository.recipe_by_name(excl_sel.name)
+            if excl_recipe is None:
+                print(f'Cannot find excluded recipe "{excl_sel}"')
+                return False
+            exclusions.add(excl_recipe.id)
+
+        try:
+            graph = chaining.build_batch_graph(self.repository, targets, exclusions, args.limit,
+                                               integer_scales=not args.fractional)
+        except ValueError as e:
+            print(f'Error: {e}')
+            return False
+
+        print('Targets:')
+        for target in targets:
+            print(f'  {target.product.name}: {target.rpm:.1f} p.m.')
+        print('\nStages & stations to build:')
+        for stage in graph.as_list():
+            print(f'stage {stage.level: 2}: {stage}')
+        print('\nExternal inputs:')
+        for res_qt in graph.external_inputs():
+            print(f'  {res_qt.resource.name}: {res_qt.quantity:.1f} p.m.')
+
+
+class PlanAll(CliCommand):
+    cmd_name = 'plan-all'
+
+    def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
+        parser = ArgumentParser(prog=self.cmd_name)
+        parser.add_argument('-j', '--jobs', type=int, dest='workers', default=None,
+                            help='Number of worker processes. Defaults to the number of CPUs.')
+        parser.add_argument('--chunk', type=int, dest='chunksize', default=None,
+                            help='Number of plans sent to a worker at once.')
+        parser.add_argument('--unordered', action='store_true', dest='unordered',
+                            help='Write results as soon as they are done instead of in recipe order.')
+        parser.add_argument('--no-shm', action='store_false', dest='shared',
+                            help='Do not share the repository with workers through shared memory.')
+        parser.add_argument('-c', '--cached', action='store_true', dest='use_cache',
+                            help='Reuse cached results and only plan what changed (implies ordered output).')
+        parser.add_argument('-r', '--rpm', type=float, default=None,
+                            help='Target RPM of every product. Defaults to the base RPM of each recipe.')
+        parser.add_argument('-l', '--limit', type=int, dest='limit', default=15,
+                            help='Maximum tree depth (recursion)')
+        parser.add_argument('-R', '--exclude', metavar='RECIPE', dest='excluded', action='extend', nargs='+',
+                            help='Exclude the recipe from all plans.')
+        parser.add_argument('-a', '--aggregate', action='store_true', dest='aggregate',
+                            help='Include aggregated resources in the results.')
+        parser.add_argument('-o', '--output', metavar='FILE', dest='output', default='-',
+                            help='Write JSON lines to FILE instead of stdout.')
+        return parser
+
+    def command_name(self) -> str:
+        return self.cmd_name
+
+    def execute(self, command_str: str):
+        import parallel
+        args = self.parse_arguments(command_str)
+        exclusions = []
+        for exclusion in args.excluded if args.excluded is not None else []:
+            excl_sel = ObjectStub.parse(exclusion)
+            if excl_sel.id is not None:
+                excl_recipe = self.repository.recipe(excl_sel.id)
+            else:
+                excl_recipe = self.repository.recipe_by_name(excl_sel.name)
+            if excl_recipe is None:
+                print(f'Cannot find excluded recipe "{excl_sel}"')
+                return False
+            exclusions.append(excl_recipe.id)
+
+        # opened before planning, so an unwritable output fails before any work is done
+        try:
+            out = sys.stdout if args.output == '-' else open(args.output, 'wt')
+        except OSError as e:
+            print(f'Error: cannot write to {args.output}: {e}')
+            return False
+        errors = 0
+        try:
+            jobs = parallel.all_product_jobs(self.repository, args.rpm, exclusions, args.limit, args.aggregate)
+            if args.use_cache:
+                results = self.main_config.plan_cache.run_jobs(self.repository, jobs, args.workers, args.chunksize,
+                                                               args.shared)
+            else:
+                results = parallel.run_jobs(self.repository, jobs, args.workers, args.chunksize, not args.unordered,
+                                            args.shared)
+            for payload in results:
+                if 'error' in payload:
+                    errors += 1
+                out.write(json.dumps(payload))
+                out.write('\n')
+        except OSError as e:
+            print(f'Error: cannot write to {args.output}: {e}')
+            return False
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if args.output != '-':
+            print(f'{len(jobs)} plans written to {args.output} ({errors} failed)')
+
+
+class ImportEntities(CliCommand):
+    cmd_name = 'import'
+
+    def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
+        import importers.factorio
+        parser = ArgumentParser(prog=self.cmd_name)
+        parser.add_argument('file', metavar='FILE', help='CSV, JSON Lines or game data file to import.')
+        parser.add_argument('-f', '--format', dest='fmt', choices=['csv', 'jsonl', 'satisfactory', 'factorio'],
+                            default=None, help='Input format. Detected from the file extension if not set. Use '
+                                               '"satisfactory" for the Docs.json file of the game and "factorio" for '
+                                               'a data-raw dump.')
+        parser.add_argument('-u', '--upsert', action='store_true', dest='upsert', default=None,
+                            help='Replace existing entities which differ from the imported ones. Default for game data.')
+        parser.add_argument('--no-upsert', action='store_false', dest='upsert',
+                            help='Fail if an imported entity already exists.')
+        parser.add_argument('-n', '--dry-run', action='store_true', dest='dry_run',
+                            help='Validate the input and report changes without applying them.')
+        parser.add_argument('--no-alternates', action='store_false', dest='alternates',
+                            help='Do not import alternate recipes from game data.')
+        parser.add_argument('--variant', choices=importers.factorio.VARIANTS, dest='variant', default='normal',
+                            help='Recipe variant to import from a Factorio dump. Defaults to "normal".')
+        return parser
+
+    def command_name(self) -> str:
+        return self.cmd_name
+
+    def execute(self, command_str: str):
+        import importers
+        import importers.factorio
+        import importers.satisfactory
+        args = self.parse_arguments(command_str)
+        skipped = 0
+        # game data is imported again after updates, its previous import is replaced
+        upsert = args.upsert if args.upsert is not None else args.fmt in ('satisfactory', 'factorio')
+        manifest = os.path.join(os.path.dirname(self.main_config.resources_file), importers.bulk.MANIFEST_NAME)
+        try:
+            if args.fmt == 'satisfactory':
+                result, skipped = importers.satisfactory.import_docs(self.repository, args.file, upsert,
+                                                                     args.dry_run, args.alternates,
+                                                                     importers.load_manifest(manifest, args.fmt))
+            elif args.fmt == 'factorio':
+                result = importers.factorio.import_dump(self.repository, args.file, upsert, args.dry_run,
+                                                        args.variant, importers.load_manifest(manifest, args.fmt))
+            else:
+                result = importers.import_file(self.repository, args.file, args.fmt, upsert, args.dry_run)
+        except OSError as e:
+            print(f'Error: failed to read {e.filename or args.file}: {e}')
+            return False
+        except ValueError as e:
+            print(f'Error: {e}')
+            return False
+        except importers.ImportDataError as e:
+            print(f'Error: import failed, repository not modified:')
+            for error in e.errors:
+                print(f'  {error}')
+            return False
+        print(f'{"would import" if args.dry_run else "imported"}: {result}')
+        if skipped > 0:
+            print(f'skipped {skipped} recipe(s) using unknown items')
+        if args.fmt in ('satisfactory', 'factorio') and not args.dry_run:
+            try:
+                importers.save_manifest(manifest, args.fmt, result)
+            except OSError as e:
+                print(f'Warning: failed to write {manifest}, entities removed from {args.file} will not be removed '
+                      f'by the next import: {e}')
+
 
 class ListObjects(CliCommand):
     cmd_name = 'ls'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
+        import render
         parser = ArgumentParser(prog=self.cmd_name)
         parser.add_argument('-p', '--product', type=str, default=None, help='Display specific resource/product.')
         parser.add_argument('-r', '--recipe', type=str, default=None, help='Display specific recipe.')
         parser.add_argument('type_name', metavar='TYPE', nargs='?', default=None,
                             choices=['r', 'recipes', 'R', 'resources'])
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        parser.add_argument('--format', choices=render.FORMATS, dest='fmt', default='text',
+                            help='Output format. "json" and "jsonl" write complete entities as records.')
+        return parser
 
     def command_name(self) -> str:
         return ListObjects.cmd_name
 
     def execute(self, command_str: str):
+        import render
         args = self.parse_arguments(command_str)
         result = None
         if args.product is not None:
             if args.recipe is not None or args.type_name is not None:
                 print(f'Invalid input: exactly one of "-r", "-p" or TYPE must be set at the same time.')
-                return
+                return False
             else:
                 res_spec = ObjectStub.parse(args.product)
                 if res_spec.name is None and res_spec.id is None:
                     print(f'invalid product selection: {args.product}')
-                    return
+                    return False
                 if res_spec.name is not None:
                     result = self.repository.resource_by_name(res_spec.name)
                 else:
                     result = self.repository.resource(res_spec.id)
+                if result is None:
+                    print(f'Error: no such resource {res_spec}')
+                    return False
+                if args.fmt != 'text':
+                    return self.write_records([render.resource_record(result)], args.fmt)
                 print(result)
         elif args.recipe is not None:
             if args.product is not None or args.type_name is not None:
                 print(f'Invalid input: exactly one of "-r", "-p" or TYPE must be set at the same time.')
-                return
+                return False
             else:
                 recipe_spec = ObjectStub.parse(args.recipe)
                 if recipe_spec.name is None and recipe_spec.id is None:
                     print(f'invalid recipe selection: {args.recipe}')
-                    return
+                    return False
                 if recipe_spec.name is not None:
                     result = self.repository.recipe_by_name(recipe_spec.name)
                 else:
                     result = self.repository.recipe(recipe_spec.id)
+                if result is None:
+                    print(f'Error: no such recipe {recipe_spec}')
+                    return False
+                if args.fmt != 'text':
+                    return self.write_records([render.recipe_record(result)], args.fmt)
                 print(result)
         else:
             if args.type_name is None:
                 print(f'Invalid input: exactly one of "-r", "-p" or TYPE must be set at the same time.')
-                return
+                return False
+            if args.fmt != 'text':
+                if args.type_name in ['recipes', 'r']:
+                    records = map(render.recipe_record, self.repository.recipes.values())
+                else:
+                    records = map(render.resource_record, self.repository.resources.values())
+                return self.write_records(records, args.fmt)
             if args.type_name in ['recipes', 'r']:
                 for (r_id, recipe) in self.repository.recipes.items():
                     print(f'{r_id} -> "{recipe.name}"')
@@ -471,15 +867,28 @@ class ListObjects(CliCommand):
                 for (r_id, resource) in self.repository.resources.items():
                     print(f'{r_id} -> "{resource.name}"')
 
+    @staticmethod
+    def write_records(records: Iterable[dict], fmt: str):
+        import render
+        try:
+            writer = render.RecordWriter(sys.stdout, fmt)
+            writer.section('entities', records)
+            writer.close()
+        except BrokenPipeError:
+            render.handle_broken_pipe()
+
 
 class RemoveResource(CliCommand):
     cmd_name = 'rm-resource'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=self.cmd_name)
         parser.add_argument(metavar='NAME|ID', dest='resource_sel')
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def command_name(self) -> str:
         return self.cmd_name
@@ -494,6 +903,7 @@ class RemoveResource(CliCommand):
             resource = self.repository.resource(stub.id)
         if resource is None:
             print(f'Error: no such resource {stub}')
+            return False
 
         dependents = []
         for recipe in self.repository.recipes.values():
@@ -506,19 +916,23 @@ class RemoveResource(CliCommand):
             print(f'Error: cannot delete because the following recipes reference this resource:')
             for dep_name, dep_dir in dependents:
                 print(f'  "{dep_name}" ({dep_dir})')
-        else:
-            if not self.repository.delete_resource(resource.id):
-                print(f'Failed to delete resource {resource} (unknown error)')
+            return False
+        if not self.repository.delete_resource(resource.id):
+            print(f'Failed to delete resource {resource} (unknown error)')
+            return False
 
 
 class RemoveRecipe(CliCommand):
     cmd_name = 'rm-recipe'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=self.cmd_name)
         parser.add_argument(metavar='NAME|ID', dest='recipe_sel')
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def command_name(self) -> str:
         return self.cmd_name
@@ -533,21 +947,26 @@ class RemoveRecipe(CliCommand):
             recipe = self.repository.recipe(stub.id)
         if recipe is None:
             print(f'Error: no such recipe {stub}')
+            return False
 
         if not self.repository.delete_recipe(recipe.id):
             print(f'Failed to delete recipe {recipe} (unknown error)')
+            return False
 
 
 class SaveRepository(CliCommand):
     cmd_name = 'save'
 
     def __init__(self, config: MainConfig):
+        super().__init__(config)
+        self.repository = self.main_config.repository
+
+    def build_parser(self) -> ArgumentParser:
         parser = ArgumentParser(prog=self.cmd_name)
         parser.add_argument('-f', '--force', dest='force', action='store_true', help='Force writing repository')
         parser.add_argument( '--recipes', metavar='FILE', dest='recipes_file', help='Custom recipes file')
         parser.add_argument( '--resources', metavar='FILE', dest='resources_file', help='Custom resources file')
-        super().__init__(config, parser)
-        self.repository = self.main_config.repository
+        return parser
 
     def command_name(self) -> str:
         return self.cmd_name
@@ -570,10 +989,58 @@ class SaveRepository(CliCommand):
             if recipes_path is not None:
                 print(f'saving recipes   -> {recipes_path}')
             repository.save_repository(self.repository, resources_path, recipes_path, args.force)
+            # only saving to the files the repository was loaded from clears its modifications
+            if resources_path == std_resources_path:
+                self.repository.mod_resources = False
+            if recipes_path == std_recipes_path:
+                self.repository.mod_recipes = False
+            if self.main_config.watcher is not None:
+                self.main_config.watcher.mark_saved()
         else:
             print(f'No modification done, not saving repository (use --force to force saving)')
 
 
+class ProfileCommand(CliCommand):
+    cmd_name = 'profile'
+
+    def __init__(self, config: MainConfig):
+        super().__init__(config)
+        # set by the Cli executing the profiled commands
+        self.cli: typing.Optional['Cli'] = None
+
+    def build_parser(self) -> ArgumentParser:
+        import profiling
+        parser = ArgumentParser(prog=self.cmd_name, description='Execute a command under cProfile.')
+        parser.add_argument('-o', '--output', metavar='FILE', dest='output', default=None,
+                            help='Statistics file, a summary is written next to it as .txt. Defaults to '
+                                 'profile-<COMMAND>-<TIME>.pstats.')
+        parser.add_argument('-n', '--top', metavar='N', type=int, dest='top', default=profiling.DEFAULT_TOP,
+                            help=f'Number of functions in the summary. Defaults to {profiling.DEFAULT_TOP}.')
+        parser.add_argument('-s', '--sort', choices=profiling.SORT_KEYS, dest='sort', default='cumulative',
+                            help='Order of the functions in the summary.')
+        parser.add_argument('-m', '--memory', action='store_true', dest='memory',
+                            help='Also trace memory allocations.')
+        parser.add_argument('command', metavar='COMMAND ...', nargs=REMAINDER,
+                            help='The command to profile.')
+        return parser
+
+    def command_name(self) -> str:
+        return self.cmd_name
+
+    def execute(self, command_str: str):
+        import profiling
+        args = self.parse_arguments(command_str)
+        if len(args.command) == 0:
+            print('Error: no command to profile')
+            return False
+        if args.command[0] == self.cmd_name or profiling.is_active():
+            print('Error: profiles cannot be nested')
+            return False
+        path = args.output if args.output is not None else profiling.default_path(args.command[0])
+        with profiling.Profile(path, shlex.join(args.command), args.top, args.sort, args.memory):
+            return self.cli.execute_line(shlex.join(args.command))
+
+
 
 class Completer:
 
@@ -582,6 +1049,7 @@ class Completer:
         self.options = []
 
     def __call__(self, text, state):
+        import readline
         if state == 0:
             if len(text) == 0:
                 if readline.get_line_buffer().lstrip(' ') != '':
@@ -595,15 +1063,26 @@ class Completer:
 
 
 class Cli:
+    command_types = (AddRecipeCommand, AddResourceCommand, FindRecipes, BuildDependencyTree, ListObjects,
+                     AddRawResourceRecipe, RemoveResource, RemoveRecipe, SaveRepository, BatchPlan, PlanAll,
+                     ImportEntities, ProfileCommand)
 
     def __init__(self, main_cfg: MainConfig):
         self.repo = main_cfg.repository
-        self.commands = [AddRecipeCommand(main_cfg), AddResourceCommand(main_cfg), FindRecipes(main_cfg), BuildDependencyTree(main_cfg),
-                         ListObjects(main_cfg), AddRawResourceRecipe(main_cfg), RemoveResource(main_cfg), RemoveRecipe(main_cfg),
-                         SaveRepository(main_cfg)]
+        self.watcher = main_cfg.watcher
+        self.commands = [command_type(main_cfg) for command_type in Cli.command_types]
+        for command in self.commands:
+            if isinstance(command, ProfileCommand):
+                command.cli = self
+        self._readline_ready = False
+
+    def _init_readline(self):
+        # only needed for the interactive prompt, scripts do not pay for loading readline
+        import readline
         readline.parse_and_bind('tab: complete')
         readline.set_completer_delims(' ')
         readline.set_completer(Completer(self.commands))
+        self._readline_ready = True
 
     def list_recipes(self, product_id: str):
         product = self.repo.resource_by_name(product_id)
@@ -618,29 +1097,74 @@ class Cli:
                 return cmd
         return None
 
+    def execute_line(self, line: str) -> bool:
+        # executes a single command line, returns False if the command failed
+        user_input = line.strip().split(' ', 1)
+        cmd_name = user_input[0]
+        if cmd_name == 'help':
+            if len(user_input) > 1:
+                command = self.get_command(user_input[1])
+                if command is not None:
+                    command.parser.print_help()
+                else:
+                    print(f'help: unknown command "{user_input[1]}"')
+                    return False
+            else:
+                for cmd in self.commands:
+                    print(cmd.command_name())
+            return True
+        command = self.get_command(cmd_name)
+        if command is None:
+            print(f'Error: unknown command "{cmd_name}"')
+            return False
+        try:
+            return command.execute(user_input[1] if len(user_input) > 1 else '') is not False
+        except CommandExit as e:
+            # -h/--help, the command is not executed
+            return e.status == 0
+        except (ArgumentError, InvalidDataError, DuplicateKeyError, ReadOnlyError) as e:
+            # the repository errors derive from BaseException and would otherwise end a script or the prompt
+            print(f'Error: {e}')
+            return False
+
+    @staticmethod
+    def command_names() -> list[str]:
+        return [command_type.cmd_name for command_type in Cli.command_types]
+
     def loop(self) -> bool:
-        user_input = input("=> ").strip().split(' ', 1)
+        if not self._readline_ready:
+            self._init_readline()
+        user_input = input("=> ").strip()
         if len(user_input) > 0:
-            cmd_name = user_input[0]
-            if cmd_name == 'exit' or user_input == 'quit':
+            cmd_name = user_input.split(' ', 1)[0]
+            if cmd_name == 'exit' or cmd_name == 'quit':
                 return False
-            if cmd_name == 'help':
-                if len(user_input) > 1:
-                    command = self.get_command(user_input[1])
-                    if command is not None:
-                        command.parser.print_help()
-                    else:
-                        print(f'help: unknown command "{cmd_name}"')
-                else:
-                    for cmd in self.commands:
-                        print(cmd.command_name())
-            else:
-                command = self.get_command(cmd_name)
-                if command is None:
-                    print(f'Error: unknown command "{cmd_name}"')
-                else:
-                    try:
-                        command.execute(user_input[1] if len(user_input) > 1 else '')
-                    except ArgumentError as e:
-                        print(f'Error: {e}')
+            if self.watcher is not None:
+                # changed data files are applied before the command, not while it runs
+                reloaded = self.watcher.poll()
+                if reloaded is not None:
+                    print(f'Reloaded changed data files: {reloaded}')
+            self.execute_line(user_input)
         return True
+
+    def run_script(self, lines: Iterable[str], stop_on_error: bool = True) -> int:
+        # Executes commands line by line. Empty lines and lines starting with "#" are skipped, "exit" or "quit" end the
+        # script. Returns the number of failed commands; with stop_on_error, execution stops at the first failure.
+        failed = 0
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            if line in ('exit', 'quit'):
+                break
+            try:
+                ok = self.execute_line(line)
+            except Exception as e:
+                print(f'Error: {e}')
+                ok = False
+            if not ok:
+                failed += 1
+                print(f'script: line {line_no} failed: {line}')
+                if stop_on_error:
+                    break
+        return failed
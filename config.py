@@ -1,15 +1,24 @@
+import typing
+
+from plan_cache import PlanCache
 from repository import RecipeRepository
 
+if typing.TYPE_CHECKING:
+    from watcher import RepositoryWatcher
+
 
 class MainConfig:
     APP_VERSION = '2.0.0'
 
-    __slots__ = ('resources_file', 'recipes_file', 'repository', 'theme', 'productivity_look', 'debug')
+    __slots__ = ('resources_file', 'recipes_file', 'repository', 'theme', 'productivity_look', 'debug', 'plan_cache', 'watcher')
 
-    def __init__(self, resources_file: str, recipes_file: str, repo: RecipeRepository, theme):
+    def __init__(self, resources_file: str, recipes_file: str, repo: RecipeRepository, theme,
+                 plan_cache: typing.Optional[PlanCache] = None):
         self.resources_file = resources_file
         self.recipes_file = recipes_file
         self.repository = repo
         self.theme = theme
         self.productivity_look = False
         self.debug = False
+        self.plan_cache = plan_cache if plan_cache is not None else PlanCache()
+        self.watcher: typing.Optional['RepositoryWatcher'] = None
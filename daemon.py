@@ -0,0 +1,550 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shlex
+import signal
+import socket
+import sys
+import threading
+import typing
+from collections.abc import Iterable
+
+import chaining
+import parallel
+import render
+import repository
+from config import MainConfig
+from parallel import PlanJob
+from plan_cache import request_key
+from repository import RecipeRepository
+
+# Planning daemon: keeps a repository, its indexes and the plan cache loaded and answers JSON-RPC 2.0 requests over a
+# Unix domain socket or a TCP port on localhost. Requests and responses are single-line JSON objects (or arrays of
+# them for batches), e.g.
+#
+#   -> {"jsonrpc": "2.0", "id": 1, "method": "graph", "params": {"recipe": "smart_plating", "rpm": 10}}
+#   <- {"jsonrpc": "2.0", "id": 1, "result": {"recipe": "smart_plating", "stages": [...], "inputs": {...}}}
+#
+# Methods:
+#   find       {product|name|id}                      recipes by product, name or id
+#   tree       {recipe, product?, rpm?, exclude?, limit?, aggregate?}   tree nodes and stages as in "tree --format json"
+#   graph      {recipe, product?, rpm?, exclude?, limit?}               stages and external inputs
+#   aggregate  {recipe, product?, rpm?, exclude?, limit?}               graph with aggregated resources
+#   edit       {op: add|upsert, records: [...]} or {op: remove, type, id}
+#   cli.exec   {line}                                 runs a CLI command, returns {"ok": ..., "output": ...}
+#   save       {force?}, ping, shutdown
+#
+# Plans are computed over a snapshot of the repository, in a pool of worker processes attached to a packed copy of it in
+# shared memory, which is replaced after the repository was modified. Everything else runs on the event loop, CLI
+# commands in a thread, one at a time.
+
+DEFAULT_WORKERS = 4
+SOCKET_NAME = '.planner.sock'
+MAX_LINE = 1 << 24
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+APPLICATION_ERROR = -32000
+
+_LOOPBACK = ('localhost', '127.0.0.1', '::1')
+
+
+class RpcError(Exception):
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def parse_address(address: str) -> tuple[str, typing.Union[str, tuple[str, int]]]:
+    # "unix:PATH" or a path -> ('unix', path), "HOST:PORT" or "PORT" -> ('tcp', (host, port)); only loopback hosts
+    if address.startswith('unix:'):
+        return 'unix', address[5:]
+    if '/' in address or address.endswith('.sock'):
+        return 'unix', address
+    host, sep, port = address.rpartition(':')
+    if len(sep) == 0:
+        host = '127.0.0.1'
+    host = host.strip('[]')
+    if not port.isdigit():
+        raise ValueError(f'invalid address "{address}", expected unix:PATH, HOST:PORT or PORT')
+    if host not in _LOOPBACK:
+        raise ValueError(f'refusing to use non-local address "{address}"')
+    return 'tcp', (host, int(port))
+
+
+def default_address(data_dir: str) -> str:
+    return f'unix:{os.path.join(data_dir, SOCKET_NAME)}'
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Planning                                                                                                           #
+#----------------------------------------------------------------------------------------------------------------------#
+
+def _plan_with(repo: RecipeRepository, job: PlanJob, with_nodes: bool) -> tuple[dict, typing.Optional[list[str]]]:
+    # returns the payload and the products the plan depends on (None if it failed)
+    payload, tree = parallel.plan_tree(repo, job)
+    if tree is None:
+        return payload, None
+    if with_nodes:
+        payload['nodes'] = list(render.tree_records(tree))
+    return payload, sorted(chaining.reachable_products(tree))
+
+
+def _plan_in_worker(job: PlanJob, with_nodes: bool) -> tuple[dict, typing.Optional[list[str]]]:
+    return _plan_with(parallel.worker_repository(), job, with_nodes)
+
+
+class _WorkerPool:
+    # Process pool whose workers attach to the repository as of a given generation, packed in shared memory. After the
+    # repository was modified the next plan starts a new pool; plans already queued in the old one still complete
+    # there, its shared memory is released once they are done.
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.generation = -1
+        self._executor = None
+        self._shm = None
+        self._retiring: list[threading.Thread] = []
+
+    def executor(self, repo: RecipeRepository):
+        if self._executor is not None and self.generation == repo.generation:
+            return self._executor
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from packed import SharedPackedRepository
+        self._retire()
+        # the daemon is multithreaded, so workers are not forked from it directly
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self._shm = SharedPackedRepository.create(repo)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                             initializer=parallel._init_worker, initargs=(None, self._shm.name))
+        self.generation = repo.generation
+        return self._executor
+
+    def _retire(self):
+        if self._executor is not None:
+            thread = threading.Thread(target=_release_pool, args=(self._executor, self._shm, False), daemon=True)
+            thread.start()
+            self._retiring = [t for t in self._retiring if t.is_alive()] + [thread]
+            self._executor = None
+            self._shm = None
+
+    def shutdown(self):
+        # queued plans are cancelled, running ones are waited for
+        if self._executor is not None:
+            _release_pool(self._executor, self._shm, True)
+            self._executor = None
+            self._shm = None
+        for thread in self._retiring:
+            thread.join()
+        self._retiring.clear()
+
+
+def _release_pool(executor, shm, cancel: bool):
+    executor.shutdown(wait=True, cancel_futures=cancel)
+    shm.close()
+    shm.unlink()
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Server                                                                                                             #
+#----------------------------------------------------------------------------------------------------------------------#
+
+class PlannerDaemon:
+
+    def __init__(self, config: MainConfig, workers: int = DEFAULT_WORKERS):
+        self.config = config
+        self.repository = config.repository
+        self.plan_cache = config.plan_cache
+        self.pool = _WorkerPool(workers) if workers > 0 else None
+        self.requests = 0
+        self._cli = None
+        self._lock: typing.Optional[asyncio.Lock] = None
+        self._stopped: typing.Optional[asyncio.Event] = None
+        self._methods = {
+            'ping': self.rpc_ping,
+            'find': self.rpc_find,
+            'tree': self.rpc_tree,
+            'graph': self.rpc_graph,
+            'aggregate': self.rpc_aggregate,
+            'edit': self.rpc_edit,
+            'cli.exec': self.rpc_cli_exec,
+            'save': self.rpc_save,
+            'shutdown': self.rpc_shutdown,
+        }
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # serving
+
+    async def serve(self, address: str):
+        self._lock = asyncio.Lock()
+        self._stopped = asyncio.Event()
+        kind, target = parse_address(address)
+        if kind == 'unix':
+            _remove_stale_socket(target)
+            server = await asyncio.start_unix_server(self._handle_connection, path=target, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host=target[0], port=target[1],
+                                                limit=MAX_LINE)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self._stopped.set)
+        print(f'daemon: listening on {address}', file=sys.stderr)
+        watch_task = asyncio.create_task(self._watch()) if self.config.watcher is not None else None
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            if watch_task is not None:
+                watch_task.cancel()
+            if self.pool is not None:
+                self.pool.shutdown()
+            if kind == 'unix':
+                with contextlib.suppress(OSError):
+                    os.unlink(target)
+        print(f'daemon: stopped after {self.requests} request(s)', file=sys.stderr)
+
+    async def _watch(self):
+        watcher = self.config.watcher
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(watcher.interval)
+            # the files are read and parsed without blocking the requests, only applying them needs the lock
+            loaded = await loop.run_in_executor(None, watcher.load)
+            if loaded is None:
+                continue
+            async with self._lock:
+                reloaded = await loop.run_in_executor(None, watcher.apply, loaded)
+            if reloaded is not None:
+                print(f'daemon: reloaded changed data files: {reloaded}', file=sys.stderr)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while not reader.at_eof():
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # line longer than MAX_LINE, the stream cannot be resynchronized
+                    writer.write(_encode(_error(None, INVALID_REQUEST, 'request too large')))
+                    break
+                if len(line.strip()) == 0:
+                    continue
+                response = await self.handle_line(line)
+                if response is not None:
+                    writer.write(_encode(response))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # connections still open when the daemon stops
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def handle_line(self, line: bytes) -> typing.Optional[typing.Union[dict, list]]:
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            return _error(None, PARSE_ERROR, f'parse error: {e}')
+        if isinstance(message, list):
+            if len(message) == 0:
+                return _error(None, INVALID_REQUEST, 'empty batch')
+            # requests of a batch are handled concurrently, plans may run in parallel
+            responses = await asyncio.gather(*(self.handle_request(request) for request in message))
+            responses = [response for response in responses if response is not None]
+            return responses if len(responses) > 0 else None
+        return await self.handle_request(message)
+
+    async def handle_request(self, request) -> typing.Optional[dict]:
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or \
+                not isinstance(request.get('method', None), str):
+            return _error(request.get('id') if isinstance(request, dict) else None, INVALID_REQUEST, 'invalid request')
+        request_id = request.get('id', None)
+        is_notification = 'id' not in request
+        self.requests += 1
+        method = self._methods.get(request['method'], None)
+        params = request.get('params', {})
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f'unknown method "{request["method"]}"')
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, 'params must be an object')
+            result = await method(params)
+        except RpcError as e:
+            return None if is_notification else _error(request_id, e.code, e.message)
+        except Exception as e:
+            if self.config.debug:
+                import traceback
+                traceback.print_exc()
+            return None if is_notification else _error(request_id, INTERNAL_ERROR, f'{type(e).__name__}: {e}')
+        if is_notification:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # planning
+
+    def _job(self, params: dict, aggregate: bool) -> PlanJob:
+        recipe = self._entity(params, 'recipe', self.repository.recipe, self.repository.recipe_by_name)
+        if 'product' in params:
+            product = self._entity(params, 'product', self.repository.resource, self.repository.resource_by_name)
+            if product.id not in recipe.products:
+                raise RpcError(INVALID_PARAMS, f'recipe "{recipe.id}" does not produce "{product.id}"')
+        elif len(recipe.products) == 1:
+            product = recipe.nth_product(0)
+        else:
+            raise RpcError(INVALID_PARAMS, f'recipe "{recipe.id}" has more than one product, "product" is required')
+        excluded = []
+        for exclusion in params.get('exclude', []):
+            excluded.append(self._entity({'recipe': exclusion}, 'recipe', self.repository.recipe,
+                                         self.repository.recipe_by_name).id)
+        rpm = params.get('rpm', None)
+        return PlanJob(recipe.id, product.id, float(rpm) if rpm is not None else None, excluded,
+                       int(params.get('limit', 15)), aggregate)
+
+    @staticmethod
+    def _entity(params: dict, key: str, by_id: typing.Callable, by_name: typing.Callable):
+        # entities are referenced by id, "@id" or name like in the CLI
+        ref = params.get(key, None)
+        if not isinstance(ref, str) or len(ref) == 0:
+            raise RpcError(INVALID_PARAMS, f'"{key}" is required')
+        entity = by_id(ref[1:]) if ref.startswith('@') else by_id(ref) or by_name(ref)
+        if entity is None:
+            raise RpcError(APPLICATION_ERROR, f'no such {key}: {ref}')
+        return entity
+
+    async def _plan(self, job: PlanJob, with_nodes: bool) -> dict:
+        key = request_key(job, 'nodes' if with_nodes else 'payload')
+        async with self._lock:
+            cached = self.plan_cache.get(self.repository, key, persistent=not with_nodes)
+            if cached is not None:
+                return cached
+            snapshot = self.repository.snapshot()
+            loop = asyncio.get_running_loop()
+            if self.pool is None:
+                # planned over a snapshot, edits do not have to wait for the plan
+                future = loop.run_in_executor(None, _plan_with, snapshot, job, with_nodes)
+            else:
+                future = loop.run_in_executor(self.pool.executor(snapshot), _plan_in_worker, job, with_nodes)
+        payload, reachable = await future
+        if 'error' in payload:
+            raise RpcError(APPLICATION_ERROR, payload['error'])
+        async with self._lock:
+            # results of plans which were overtaken by an edit are returned but not cached
+            if reachable is not None and self.repository.generation == snapshot.generation:
+                self.plan_cache.put(self.repository, key, job.recipe_id, reachable, payload,
+                                    persistent=not with_nodes)
+        return payload
+
+    async def rpc_tree(self, params: dict) -> dict:
+        return await self._plan(self._job(params, bool(params.get('aggregate', False))), True)
+
+    async def rpc_graph(self, params: dict) -> dict:
+        return await self._plan(self._job(params, False), False)
+
+    async def rpc_aggregate(self, params: dict) -> dict:
+        return await self._plan(self._job(params, True), False)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # repository
+
+    async def rpc_ping(self, params: dict) -> dict:
+        return {'version': MainConfig.APP_VERSION, 'generation': self.repository.generation,
+                'resources': len(self.repository.resources), 'recipes': len(self.repository.recipes),
+                'requests': self.requests, 'cache_hits': self.plan_cache.hits, 'cache_misses': self.plan_cache.misses}
+
+    async def rpc_find(self, params: dict) -> list[dict]:
+        repo = self.repository
+        if 'product' in params:
+            product = self._entity(params, 'product', repo.resource, repo.resource_by_name)
+            recipes = repo.find_recipes_by_product(product)
+        elif 'name' in params:
+            recipes = [r for r in [repo.recipe_by_name(str(params['name']))] if r is not None]
+        elif 'id' in params:
+            recipes = [r for r in [repo.recipe(str(params['id']))] if r is not None]
+        else:
+            raise RpcError(INVALID_PARAMS, 'one of "product", "name" or "id" is required')
+        return [render.recipe_record(recipe) for recipe in recipes]
+
+    async def rpc_edit(self, params: dict) -> dict:
+        # imported here as only edits need the importers
+        import importers
+        op = params.get('op', None)
+        async with self._lock:
+            if op in ('add', 'upsert'):
+                records = params.get('records', None)
+                if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                    raise RpcError(INVALID_PARAMS, '"records" must be a list of objects')
+                try:
+                    result = importers.import_records(self.repository, enumerate(records, 1), op == 'upsert',
+                                                      bool(params.get('dry_run', False)))
+                except importers.ImportDataError as e:
+                    raise RpcError(APPLICATION_ERROR, str(e))
+                return {'added': result.added, 'updated': result.updated, 'unchanged': result.unchanged,
+                        'generation': self.repository.generation}
+            if op == 'remove':
+                return {'removed': self._remove(params.get('type', None), params.get('id', None)),
+                        'generation': self.repository.generation}
+        raise RpcError(INVALID_PARAMS, f'unknown edit operation "{op}", must be add, upsert or remove')
+
+    def _remove(self, kind: str, entity_id: str) -> bool:
+        if kind == 'recipe':
+            return self.repository.delete_recipe(entity_id)
+        if kind != 'resource':
+            raise RpcError(INVALID_PARAMS, '"type" must be resource or recipe')
+        for recipe in self.repository.recipes.values():
+            if entity_id in recipe.resources or entity_id in recipe.products:
+                raise RpcError(APPLICATION_ERROR, f'resource "{entity_id}" is referenced by recipe "{recipe.id}"')
+        return self.repository.delete_resource(entity_id)
+
+    async def rpc_cli_exec(self, params: dict) -> dict:
+        line = params.get('line', None)
+        if not isinstance(line, str):
+            raise RpcError(INVALID_PARAMS, '"line" is required')
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self._exec, line)
+
+    def _exec(self, line: str) -> dict:
+        if self._cli is None:
+            # imported here as the CLI is only needed for cli.exec
+            from cli import Cli
+            self._cli = Cli(self.config)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                ok = self._cli.execute_line(line)
+            except Exception as e:
+                print(f'Error: {e}')
+                ok = False
+        return {'ok': ok, 'output': output.getvalue()}
+
+    async def rpc_save(self, params: dict) -> dict:
+        async with self._lock:
+            modified = self.repository.mod_recipes or self.repository.mod_resources
+            force = bool(params.get('force', False))
+            if modified or force:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    repository.save_repository(self.repository, self.config.resources_file, self.config.recipes_file,
+                                               force)
+                self.repository.mod_recipes = False
+                self.repository.mod_resources = False
+                if self.config.watcher is not None:
+                    self.config.watcher.mark_saved()
+            return {'saved': modified or force}
+
+    async def rpc_shutdown(self, params: dict) -> dict:
+        self._stopped.set()
+        return {}
+
+
+def _error(request_id, code: int, message: str) -> dict:
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def _encode(message) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _remove_stale_socket(path: str):
+    # a socket file left behind by a daemon which was killed, refuses to replace one which is still in use
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise OSError(f'a daemon is already listening on {path}')
+
+
+def serve(config: MainConfig, address: str, workers: int = DEFAULT_WORKERS):
+    asyncio.run(PlannerDaemon(config, workers).serve(address))
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Client                                                                                                             #
+#----------------------------------------------------------------------------------------------------------------------#
+
+class DaemonClient:
+    # blocking client, kept free of planner imports so that connecting is as fast as starting the interpreter
+
+    def __init__(self, address: str, timeout: typing.Optional[float] = None):
+        kind, target = parse_address(address)
+        if kind == 'unix':
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET6 if ':' in target[0] else socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(target)
+        self._stream = self._socket.makefile('rwb')
+        self._next_id = 0
+
+    def call(self, method: str, **params):
+        self._next_id += 1
+        self._stream.write(_encode({'jsonrpc': '2.0', 'id': self._next_id, 'method': method, 'params': params}))
+        self._stream.flush()
+        line = self._stream.readline()
+        if len(line) == 0:
+            raise ConnectionError('daemon closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RpcError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def execute_line(self, line: str) -> bool:
+        result = self.call('cli.exec', line=line)
+        sys.stdout.write(result['output'])
+        return result['ok']
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_client(address: str, command: list[str], script: typing.Optional[Iterable[str]] = None,
+               stop_on_error: bool = True) -> int:
+    # runs a one-shot command, a script or an interactive prompt against a daemon, returns the number of failures
+    with DaemonClient(address) as client:
+        if len(command) > 0:
+            return 0 if client.execute_line(shlex.join(command)) else 1
+        failed = 0
+        lines = script if script is not None else _prompt()
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            if line in ('exit', 'quit'):
+                break
+            if not client.execute_line(line):
+                failed += 1
+                if script is not None:
+                    print(f'script: line {line_no} failed: {line}')
+                    if stop_on_error:
+                        break
+        return failed
+
+
+def _prompt() -> Iterable[str]:
+    while True:
+        try:
+            yield input('=> ')
+        except EOFError:
+            return
@@ -62,7 +62,7 @@ class ResourceQuantity:
     def is_equal(self, other):
         if not isinstance(other, ResourceQuantity):
             return False
-        return self.resource == other.resource and self.quantity == other.quantity
+        return self.resource.id == other.resource.id and self.quantity == other.quantity
 
 
 class ResourceQuantities:
@@ -158,20 +158,11 @@ class TargetedProduction:
         return self.str_for_rpm(self.base_rpm)
 
     def str_for_rpm(self, rpm: float):
-        recipe_fact = rpm / self.base_rpm
-        result = f'{recipe_fact:.1f}x "{self.product.name}": ['
-        r_count = 0
-        for resource in self.resources:
-            if r_count > 0:
-                result += f' + {resource.scale(rpm)}'
-            else:
-                result += str(resource.scale(rpm))
-            r_count += 1
-        result += f' -> {rpm:.1f}x({self.product})'
-        for bp in self.byproducts:
-            result += f' + {bp.scale(rpm)}'
-
-        return result + ' p.m.]'
+        # formats the scaled quantities directly instead of creating scaled ResourceQuantity objects
+        inputs = ' + '.join([f'{r.quantity * rpm:.1f}x({r.resource.name})' for r in self.resources])
+        outputs = ''.join([f' + {bp.quantity * rpm:.1f}x({bp.resource.name})' for bp in self.byproducts])
+        return f'{rpm / self.base_rpm:.1f}x "{self.product.name}": [{inputs} -> {rpm:.1f}x({self.product.name})' \
+               f'{outputs} p.m.]'
 
     def get_base_rpm(self) -> float:
         return self.base_rpm
@@ -296,10 +287,11 @@ class Recipe(Entity):
             return False
         if self.source_name != other.source_name \
             or self.name != other.name \
-            or self.id != other.id:
+            or self.id != other.id \
+            or self.cycle_time != other.cycle_time:
             return False
 
-        return self.resources.is_equal(other.resources)
+        return self.resources.is_equal(other.resources) and self.products.is_equal(other.products)
 
 
 
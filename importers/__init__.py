@@ -0,0 +1 @@
+from .bulk import ImportDataError, ImportResult, import_file, import_records, load_manifest, save_manifest
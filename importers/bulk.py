@@ -0,0 +1,341 @@
+import csv
+import json
+import os
+import typing
+from collections.abc import Iterable, Iterator
+from datetime import timedelta
+
+from data import Resource, Recipe, ResourceQuantity
+from repository import RecipeRepository, InvalidDataError, DuplicateKeyError, generate_id
+
+# Bulk import of resources and recipes from CSV or JSON Lines.
+#
+# JSON Lines: one object per line, in the same format as resources.json / recipes.json entries. Resources referenced by
+# recipes may be given as {"id": ..., "quantity": ...} or {"name": ..., "quantity": ...}.
+#
+# CSV: columns type, id, name, raw, cycle_secs, products, resources, source_name. Products and resources are lists of
+# "REF:QUANTITY" separated by ";", where REF is "@<id>" or a resource name.
+#
+# The type of a record ("resource" or "recipe") is inferred from its fields if not given.
+#
+# Imports of game data replace those of an earlier version: the ids a source imported are kept in a manifest file (see
+# load_manifest), entities missing from the next import of the same source are removed.
+
+CSV_FIELDS = ('type', 'id', 'name', 'raw', 'cycle_secs', 'products', 'resources', 'source_name')
+# file in the data directory recording the ids of game data imports
+MANIFEST_NAME = '.imports.json'
+
+
+class ImportDataError(InvalidDataError):
+
+    def __init__(self, errors: list[str]):
+        super().__init__(f'{len(errors)} error(s) in import data: ' + '; '.join(errors[:10]), 'import')
+        self.errors = errors
+
+
+class ImportResult:
+    __slots__ = ('added', 'updated', 'unchanged', 'removed', 'ids')
+
+    def __init__(self):
+        # per entity type ('resource', 'recipe')
+        self.added = {'resource': 0, 'recipe': 0}
+        self.updated = {'resource': 0, 'recipe': 0}
+        self.unchanged = {'resource': 0, 'recipe': 0}
+        self.removed = {'resource': 0, 'recipe': 0}
+        # ids of all imported records
+        self.ids: dict[str, set[str]] = {'resource': set(), 'recipe': set()}
+
+    def __str__(self):
+        return ', '.join(f'{kind}s: {self.added[kind]} added, {self.updated[kind]} updated, '
+                         f'{self.unchanged[kind]} unchanged'
+                         + (f', {self.removed[kind]} removed' if self.removed[kind] > 0 else '')
+                         for kind in ('resource', 'recipe'))
+
+
+class _DryRun(BaseException):
+    pass
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Reading                                                                                                            #
+#----------------------------------------------------------------------------------------------------------------------#
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f'cannot detect import format of "{path}", use csv or jsonl')
+
+
+def _parse_refs(value: str) -> list[dict]:
+    refs = []
+    for part in value.split(';'):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        ref, sep, qt = part.rpartition(':')
+        if len(sep) == 0:
+            raise ValueError(f'invalid resource reference "{part}", must be "REF:QUANTITY"')
+        ref = ref.strip()
+        refs.append({'id': ref[1:]} if ref.startswith('@') else {'name': ref})
+        refs[-1]['quantity'] = float(qt)
+    return refs
+
+
+def _parse_flag(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _csv_record(row: dict) -> dict:
+    record = {k: v for k, v in row.items() if k is not None and v is not None and v != ''}
+    if 'raw' in record:
+        record['raw'] = _parse_flag(record['raw'])
+    if 'cycle_secs' in record:
+        record['cycle_secs'] = float(record['cycle_secs'])
+    for key in ('products', 'resources'):
+        if key in record:
+            record[key] = _parse_refs(record[key])
+    return record
+
+
+def read_records(stream: typing.TextIO, fmt: str) -> Iterator[tuple[int, dict]]:
+    # yields (line number, record) without reading the whole input at once
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, _csv_record(row)
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('//'):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'line {line_no}: {e}')
+            if not isinstance(record, dict):
+                raise ValueError(f'line {line_no}: expected an object')
+            yield line_no, record
+    else:
+        raise ValueError(f'unknown import format: {fmt}')
+
+
+def record_type(record: dict) -> str:
+    kind = record.get('type', None)
+    if kind is not None:
+        return kind
+    if 'products' in record or 'resources' in record or 'cycle_secs' in record:
+        return 'recipe'
+    return 'resource'
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _recipe_error(record: dict) -> typing.Optional[str]:
+    # first problem with the fields of a recipe record, None if it can be imported
+    for key in ('products', 'resources'):
+        refs = record.get(key, [])
+        if not isinstance(refs, list) or not all(isinstance(ref, dict) for ref in refs):
+            return f'{key} must be a list of objects'
+        for ref in refs:
+            if not isinstance(ref.get('id', ref.get('name', None)), str):
+                return f'{key} must reference resources by a string "id" or "name"'
+            if not _is_number(ref.get('quantity', None)):
+                return f'quantity of {key} must be a number'
+    if not _is_number(record.get('cycle_secs', 0)):
+        return 'cycle_secs must be a number'
+    if not isinstance(record.get('source_name', None), (str, type(None))):
+        return 'source_name must be a string'
+    return None
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Importing                                                                                                          #
+#----------------------------------------------------------------------------------------------------------------------#
+
+class _ReferenceResolver:
+    # resolves resource references of all recipes at once, every distinct reference is only looked up once
+
+    def __init__(self, repo: RecipeRepository):
+        self.repo = repo
+        self.cache: dict[tuple[str, str], typing.Optional[Resource]] = dict()
+
+    def resolve(self, ref: dict) -> typing.Optional[Resource]:
+        key = ('id', ref['id']) if 'id' in ref else ('name', ref.get('name', ''))
+        if key not in self.cache:
+            if key[0] == 'id':
+                self.cache[key] = self.repo.resource(key[1])
+            else:
+                self.cache[key] = self.repo.resource_by_name(key[1])
+        return self.cache[key]
+
+
+def _import(repo: RecipeRepository, records: Iterable[tuple[int, dict]], upsert: bool,
+            previous: typing.Optional[dict[str, set[str]]]) -> ImportResult:
+    result = ImportResult()
+    errors = []
+    recipe_records = []
+    seen_ids = result.ids
+
+    # resources are added first so that recipes may reference resources of the same import in any order
+    for line_no, record in records:
+        kind = record_type(record)
+        name = record.get('name', '')
+        if not isinstance(kind, str) or kind not in seen_ids:
+            errors.append(f'line {line_no}: unknown type "{kind}"')
+            continue
+        if not isinstance(name, str):
+            errors.append(f'line {line_no}: {kind} name must be a string')
+            continue
+        entity_id = record.get('id', None) or generate_id(name)
+        if not isinstance(entity_id, str):
+            errors.append(f'line {line_no}: {kind} id must be a string')
+            continue
+        if len(name) == 0:
+            errors.append(f'line {line_no}: {kind} name must not be empty')
+            continue
+        if not RecipeRepository.validate_id_format(entity_id):
+            errors.append(f'line {line_no}: invalid {kind} id "{entity_id}"')
+            continue
+        if entity_id in seen_ids[kind]:
+            errors.append(f'line {line_no}: duplicate {kind} id "{entity_id}" in import')
+            continue
+        seen_ids[kind].add(entity_id)
+
+        if kind == 'recipe':
+            error = _recipe_error(record)
+            if error is not None:
+                errors.append(f'line {line_no}: recipe "{entity_id}": {error}')
+            else:
+                recipe_records.append((line_no, entity_id, record))
+            continue
+        is_raw = record.get('raw', False)
+        if isinstance(is_raw, str):
+            # as in CSV
+            is_raw = _parse_flag(is_raw)
+        elif not isinstance(is_raw, (bool, int)):
+            errors.append(f'line {line_no}: resource "{entity_id}": raw must be a boolean')
+            continue
+        resource = Resource(name, entity_id, bool(is_raw))
+        old = repo.resource(entity_id)
+        if old is None:
+            repo.add_resource(resource)
+            result.added[kind] += 1
+        elif not upsert:
+            errors.append(f'line {line_no}: resource "{entity_id}" already exists')
+        elif old.name != resource.name or old.is_raw != resource.is_raw:
+            repo.update_entity(entity_id, resource)
+            result.updated[kind] += 1
+        else:
+            result.unchanged[kind] += 1
+
+    resolver = _ReferenceResolver(repo)
+    for line_no, entity_id, record in recipe_records:
+        quantities = {'products': [], 'resources': []}
+        for key, target in quantities.items():
+            for ref in record.get(key, []):
+                resource = resolver.resolve(ref)
+                if resource is None:
+                    errors.append(f'line {line_no}: unknown resource {ref.get("id", ref.get("name"))}')
+                else:
+                    target.append(ResourceQuantity(resource, float(ref['quantity'])))
+        if len(quantities['products']) == 0:
+            errors.append(f'line {line_no}: recipe "{entity_id}" has no products')
+            continue
+        cycle_secs = float(record.get('cycle_secs', 0))
+        if cycle_secs <= 0:
+            errors.append(f'line {line_no}: recipe "{entity_id}" needs a positive cycle_secs')
+            continue
+
+        recipe = Recipe(record['name'], entity_id, quantities['resources'], quantities['products'],
+                        timedelta(seconds=cycle_secs))
+        recipe.source_name = record.get('source_name', None)
+        old = repo.recipe(entity_id)
+        if old is None:
+            repo.add_recipe(recipe)
+            result.added['recipe'] += 1
+        elif not upsert:
+            errors.append(f'line {line_no}: recipe "{entity_id}" already exists')
+        elif not old.is_equal(recipe):
+            repo.update_recipe(recipe)
+            result.updated['recipe'] += 1
+        else:
+            result.unchanged['recipe'] += 1
+
+    if len(errors) > 0:
+        raise ImportDataError(errors)
+    if previous is not None:
+        _remove_missing(repo, previous, result)
+    return result
+
+
+def _remove_missing(repo: RecipeRepository, previous: dict[str, set[str]], result: ImportResult):
+    # entities of the previous import which are not part of this one; resources still used by a recipe are kept
+    for recipe_id in previous.get('recipe', set()) - result.ids['recipe']:
+        if repo.delete_recipe(recipe_id):
+            result.removed['recipe'] += 1
+    used = set()
+    for recipe in repo.recipes.values():
+        used.update(recipe.resources.keys())
+        used.update(recipe.products.keys())
+    for resource_id in previous.get('resource', set()) - result.ids['resource']:
+        if resource_id not in used and repo.delete_resource(resource_id):
+            result.removed['resource'] += 1
+
+
+def import_records(repo: RecipeRepository, records: Iterable[tuple[int, dict]], upsert: bool = False,
+                   dry_run: bool = False, previous: typing.Optional[dict[str, set[str]]] = None) -> ImportResult:
+    # Adds all records in one transaction: if any record is invalid, ImportDataError listing all problems is raised and
+    # the repository is left unchanged. With upsert, existing entities are replaced if they differ from the record.
+    # previous holds the ids per type of an earlier import of the same source, those missing now are removed.
+    result = None
+    try:
+        with repo.transaction():
+            result = _import(repo, records, upsert, previous)
+            if dry_run:
+                raise _DryRun()
+    except _DryRun:
+        pass
+    except (DuplicateKeyError, InvalidDataError, ValueError, KeyError) as e:
+        if isinstance(e, ImportDataError):
+            raise
+        raise ImportDataError([str(e)])
+    return result
+
+
+def import_file(repo: RecipeRepository, path: str, fmt: typing.Optional[str] = None, upsert: bool = False,
+                dry_run: bool = False) -> ImportResult:
+    if fmt is None:
+        fmt = detect_format(path)
+    with open(path, 'r', newline='' if fmt == 'csv' else None, encoding='utf-8') as stream:
+        return import_records(repo, read_records(stream, fmt), upsert, dry_run)
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Manifest                                                                                                           #
+#----------------------------------------------------------------------------------------------------------------------#
+
+def load_manifest(path: str, source: str) -> dict[str, set[str]]:
+    # ids per type imported from source by the last import, empty if it was never imported
+    try:
+        with open(path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {'resource': set(), 'recipe': set()}
+    entry = manifest.get(source, {}) if isinstance(manifest, dict) else {}
+    return {kind: set(entry.get(kind, [])) for kind in ('resource', 'recipe')}
+
+
+def save_manifest(path: str, source: str, result: ImportResult):
+    try:
+        with open(path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        manifest = dict()
+    manifest[source] = {kind: sorted(ids) for kind, ids in result.ids.items()}
+    with open(path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
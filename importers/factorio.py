@@ -0,0 +1,158 @@
+import re
+import typing
+from collections.abc import Iterator
+
+from repository import RecipeRepository
+from .bulk import ImportDataError, ImportResult, import_records
+from .jsonstream import JsonStream, open_text
+
+# Importer for Factorio prototype dumps (factorio --dump-data, script-output/data-raw-dump.json). The dump is an object
+# of prototype types, each an object of prototypes by name. Recipes are mapped with their ingredients, results and
+# energy_required (cycle time). Probabilities and amount ranges of results are converted to expected quantities. Items
+# mined from resource prototypes and fluids pumped by offshore pumps are imported as raw resources. IDs are the
+# prototype names (iron-gear-wheel -> iron_gear_wheel), so importing the dump again after a mod changed only updates
+# entities which actually changed and removes those which are gone. Prototypes whose names map to the same id
+# (iron-plate and iron_plate) are reported as errors.
+
+_RX_INVALID_ID = re.compile(r'[^a-z0-9]+')
+
+# recipes without energy_required take half a second
+DEFAULT_ENERGY_REQUIRED = 0.5
+VARIANTS = ('normal', 'expensive')
+
+
+def prototype_id(name: str) -> str:
+    return _RX_INVALID_ID.sub('_', name.lower()).strip('_')
+
+
+def prototype_name(name: str) -> str:
+    return name.replace('-', ' ').replace('_', ' ').title()
+
+
+def _amount(spec) -> tuple[typing.Optional[str], float]:
+    # ingredient or result as (name, expected amount), either ["name", amount] or a table with amount, amount_min/max
+    # and probability
+    if isinstance(spec, list):
+        return spec[0], float(spec[1])
+    name = spec.get('name', None)
+    if 'amount' in spec:
+        amount = float(spec['amount'])
+    elif 'amount_min' in spec:
+        amount = (float(spec['amount_min']) + float(spec.get('amount_max', spec['amount_min']))) / 2
+    else:
+        amount = 1.0
+    return name, amount * float(spec.get('probability', 1.0))
+
+
+def _recipe_data(recipe: dict, variant: str) -> typing.Optional[dict]:
+    # selects the normal or expensive definition; a variant set to false is disabled and the other one is used
+    data = recipe.get(variant, None)
+    if data is None:
+        data = recipe if 'ingredients' in recipe else None
+    if data is False or data is None:
+        for other in VARIANTS:
+            if isinstance(recipe.get(other, None), dict):
+                return recipe[other]
+        return None
+    return data
+
+
+def _results(data: dict) -> list[tuple[str, float]]:
+    if 'results' in data:
+        results = [_amount(spec) for spec in data['results']]
+    elif 'result' in data:
+        results = [(data['result'], float(data.get('result_count', 1)))]
+    else:
+        results = []
+    return [(name, amount) for name, amount in results if name is not None and amount > 0]
+
+
+class _DumpReader:
+
+    def __init__(self, variant: str):
+        self.variant = variant
+        # recipe id -> (name, energy required, ingredients, results), names are prototype names
+        self.recipes: dict[str, tuple[str, float, list[tuple[str, float]], list[tuple[str, float]]]] = dict()
+        self.raw: set[str] = set()
+        # different prototypes mapped to the same id
+        self.collisions: list[str] = []
+
+    def read(self, js: JsonStream):
+        for prototype_type in js.iter_object():
+            if prototype_type == 'recipe':
+                for name in js.iter_object():
+                    self.add_recipe(name, js.value())
+            elif prototype_type == 'resource':
+                for _ in js.iter_object():
+                    self.add_resource(js.value())
+            elif prototype_type == 'offshore-pump':
+                for _ in js.iter_object():
+                    fluid = js.value().get('fluid', None)
+                    if fluid is not None:
+                        self.raw.add(fluid)
+            else:
+                js.skip()
+
+    def add_recipe(self, name: str, recipe: dict):
+        data = _recipe_data(recipe, self.variant)
+        if data is None:
+            return
+        ingredients = [_amount(spec) for spec in data.get('ingredients', [])]
+        results = _results(data)
+        energy = float(data.get('energy_required', recipe.get('energy_required', DEFAULT_ENERGY_REQUIRED)))
+        recipe_id = prototype_id(name)
+        if recipe_id in self.recipes:
+            self.collisions.append(f'recipes "{self.recipes[recipe_id][0]}" and "{recipe.get("name", name)}" both '
+                                   f'have the id "{recipe_id}"')
+            return
+        self.recipes[recipe_id] = (recipe.get('name', name), energy,
+                                   [(n, a) for n, a in ingredients if n is not None], results)
+
+    def add_resource(self, resource: dict):
+        minable = resource.get('minable', None)
+        if not isinstance(minable, dict):
+            return
+        if 'results' in minable:
+            self.raw.update(name for name, _ in map(_amount, minable['results']) if name is not None)
+        elif 'result' in minable:
+            self.raw.add(minable['result'])
+
+    def resources(self) -> dict[str, str]:
+        # id -> prototype name of the items and fluids used by the recipes, only these are imported as resources
+        resources: dict[str, str] = dict()
+        reported = set()
+        for _, _, ingredients, results in self.recipes.values():
+            for name, _ in ingredients + results:
+                resource_id = prototype_id(name)
+                other = resources.setdefault(resource_id, name)
+                if other != name and name not in reported:
+                    reported.add(name)
+                    self.collisions.append(f'items "{other}" and "{name}" both have the id "{resource_id}"')
+        return resources
+
+    def records(self, resources: dict[str, str]) -> Iterator[tuple[int, dict]]:
+        index = 0
+        for resource_id, name in resources.items():
+            index += 1
+            yield index, {'type': 'resource', 'id': resource_id, 'name': prototype_name(name), 'raw': name in self.raw}
+        for recipe_id, (name, energy, ingredients, results) in self.recipes.items():
+            if len(results) == 0 or energy <= 0:
+                continue
+            index += 1
+            yield index, {'type': 'recipe', 'id': recipe_id, 'name': prototype_name(name), 'cycle_secs': energy,
+                          'resources': [{'id': prototype_id(n), 'quantity': a} for n, a in ingredients],
+                          'products': [{'id': prototype_id(n), 'quantity': a} for n, a in results]}
+
+
+def import_dump(repo: RecipeRepository, path: str, upsert: bool = True, dry_run: bool = False,
+                variant: str = 'normal', previous: typing.Optional[dict[str, set[str]]] = None) -> ImportResult:
+    # entities of the previous import (see bulk.load_manifest) which are no longer in the dump are removed
+    if variant not in VARIANTS:
+        raise ValueError(f'unknown recipe variant "{variant}", must be one of {", ".join(VARIANTS)}')
+    reader = _DumpReader(variant)
+    with open_text(path) as stream:
+        reader.read(JsonStream(stream))
+    resources = reader.resources()
+    if len(reader.collisions) > 0:
+        raise ImportDataError(reader.collisions)
+    return import_records(repo, reader.records(resources), upsert, dry_run, previous)
@@ -0,0 +1,123 @@
+import codecs
+import io
+import json
+import typing
+from collections.abc import Iterator
+
+# Pull parser for large JSON documents. Arrays and objects are navigated element by element, values are only decoded
+# (with json.JSONDecoder.raw_decode) when requested, so at most one value has to be held in memory at a time:
+#
+#   js = JsonStream(stream)
+#   for _ in js.iter_array():
+#       for key in js.iter_object():
+#           if key == 'wanted':
+#               use(js.value())
+#           else:
+#               js.skip()
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonStream:
+
+    def __init__(self, stream: typing.TextIO, chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, min_size: int = 0) -> bool:
+        # reads at least one more chunk, returns False at the end of the input
+        if self.eof:
+            return False
+        if self.pos > 0:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        data = self.stream.read(max(self.chunk_size, min_size))
+        if len(data) == 0:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def _peek(self) -> str:
+        # next non-whitespace character without consuming it, '' at the end of the input
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c == '' or c not in chars:
+            raise ValueError(f'expected one of "{chars}" but found "{c}"')
+        self.pos += 1
+        return c
+
+    def value(self) -> typing.Any:
+        # decodes the value at the current position
+        self._peek()
+        while True:
+            try:
+                result, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # the value may just be incomplete, the buffer grows geometrically to keep retries cheap
+                if not self._fill(len(self.buf) - self.pos):
+                    raise
+                continue
+            if end == len(self.buf) and self._fill():
+                # a number might continue in the next chunk
+                continue
+            self.pos = end
+            return result
+
+    def skip(self):
+        self.value()
+
+    def iter_array(self) -> Iterator[None]:
+        # yields once per element, the caller must consume the element (value(), skip() or nested iteration)
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self._expect(',]') == ']':
+                return
+
+    def iter_object(self) -> Iterator[str]:
+        # yields the keys of an object, the caller must consume each value
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError(f'expected an object key but found {key!r}')
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+
+def open_text(path: str) -> typing.TextIO:
+    # opens a JSON file as text, detecting UTF-16/UTF-8 by its BOM or by zero bytes in the first characters
+    raw = open(path, 'rb')
+    head = raw.peek(4)[:4] if isinstance(raw, io.BufferedReader) else b''
+    if head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        encoding = 'utf-16'
+    elif len(head) >= 2 and head[0] != 0 and head[1] == 0:
+        encoding = 'utf-16-le'
+    elif len(head) >= 2 and head[0] == 0 and head[1] != 0:
+        encoding = 'utf-16-be'
+    else:
+        encoding = 'utf-8'
+    return io.TextIOWrapper(raw, encoding=encoding)
@@ -0,0 +1,134 @@
+import functools
+import re
+import typing
+from collections.abc import Iterator
+
+from repository import RecipeRepository
+from .bulk import ImportResult, import_records
+from .jsonstream import JsonStream, open_text
+
+# Importer for the Docs.json file shipped with Satisfactory (CommunityResources/Docs/Docs.json, UTF-16). The document
+# is a list of {"NativeClass": ..., "Classes": [...]} groups. Item descriptors become resources, recipes produced in a
+# manufacturing building become recipes. Both are identified by their class name (Desc_IronPlate_C -> iron_plate,
+# Recipe_Alternate_PureIronIngot_C -> alternate_pure_iron_ingot), so re-importing a newer version of the file only
+# updates entities which actually changed and removes those which are gone.
+
+_RX_ITEM_AMOUNT = re.compile(r'ItemClass=[^,]*\.([A-Za-z0-9_]+)["\']*\s*,\s*Amount=([0-9.]+)')
+_RX_PRODUCED_IN = re.compile(r'\.([A-Za-z0-9_]+)"?\s*[,)]')
+_RX_CAMEL = re.compile(r'(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])')
+_RX_INVALID_ID = re.compile(r'[^a-z0-9_]')
+_RX_UNDERSCORES = re.compile(r'_+')
+_CLASS_PREFIXES = ('Desc_', 'Recipe_', 'BP_', 'Build_')
+
+# forms of items which are measured in m³ but stored as liters
+_FLUID_FORMS = ('RF_LIQUID', 'RF_GAS')
+
+
+@functools.lru_cache(maxsize=None)
+def class_id(class_name: str) -> str:
+    name = class_name[:-2] if class_name.endswith('_C') else class_name
+    for prefix in _CLASS_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    snake = _RX_CAMEL.sub('_', name).lower()
+    snake = _RX_INVALID_ID.sub('', snake)
+    return _RX_UNDERSCORES.sub('_', snake).strip('_')
+
+
+def _native_kind(native_class: str) -> typing.Optional[str]:
+    # "/Script/CoreUObject.Class'/Script/FactoryGame.FGRecipe'" -> 'recipe'
+    name = native_class.rstrip("'").rsplit('.', 1)[-1]
+    if name == 'FGRecipe':
+        return 'recipe'
+    if name == 'FGResourceDescriptor':
+        return 'raw'
+    if 'Descriptor' in name or name.startswith('FGAmmoType') or name == 'FGConsumableDescriptor':
+        return 'item'
+    return None
+
+
+def iter_classes(js: JsonStream) -> Iterator[tuple[str, dict]]:
+    # yields (kind, class) for all descriptor and recipe classes, other groups are skipped without decoding them
+    for _ in js.iter_array():
+        kind = None
+        for key in js.iter_object():
+            if key == 'NativeClass':
+                kind = _native_kind(js.value())
+            elif key == 'Classes' and kind is not None:
+                for _ in js.iter_array():
+                    yield kind, js.value()
+            else:
+                js.skip()
+
+
+def _is_manufactured(produced_in: str) -> bool:
+    # recipes of the build gun, work bench or equipment workshop are not produced by stations
+    return any(building.startswith('Build_') for building in _RX_PRODUCED_IN.findall(produced_in))
+
+
+class _DocsReader:
+
+    def __init__(self, include_alternates: bool):
+        self.include_alternates = include_alternates
+        # item id -> (name, is raw, amount divisor)
+        self.items: dict[str, tuple[str, bool, float]] = dict()
+        # compact recipe data, only resolved after all items are known as Docs.json is not ordered
+        self.recipes: dict[str, tuple[str, float, list[tuple[str, float]], list[tuple[str, float]]]] = dict()
+        self.skipped = 0
+
+    def read(self, js: JsonStream):
+        for kind, cls in iter_classes(js):
+            if kind == 'recipe':
+                self.add_recipe(cls)
+            else:
+                self.add_item(cls, kind == 'raw')
+
+    def add_item(self, cls: dict, is_raw: bool):
+        name = cls.get('mDisplayName', '')
+        if len(name) == 0:
+            return
+        divisor = 1000.0 if cls.get('mForm', '') in _FLUID_FORMS else 1.0
+        self.items[class_id(cls['ClassName'])] = (name, is_raw, divisor)
+
+    def add_recipe(self, cls: dict):
+        if not _is_manufactured(cls.get('mProducedIn', '')):
+            return
+        recipe_id = class_id(cls['ClassName'])
+        if not self.include_alternates and recipe_id.startswith('alternate_'):
+            return
+        ingredients = [(class_id(c), float(a)) for c, a in _RX_ITEM_AMOUNT.findall(cls.get('mIngredients', ''))]
+        products = [(class_id(c), float(a)) for c, a in _RX_ITEM_AMOUNT.findall(cls.get('mProduct', ''))]
+        self.recipes[recipe_id] = (cls.get('mDisplayName', recipe_id), float(cls['mManufactoringDuration']),
+                                   ingredients, products)
+
+    def records(self) -> Iterator[tuple[int, dict]]:
+        index = 0
+        for item_id, (name, is_raw, _) in self.items.items():
+            index += 1
+            yield index, {'type': 'resource', 'id': item_id, 'name': name, 'raw': is_raw}
+        for recipe_id, (name, duration, ingredients, products) in self.recipes.items():
+            quantities = []
+            for components in (ingredients, products):
+                if any(item_id not in self.items for item_id, _ in components):
+                    break
+                quantities.append([{'id': item_id, 'quantity': amount / self.items[item_id][2]}
+                                   for item_id, amount in components])
+            if len(quantities) != 2 or len(quantities[1]) == 0 or duration <= 0:
+                self.skipped += 1
+                continue
+            index += 1
+            yield index, {'type': 'recipe', 'id': recipe_id, 'name': name, 'cycle_secs': duration,
+                          'resources': quantities[0], 'products': quantities[1]}
+
+
+def import_docs(repo: RecipeRepository, path: str, upsert: bool = True, dry_run: bool = False,
+                include_alternates: bool = True,
+                previous: typing.Optional[dict[str, set[str]]] = None) -> tuple[ImportResult, int]:
+    # returns the import result and the number of recipes skipped because they use unknown items; entities of the
+    # previous import (see bulk.load_manifest) which are no longer in the file are removed
+    reader = _DocsReader(include_alternates)
+    with open_text(path) as stream:
+        reader.read(JsonStream(stream))
+    result = import_records(repo, reader.records(), upsert, dry_run, previous)
+    return result, reader.skipped
@@ -1,17 +1,72 @@
 import argparse
 import os.path
+import shlex
+import sys
 
-import planner_ui
-import planner_ui.application
 import repository
 from cli import Cli
 from config import MainConfig
+from plan_cache import PlanCache
 
 
 def _cli(config: MainConfig):
     cli = Cli(config)
     while cli.loop(): pass
 
+
+def _script(config: MainConfig, script_path: str, stop_on_error: bool) -> int:
+    cli = Cli(config)
+    if script_path == '-':
+        return cli.run_script(sys.stdin, stop_on_error)
+    with open(script_path, 'r') as script_file:
+        return cli.run_script(script_file, stop_on_error)
+
+
+def _one_shot(config: MainConfig, command: list[str]) -> int:
+    return 0 if Cli(config).execute_line(shlex.join(command)) else 1
+
+
+def _connect(args: argparse.Namespace, command: list[str]) -> int:
+    # the daemon holds the repository, nothing is loaded or saved here
+    import daemon
+    address = args.address or daemon.default_address(args.data_dir)
+    try:
+        if args.script_file is None or len(command) > 0:
+            failed = daemon.run_client(address, command)
+        elif args.script_file == '-':
+            failed = daemon.run_client(address, [], sys.stdin, args.stop_on_error)
+        else:
+            with open(args.script_file, 'r') as script_file:
+                failed = daemon.run_client(address, [], script_file, args.stop_on_error)
+    except (OSError, ValueError, daemon.RpcError) as e:
+        print(f'Error: cannot use daemon at {address}: {e}')
+        return 1
+    if failed > 0 and args.script_file is not None:
+        print(f'Error: {failed} command(s) failed')
+    return 1 if failed > 0 else 0
+
+
+def _split_command(parser: argparse.ArgumentParser, argv: list[str]) -> tuple[list[str], list[str]]:
+    # Splits the arguments at the start of a one-shot command, which is either a second positional argument or a
+    # command name in place of DATA_DIR. Everything after it belongs to the command, even if it looks like an option.
+    takes_value = {opt for action in parser._actions if action.nargs != 0 for opt in action.option_strings}
+    commands = Cli.command_names()
+    positionals = 0
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '--':
+            break
+        if arg.startswith('-') and arg != '-':
+            i += 2 if arg in takes_value else 1
+            continue
+        if positionals > 0 or (arg in commands and not os.path.isdir(arg)):
+            return argv[:i], argv[i:]
+        positionals += 1
+        i += 1
+    return argv, []
+
+
 def _check_files(resources_file: str, recipes_file: str) -> tuple[bool, bool]:
     resources_exist = os.path.isfile(resources_file)
     recipes_exist = os.path.isfile(recipes_file)
@@ -19,8 +74,10 @@ def _check_files(resources_file: str, recipes_file: str) -> tuple[bool, bool]:
     return resources_exist, recipes_exist
 
 
-def _main():
-    parser = argparse.ArgumentParser()
+def _main() -> int:
+    parser = argparse.ArgumentParser(usage='%(prog)s [options] [DATA_DIR] [COMMAND ...]',
+                                     epilog='If a CLI command is given after DATA_DIR, it is executed once and the '
+                                            'application exits.')
     parser.add_argument(metavar='DATA_DIR', help='the directory in which files are stored', default='./data', nargs='?',
                         dest='data_dir')
     parser.add_argument('-r', '--recipes', metavar='NAME', dest='recipes_name', default='recipes.json',
@@ -31,55 +88,129 @@ def _main():
                         const='gui')
     parser.add_argument('--cli', dest='op_mode', help='Use the command line interface.', action='store_const',
                         const='cli')
+    parser.add_argument('--script', metavar='FILE', dest='script_file', default=None,
+                        help='Execute CLI commands from FILE ("-" for stdin) instead of starting an interactive mode.')
+    parser.add_argument('--continue-on-error', dest='stop_on_error', action='store_false',
+                        help='Continue executing a script after a failed command. Changes are not saved if a script '
+                             'stops because of an error.')
     parser.add_argument('--init', dest='do_init', help='Initialize a new empty repository', action='store_true')
     parser.add_argument('-R', '--read-only', dest='is_readonly', help='Do not save changes when exiting', action='store_true')
     parser.add_argument('-d', '--debug', dest='is_debug', help='Enable debug logging', action='store_true')
     parser.add_argument('--theme', dest='gui_theme', help='GUI theme to use. Defaults to \'classic\'.', default='classic')
     parser.add_argument('--productivity', dest='productivity_look', help='Improve the GUI look towards a traditional productivity design.', action='store_true')
-    args = parser.parse_args()
+    parser.add_argument('--plan-cache', dest='use_plan_cache', help='Keep planning results in DATA_DIR/.plan_cache across sessions.', action='store_true')
+    parser.add_argument('--watch', dest='do_watch', action='store_true',
+                        help='Reload entities changed in the data files while the interactive CLI, GUI or daemon is '
+                             'running.')
+    parser.add_argument('--daemon', dest='op_mode', action='store_const', const='daemon',
+                        help='Serve planning requests as JSON-RPC on the address given by --address.')
+    parser.add_argument('--connect', dest='do_connect', action='store_true',
+                        help='Execute commands, scripts or the interactive prompt in a running daemon.')
+    parser.add_argument('--address', metavar='ADDR', dest='address', default=None,
+                        help='Daemon address, "unix:PATH", "HOST:PORT" or "PORT" on localhost. Defaults to the '
+                             'socket DATA_DIR/.planner.sock.')
+    parser.add_argument('--workers', metavar='N', type=int, dest='workers', default=None,
+                        help='Number of worker processes of the daemon for planning, 0 plans in the daemon process.')
+    parser.add_argument('--profile', dest='do_profile', action='store_true',
+                        help='Profile the run with cProfile, writing FILE.pstats and a summary of the top functions.')
+    parser.add_argument('--profile-file', metavar='FILE', dest='profile_file', default=None,
+                        help='Statistics file for --profile. Defaults to profile-<COMMAND>-<TIME>.pstats.')
+    parser.add_argument('--profile-memory', dest='profile_memory', action='store_true',
+                        help='Also trace memory allocations with --profile.')
+    main_argv, command = _split_command(parser, sys.argv[1:])
+    args = parser.parse_args(main_argv)
+    if args.do_profile:
+        # only imported if used, profiling costs nothing otherwise
+        import profiling
+        label = command[0] if len(command) > 0 else 'script' if args.script_file is not None else args.op_mode or 'cli'
+        path = args.profile_file if args.profile_file is not None else profiling.default_path(label)
+        with profiling.Profile(path, ' '.join(command) or label, memory=args.profile_memory):
+            return _run(args, command)
+    return _run(args, command)
+
+
+def _run(args: argparse.Namespace, command: list[str]) -> int:
+    is_batch = args.script_file is not None or len(command) > 0
+
+    if args.do_connect:
+        return _connect(args, command)
 
     recipes_file = f'{args.data_dir}/{args.recipes_name}'
     resources_file = f'{args.data_dir}/{args.resources_name}'
 
-    print('Using:')
-    print(f'  recipes:   {recipes_file}')
-    print(f'  resources: {resources_file}')
+    if not is_batch:
+        print('Using:')
+        print(f'  recipes:   {recipes_file}')
+        print(f'  resources: {resources_file}')
 
     if args.do_init:
         if _check_files(resources_file, recipes_file) != (False, False):
             print(f'Error: cannot init new repository because files already exist')
-            return
+            return 1
         print('initializing new repository')
         repo = repository.RecipeRepository()
     else:
         res_exists, rec_exists = _check_files(resources_file, recipes_file)
         if not res_exists:
             print(f'Error: failed to read resources file {resources_file}')
-            return
+            return 1
         if not rec_exists:
             print(f'Error: failed to read recipes file {recipes_file}')
-            return
+            return 1
         repo = repository.load_repository(resources_file, recipes_file)
 
-    config = MainConfig(resources_file, recipes_file, repo, args.gui_theme)
+    plan_cache = PlanCache(directory=f'{args.data_dir}/.plan_cache' if args.use_plan_cache else None)
+    config = MainConfig(resources_file, recipes_file, repo, args.gui_theme, plan_cache)
     if args.is_debug:
         config.debug = True
+    if args.do_watch:
+        from watcher import RepositoryWatcher
+        config.watcher = RepositoryWatcher(repo, resources_file, recipes_file)
 
     op_mode = args.op_mode
+    do_save = not args.is_readonly
+    failed = 0
     try:
-        if op_mode == 'cli' or op_mode is None:
+        if args.script_file is not None:
+            failed = _script(config, args.script_file, args.stop_on_error)
+            if failed > 0:
+                print(f'Error: {failed} command(s) failed')
+                if args.stop_on_error:
+                    do_save = False
+        elif len(command) > 0:
+            failed = _one_shot(config, command)
+            if failed > 0:
+                do_save = False
+        elif op_mode == 'cli' or op_mode is None:
             _cli(config)
+        elif op_mode == 'daemon':
+            import daemon
+            workers = args.workers if args.workers is not None else daemon.DEFAULT_WORKERS
+            daemon.serve(config, args.address or daemon.default_address(args.data_dir), workers)
         elif op_mode == 'gui':
             if args.productivity_look:
                 config.productivity_look = True
+            # tkinter is only loaded when the GUI is actually used
+            import planner_ui.application
             planner_ui.application.main(config)
     except Exception as e:
-        print(f'Fatal error: {e}. Dumping repository.')
+        if is_batch:
+            # a script or command which did not finish may have left partial changes
+            do_save = False
+            print(f'Fatal error: {e}. Changes are not saved.')
+        else:
+            print(f'Fatal error: {e}. Dumping repository.')
         raise e
+    except BaseException:
+        if is_batch:
+            do_save = False
+        raise
     finally:
-        if not args.is_readonly:
+        # batch runs stay quiet if nothing changed, their output may be piped into other tools
+        if do_save and (not is_batch or repo.mod_recipes or repo.mod_resources):
             repository.save_repository(repo, config.resources_file, config.recipes_file)
+    return 1 if failed > 0 else 0
 
 
 if __name__ == '__main__':
-    _main()
+    sys.exit(_main())
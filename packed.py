@@ -0,0 +1,259 @@
+import array
+import mmap
+import struct
+import typing
+from collections import OrderedDict
+from datetime import timedelta
+from multiprocessing import shared_memory
+
+from data import Resource, Recipe, ResourceQuantity
+from repository import RecipeRepository
+
+# Flat, read-only representation of a RecipeRepository in one contiguous buffer. Entities are referenced by interned
+# integer ids, recipe inputs/outputs and the product -> recipes index are stored CSR-style as offset and value arrays.
+# The buffer can be placed in shared memory or an mmap'd file and attached by other processes without copying.
+#
+# Layout: header (magic, version, section count), section table (offset, item count per section), sections.
+
+_MAGIC = b'FPPK'
+_VERSION = 1
+_HEADER = struct.Struct('<4sII')
+_SECTION = struct.Struct('<QQ')
+
+# section name, array typecode
+_SECTIONS = (
+    ('str_offsets', 'Q'),       # offsets into str_data, one more than number of strings
+    ('str_data', 'B'),          # utf-8 encoded strings
+    ('res_id', 'I'),            # string index of resource id
+    ('res_name', 'I'),          # string index of resource name
+    ('res_raw', 'B'),
+    ('rec_id', 'I'),
+    ('rec_name', 'I'),
+    ('rec_source', 'i'),        # string index of source name or -1
+    ('rec_cycle', 'd'),         # cycle time in seconds
+    ('rec_in_offsets', 'Q'),    # CSR offsets into in_res/in_qt, one more than number of recipes
+    ('in_res', 'I'),            # resource index
+    ('in_qt', 'd'),
+    ('rec_out_offsets', 'Q'),
+    ('out_res', 'I'),
+    ('out_qt', 'd'),
+    ('prod_offsets', 'Q'),      # CSR offsets into prod_recipes, one more than number of resources
+    ('prod_recipes', 'I'),      # recipe index
+)
+
+
+def pack_repository(repo: RecipeRepository) -> bytes:
+    strings: list[bytes] = []
+    string_index: dict[str, int] = dict()
+
+    def intern(s: str) -> int:
+        idx = string_index.get(s, None)
+        if idx is None:
+            idx = len(strings)
+            string_index[s] = idx
+            strings.append(s.encode('utf-8'))
+        return idx
+
+    arrays = {name: array.array(code) for name, code in _SECTIONS}
+    resources = list(repo.resources.values())
+    res_index = {resource.id: i for i, resource in enumerate(resources)}
+    for resource in resources:
+        arrays['res_id'].append(intern(resource.id))
+        arrays['res_name'].append(intern(resource.name))
+        arrays['res_raw'].append(1 if resource.is_raw else 0)
+
+    producers: list[list[int]] = [[] for _ in resources]
+    arrays['rec_in_offsets'].append(0)
+    arrays['rec_out_offsets'].append(0)
+    for rec_idx, recipe in enumerate(repo.recipes.values()):
+        arrays['rec_id'].append(intern(recipe.id))
+        arrays['rec_name'].append(intern(recipe.name))
+        arrays['rec_source'].append(intern(recipe.source_name) if recipe.source_name is not None else -1)
+        arrays['rec_cycle'].append(recipe.cycle_time)
+        for res_qt in recipe.resources:
+            arrays['in_res'].append(res_index[res_qt.resource.id])
+            arrays['in_qt'].append(res_qt.quantity)
+        arrays['rec_in_offsets'].append(len(arrays['in_res']))
+        for res_qt in recipe.products:
+            arrays['out_res'].append(res_index[res_qt.resource.id])
+            arrays['out_qt'].append(res_qt.quantity)
+            producers[res_index[res_qt.resource.id]].append(rec_idx)
+        arrays['rec_out_offsets'].append(len(arrays['out_res']))
+
+    arrays['prod_offsets'].append(0)
+    for recipe_indices in producers:
+        arrays['prod_recipes'].extend(recipe_indices)
+        arrays['prod_offsets'].append(len(arrays['prod_recipes']))
+
+    arrays['str_offsets'].append(0)
+    for encoded in strings:
+        arrays['str_data'].frombytes(encoded)
+        arrays['str_offsets'].append(len(arrays['str_data']))
+
+    # sections are aligned to 8 bytes so that they can be cast from the buffer directly
+    offset = _HEADER.size + _SECTION.size * len(_SECTIONS)
+    table = []
+    for name, _ in _SECTIONS:
+        offset = (offset + 7) & ~7
+        arr = arrays[name]
+        table.append((offset, len(arr)))
+        offset += len(arr) * arr.itemsize
+
+    buf = bytearray(offset)
+    _HEADER.pack_into(buf, 0, _MAGIC, _VERSION, len(_SECTIONS))
+    for i, (sec_offset, count) in enumerate(table):
+        _SECTION.pack_into(buf, _HEADER.size + i * _SECTION.size, sec_offset, count)
+        data = arrays[_SECTIONS[i][0]].tobytes()
+        buf[sec_offset:sec_offset + len(data)] = data
+    return bytes(buf)
+
+
+# number of materialized resources and recipes kept by a PackedRepository, each
+DEFAULT_CACHE_SIZE = 8192
+
+
+class PackedRepository:
+    # Read-only repository over a packed buffer. Implements the read methods of RecipeRepository used by the planner;
+    # Resource and Recipe objects are only materialized when they are accessed. The most recently used ones are cached,
+    # up to cache_size of each, so a long-lived worker does not end up with an object copy of the whole repository.
+
+    def __init__(self, buffer, cache_size: int = DEFAULT_CACHE_SIZE):
+        self._buffer = memoryview(buffer)
+        magic, version, count = _HEADER.unpack_from(self._buffer, 0)
+        if magic != _MAGIC or version != _VERSION or count != len(_SECTIONS):
+            raise ValueError('buffer does not contain a packed repository')
+        self._arrays: dict[str, memoryview] = dict()
+        for i, (name, code) in enumerate(_SECTIONS):
+            sec_offset, sec_count = _SECTION.unpack_from(self._buffer, _HEADER.size + i * _SECTION.size)
+            size = sec_count * struct.calcsize(code)
+            self._arrays[name] = self._buffer[sec_offset:sec_offset + size].cast(code)
+
+        self.cache_size = cache_size
+        self._resources: OrderedDict[int, Resource] = OrderedDict()
+        self._recipes: OrderedDict[int, Recipe] = OrderedDict()
+        self._res_by_id: typing.Optional[dict[str, int]] = None
+        self._rec_by_id: typing.Optional[dict[str, int]] = None
+
+    def close(self):
+        for view in self._arrays.values():
+            view.release()
+        self._arrays.clear()
+        self._buffer.release()
+
+    def _string(self, idx: int) -> str:
+        offsets = self._arrays['str_offsets']
+        return bytes(self._arrays['str_data'][offsets[idx]:offsets[idx + 1]]).decode('utf-8')
+
+    def _cache(self, cache: OrderedDict, idx: int, entity):
+        cache[idx] = entity
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _resource_at(self, idx: int) -> Resource:
+        resource = self._resources.get(idx, None)
+        if resource is None:
+            resource = Resource(self._string(self._arrays['res_name'][idx]), self._string(self._arrays['res_id'][idx]),
+                                self._arrays['res_raw'][idx] != 0)
+            self._cache(self._resources, idx, resource)
+        else:
+            self._resources.move_to_end(idx)
+        return resource
+
+    def _quantities(self, idx: int, prefix: str) -> list[ResourceQuantity]:
+        offsets = self._arrays[f'rec_{prefix}_offsets']
+        res = self._arrays[f'{prefix}_res']
+        qts = self._arrays[f'{prefix}_qt']
+        return [ResourceQuantity(self._resource_at(res[i]), qts[i]) for i in range(offsets[idx], offsets[idx + 1])]
+
+    def _recipe_at(self, idx: int) -> Recipe:
+        recipe = self._recipes.get(idx, None)
+        if recipe is None:
+            recipe = Recipe(self._string(self._arrays['rec_name'][idx]), self._string(self._arrays['rec_id'][idx]),
+                            self._quantities(idx, 'in'), self._quantities(idx, 'out'),
+                            timedelta(seconds=self._arrays['rec_cycle'][idx]))
+            source = self._arrays['rec_source'][idx]
+            if source >= 0:
+                recipe.source_name = self._string(source)
+            self._cache(self._recipes, idx, recipe)
+        else:
+            self._recipes.move_to_end(idx)
+        return recipe
+
+    def _resource_index(self) -> dict[str, int]:
+        if self._res_by_id is None:
+            self._res_by_id = {self._string(s): i for i, s in enumerate(self._arrays['res_id'])}
+        return self._res_by_id
+
+    def _recipe_index(self) -> dict[str, int]:
+        if self._rec_by_id is None:
+            self._rec_by_id = {self._string(s): i for i, s in enumerate(self._arrays['rec_id'])}
+        return self._rec_by_id
+
+    def resource(self, res_id: str) -> typing.Optional[Resource]:
+        idx = self._resource_index().get(res_id, None)
+        return self._resource_at(idx) if idx is not None else None
+
+    def recipe(self, rec_id: str) -> typing.Optional[Recipe]:
+        idx = self._recipe_index().get(rec_id, None)
+        return self._recipe_at(idx) if idx is not None else None
+
+    def find_recipes_by_product(self, product: Resource) -> list[Recipe]:
+        idx = self._resource_index().get(product.id, None)
+        if idx is None:
+            return []
+        offsets = self._arrays['prod_offsets']
+        prod_recipes = self._arrays['prod_recipes']
+        return [self._recipe_at(prod_recipes[i]) for i in range(offsets[idx], offsets[idx + 1])]
+
+    @property
+    def resources(self) -> dict[str, Resource]:
+        return {resource.id: resource for resource in map(self._resource_at, range(len(self._arrays['res_id'])))}
+
+    @property
+    def recipes(self) -> dict[str, Recipe]:
+        return {recipe.id: recipe for recipe in map(self._recipe_at, range(len(self._arrays['rec_id'])))}
+
+
+def write_packed_file(repo: RecipeRepository, path: str):
+    with open(path, 'wb') as packed_file:
+        packed_file.write(pack_repository(repo))
+
+
+def open_packed_file(path: str) -> PackedRepository:
+    # the mapping stays open as long as the returned repository references it
+    with open(path, 'rb') as packed_file:
+        mapped = mmap.mmap(packed_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return PackedRepository(mapped)
+
+
+class SharedPackedRepository:
+    # Owner or attachment of a packed repository in multiprocessing.shared_memory. The creating process must call
+    # unlink() once all workers are done.
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.repository = PackedRepository(shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @staticmethod
+    def create(repo: RecipeRepository) -> 'SharedPackedRepository':
+        data = pack_repository(repo)
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        return SharedPackedRepository(shm, True)
+
+    @staticmethod
+    def attach(name: str) -> 'SharedPackedRepository':
+        return SharedPackedRepository(shared_memory.SharedMemory(name=name), False)
+
+    def close(self):
+        self.repository.close()
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
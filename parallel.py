@@ -0,0 +1,214 @@
+import os
+import typing
+from collections.abc import Iterator, Iterable
+
+import chaining
+from repository import RecipeRepository
+
+if typing.TYPE_CHECKING:
+    from packed import SharedPackedRepository
+
+
+class PlanJob:
+    __slots__ = ('recipe_id', 'product_id', 'rpm', 'excluded', 'max_depth', 'aggregate')
+
+    def __init__(self, recipe_id: str, product_id: str, rpm: typing.Optional[float] = None,
+                 excluded: typing.Optional[Iterable[str]] = None, max_depth: int = 15, aggregate: bool = False):
+        self.recipe_id = recipe_id
+        self.product_id = product_id
+        self.rpm = rpm
+        self.excluded = tuple(sorted(excluded)) if excluded is not None else ()
+        self.max_depth = max_depth
+        self.aggregate = aggregate
+
+    def __repr__(self):
+        return f'PlanJob[{self.recipe_id}/{self.product_id} rpm={self.rpm}]'
+
+
+def plan_payload(repo: RecipeRepository, job: PlanJob) -> dict:
+    # compact, JSON serializable result of planning a single job
+    return plan_tree(repo, job)[0]
+
+
+def build_tree(repo: RecipeRepository, job: PlanJob, monitor: typing.Optional[chaining.BuildMonitor] = None,
+               stats: typing.Optional[chaining.PlanStats] = None) -> typing.Optional[chaining.ProductionTree]:
+    # None if the recipe or product does not exist
+    recipe = repo.recipe(job.recipe_id)
+    product = repo.resource(job.product_id)
+    if recipe is None or product is None or product.id not in recipe.products:
+        return None
+    rpm = job.rpm if job.rpm is not None else recipe.production(product).get_base_rpm()
+    tree = chaining.ProductionTree(recipe, product, rpm)
+    tree.build(repo, job.max_depth, excluded_recipes=set(job.excluded), monitor=monitor, stats=stats)
+    return tree
+
+
+def replan_tree(repo: RecipeRepository, tree: chaining.ProductionTree, base_job: PlanJob, job: PlanJob,
+                monitor: typing.Optional[chaining.BuildMonitor] = None) -> typing.Optional[chaining.ProductionTree]:
+    # Tree for job derived from the tree built for base_job, without building it again: the RPM is rescaled and changed
+    # exclusions are patched in. None if the jobs differ in anything else, which needs a full build. Raises
+    # BuildCancelled if the monitor is cancelled.
+    if (job.recipe_id, job.product_id, job.max_depth) != (base_job.recipe_id, base_job.product_id, base_job.max_depth):
+        return None
+    excluded = set(job.excluded)
+    base_excluded = set(base_job.excluded)
+    rpm = job.rpm if job.rpm is not None else tree.root.production.get_base_rpm()
+    result = chaining.rescaled_tree(tree, rpm, excluded - base_excluded, monitor)
+    if len(base_excluded - excluded) > 0:
+        chaining.extend_tree(result, repo, base_excluded - excluded, job.max_depth, excluded, monitor)
+    return result
+
+
+def plan_tree(repo: RecipeRepository, job: PlanJob) -> tuple[dict, typing.Optional[chaining.ProductionTree]]:
+    payload = {'recipe': job.recipe_id, 'product': job.product_id, 'rpm': job.rpm}
+    tree = build_tree(repo, job)
+    if tree is None:
+        payload['error'] = f'no such recipe/product: {job.recipe_id}/{job.product_id}'
+        return payload, None
+
+    product = tree.root.production.product
+    payload['rpm'] = tree.root.rpm
+    if job.aggregate:
+        aggregate = tree.get_aggregate()
+        payload['aggregate'] = [[rqr.recipe.id, rqr.resource.id, rqr.quantity] for rqr in aggregate.recipes.values()] \
+            + [[None, rr.resource.id, rr.quantity] for rr in aggregate.raw.values()]
+
+    graph = chaining.convert_to_graph(tree, product)
+    graph.integer_scales = True
+    graph.update_scales()
+    payload['stages'] = [[node.recipe_id(), node.recipe.scale, node.level] for node in graph.as_list()]
+    payload['inputs'] = {res_id: res_qt.quantity for res_id, res_qt in graph.external_inputs().pairs()}
+    return payload, tree
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Worker processes                                                                                                   #
+#----------------------------------------------------------------------------------------------------------------------#
+
+# repository of the current worker process, set once by _init_worker (or inherited when forking)
+_WORKER_REPO: typing.Optional[RecipeRepository] = None
+_WORKER_SHM: typing.Optional['SharedPackedRepository'] = None
+
+
+def worker_repository() -> typing.Optional[RecipeRepository]:
+    # repository of the current worker process, for functions submitted to a pool initialized by _init_worker
+    return _WORKER_REPO
+
+
+def serialize_repository(repo: RecipeRepository) -> tuple[list[dict], list[dict]]:
+    return [r.as_dict() for r in repo.resources.values()], [r.as_dict() for r in repo.recipes.values()]
+
+
+def deserialize_repository(snapshot: tuple[list[dict], list[dict]]) -> RecipeRepository:
+    repo = RecipeRepository()
+    resources, recipes = snapshot
+    for res_dict in resources:
+        repo.load_resource(res_dict)
+    for rec_dict in recipes:
+        repo.load_recipe(rec_dict)
+    return repo
+
+
+def _init_worker(snapshot: typing.Optional[tuple[list[dict], list[dict]]], shm_name: typing.Optional[str]):
+    global _WORKER_REPO, _WORKER_SHM
+    if shm_name is not None:
+        from packed import SharedPackedRepository
+        _WORKER_SHM = SharedPackedRepository.attach(shm_name)
+        _WORKER_REPO = _WORKER_SHM.repository
+    elif snapshot is not None:
+        _WORKER_REPO = deserialize_repository(snapshot)
+
+
+def _run_chunk(chunk: list[tuple[int, PlanJob]], with_reachable: bool = False) -> list[dict]:
+    results = []
+    for index, job in chunk:
+        try:
+            payload, tree = plan_tree(_WORKER_REPO, job)
+            if with_reachable and tree is not None:
+                payload['reachable'] = sorted(chaining.reachable_products(tree))
+        except Exception as e:
+            payload = {'recipe': job.recipe_id, 'product': job.product_id, 'rpm': job.rpm, 'error': str(e)}
+        payload['index'] = index
+        results.append(payload)
+    return results
+
+
+def _chunks(jobs: list[PlanJob], chunksize: int) -> list[list[tuple[int, PlanJob]]]:
+    indexed = list(enumerate(jobs))
+    return [indexed[i:i + chunksize] for i in range(0, len(indexed), chunksize)]
+
+
+def run_jobs(repo: RecipeRepository, jobs: list[PlanJob], workers: typing.Optional[int] = None,
+             chunksize: typing.Optional[int] = None, ordered: bool = True, shared: bool = True,
+             with_reachable: bool = False) -> Iterator[dict]:
+    # Plans all jobs in a process pool. Each worker receives the repository once: attached from a packed copy in shared
+    # memory if shared is set, otherwise inherited when the platform supports forking or as a serialized snapshot
+    # passed to the pool initializer. Payloads carry the job index, and are yielded in job order if ordered is set or
+    # as soon as their chunk completes otherwise. With with_reachable, payloads also list the products the plan depends
+    # on (see chaining.reachable_products).
+    global _WORKER_REPO
+    if len(jobs) == 0:
+        return
+    # workers are started lazily, all of them have to see the same state of the repository
+    repo = repo.snapshot()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * 4))
+    chunks = _chunks(jobs, chunksize)
+    # the repository is only set for the workers while the jobs run, the calling process keeps its own
+    previous_repo = _WORKER_REPO
+
+    if workers == 1:
+        _WORKER_REPO = repo
+        try:
+            for chunk in chunks:
+                yield from _run_chunk(chunk, with_reachable)
+        finally:
+            _WORKER_REPO = previous_repo
+        return
+
+    # multiprocessing is only imported when a pool is actually used, keeping the startup of the CLI fast
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from packed import SharedPackedRepository
+
+    shm = None
+    snapshot = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context('spawn')
+    if shared:
+        shm = SharedPackedRepository.create(repo)
+    elif context.get_start_method() == 'fork':
+        _WORKER_REPO = repo
+    else:
+        snapshot = serialize_repository(repo)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(snapshot, shm.name if shm is not None else None)) as executor:
+            if ordered:
+                for results in executor.map(_run_chunk, chunks, [with_reachable] * len(chunks)):
+                    yield from results
+            else:
+                futures = [executor.submit(_run_chunk, chunk, with_reachable) for chunk in chunks]
+                for future in as_completed(futures):
+                    yield from future.result()
+    finally:
+        _WORKER_REPO = previous_repo
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+def all_product_jobs(repo: RecipeRepository, rpm: typing.Optional[float] = None,
+                     excluded: typing.Optional[Iterable[str]] = None, max_depth: int = 15,
+                     aggregate: bool = False) -> list[PlanJob]:
+    jobs = []
+    for recipe in repo.recipes.values():
+        for product_id in recipe.products.keys():
+            jobs.append(PlanJob(recipe.id, product_id, rpm, excluded, max_depth, aggregate))
+    return jobs
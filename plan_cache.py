@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import typing
+from collections import OrderedDict
+from collections.abc import Iterable
+
+import chaining
+import parallel
+from parallel import PlanJob
+from repository import RecipeRepository
+
+# files kept in the cache directory, the least recently used are removed beyond this
+DEFAULT_MAX_FILES = 4096
+
+
+def request_key(job: PlanJob, kind: str = 'payload') -> str:
+    # normalized representation of a planning request, RPMs are compared with a precision of 1e-6
+    rpm = round(job.rpm, 6) if job.rpm is not None else None
+    return json.dumps([kind, job.recipe_id, job.product_id, rpm, sorted(job.excluded), job.max_depth, job.aggregate])
+
+
+class _Entry:
+    __slots__ = ('value', 'root', 'dependencies', 'repo_token', 'generation')
+
+    def __init__(self, value, root: tuple[str, str], dependencies: dict[str, str], repo_token: int, generation: int):
+        self.value = value
+        # (recipe id, digest) of the root recipe
+        self.root = root
+        self.dependencies = dependencies
+        self.repo_token = repo_token
+        self.generation = generation
+
+
+class PlanCache:
+    # Two-layer cache of planning results: an in-memory LRU and an optional directory of JSON files. Every entry stores
+    # digests of the recipes producing each product the plan depends on, so an entry is only invalidated if one of
+    # those changed. Entries checked against the current generation of a repository are not checked again until the
+    # repository is modified. Files of invalid or unreadable entries are removed when they are looked up, and the
+    # directory is limited to max_files files by removing the least recently used ones.
+
+    def __init__(self, max_entries: int = 256, directory: typing.Optional[str] = None,
+                 max_files: int = DEFAULT_MAX_FILES):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_files = max_files
+        self._file_count = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._digests: dict[str, str] = dict()
+        self._digests_generation: tuple[int, int] = (0, -1)
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._file_count = self._prune_files(max_files)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # digests
+
+    def _recipe_digest(self, repo: RecipeRepository, recipe_id: str) -> typing.Optional[str]:
+        if self._digests_generation != (repo.token, repo.generation):
+            self._digests.clear()
+            self._digests_generation = (repo.token, repo.generation)
+        digest = self._digests.get(recipe_id, None)
+        if digest is None:
+            recipe = repo.recipe(recipe_id)
+            if recipe is None:
+                return None
+            encoded = json.dumps(recipe.as_dict(), sort_keys=True).encode('utf-8')
+            digest = hashlib.sha1(encoded).hexdigest()
+            self._digests[recipe_id] = digest
+        return digest
+
+    def _product_digest(self, repo: RecipeRepository, product_id: str) -> typing.Optional[str]:
+        product = repo.resource(product_id)
+        if product is None:
+            return None
+        recipe_digests = sorted(self._recipe_digest(repo, r.id) for r in repo.find_recipes_by_product(product))
+        return hashlib.sha1(','.join(recipe_digests).encode('utf-8')).hexdigest()
+
+    def _dependencies(self, repo: RecipeRepository, products: Iterable[str]) -> dict[str, str]:
+        return {product_id: self._product_digest(repo, product_id) for product_id in products}
+
+    def _is_valid(self, repo: RecipeRepository, entry: _Entry) -> bool:
+        if entry.repo_token == repo.token and entry.generation == repo.generation:
+            return True
+        if self._recipe_digest(repo, entry.root[0]) != entry.root[1]:
+            return False
+        for product_id, digest in entry.dependencies.items():
+            if self._product_digest(repo, product_id) != digest:
+                return False
+        entry.repo_token = repo.token
+        entry.generation = repo.generation
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # layers
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, key: str) -> typing.Optional[_Entry]:
+        path = self._path(key)
+        try:
+            with open(path, 'r') as entry_file:
+                stored = json.load(entry_file)
+            if stored.get('key') != key:
+                # another key with the same hash, it is replaced when this one is stored
+                return None
+            entry = _Entry(stored['value'], tuple(stored['root']), dict(stored['dependencies']), 0, -1)
+        except OSError:
+            return None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._remove_file(key)
+            return None
+        try:
+            # the modification time orders the files for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _store(self, key: str, entry: _Entry):
+        path = self._path(key)
+        tmp_path = f'{path}.tmp'
+        try:
+            exists = os.path.exists(path)
+            with open(tmp_path, 'wt') as entry_file:
+                json.dump({'key': key, 'root': entry.root, 'dependencies': entry.dependencies,
+                           'value': entry.value}, entry_file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f'plan cache: failed to write {path}: {e}')
+            return
+        if not exists:
+            self._file_count += 1
+            if self._file_count > self.max_files:
+                # pruned below the limit, so the directory is not listed again on every store
+                self._file_count = self._prune_files(self.max_files * 3 // 4)
+
+    def _remove_file(self, key: str):
+        try:
+            os.remove(self._path(key))
+            self._file_count -= 1
+        except OSError:
+            pass
+
+    def _prune_files(self, limit: int) -> int:
+        # removes the least recently used files beyond limit and leftovers of interrupted writes, returns the number
+        # of files left
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for dir_entry in it:
+                    try:
+                        if dir_entry.name.endswith('.json.tmp'):
+                            os.remove(dir_entry.path)
+                        elif dir_entry.name.endswith('.json'):
+                            files.append((dir_entry.stat().st_mtime, dir_entry.path))
+                    except OSError:
+                        pass
+        except OSError as e:
+            print(f'plan cache: failed to list {self.directory}: {e}')
+            return 0
+        files.sort()
+        removed = 0
+        for _, path in files[:max(len(files) - limit, 0)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return len(files) - removed
+
+    def get(self, repo: RecipeRepository, key: str, persistent: bool = True):
+        entry = self._entries.get(key, None)
+        if entry is None and persistent and self.directory is not None:
+            entry = self._load(key)
+        if entry is not None and self._is_valid(repo, entry):
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            self.hits += 1
+            return entry.value
+        if entry is not None and persistent and self.directory is not None:
+            # the stored entry depends on the same recipes and is just as outdated
+            self._remove_file(key)
+        self._entries.pop(key, None)
+        self.misses += 1
+        return None
+
+    def put(self, repo: RecipeRepository, key: str, root_recipe_id: str, reachable: Iterable[str], value,
+            persistent: bool = True):
+        root = (root_recipe_id, self._recipe_digest(repo, root_recipe_id))
+        entry = _Entry(value, root, self._dependencies(repo, reachable), repo.token, repo.generation)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+        if persistent and self.directory is not None:
+            self._store(key, entry)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # planning
+
+    def plan_payload(self, repo: RecipeRepository, job: PlanJob) -> dict:
+        key = request_key(job)
+        payload = self.get(repo, key)
+        if payload is None:
+            payload, tree = parallel.plan_tree(repo, job)
+            if tree is not None:
+                self.put(repo, key, job.recipe_id, chaining.reachable_products(tree), payload)
+        return payload
+
+    def cached_tree(self, repo: RecipeRepository, job: PlanJob) -> typing.Optional[chaining.ProductionTree]:
+        # built trees are only cached in memory; every hit is a copy with reset alternatives, the cached tree may be in
+        # use (e.g. displayed) and switched meanwhile
+        tree = self.get(repo, request_key(job, 'tree'), persistent=False)
+        if tree is None:
+            return None
+        copy = chaining.rescaled_tree(tree, tree.root.rpm)
+        copy.reset_alternatives()
+        return copy
+
+    def put_tree(self, repo: RecipeRepository, job: PlanJob, tree: chaining.ProductionTree):
+        self.put(repo, request_key(job, 'tree'), job.recipe_id, chaining.reachable_products(tree), tree,
+                 persistent=False)
+
+    def plan_tree(self, repo: RecipeRepository, job: PlanJob,
+                  stats: typing.Optional[chaining.PlanStats] = None) -> typing.Optional[chaining.ProductionTree]:
+        # build statistics are only collected by building, the cached tree is not used then
+        tree = self.cached_tree(repo, job) if stats is None else None
+        if tree is None:
+            tree = parallel.build_tree(repo, job, stats=stats)
+            if tree is not None:
+                self.put_tree(repo, job, tree)
+        return tree
+
+    def run_jobs(self, repo: RecipeRepository, jobs: list[PlanJob], workers: typing.Optional[int] = None,
+                 chunksize: typing.Optional[int] = None, shared: bool = True) -> list[dict]:
+        # like parallel.run_jobs (ordered), but only jobs which are not cached are sent to the worker pool
+        results: list[typing.Optional[dict]] = [None] * len(jobs)
+        missing = []
+        for i, job in enumerate(jobs):
+            cached = self.get(repo, request_key(job))
+            if cached is None:
+                missing.append(i)
+            else:
+                results[i] = dict(cached)
+        missing_jobs = [jobs[i] for i in missing]
+        for payload in parallel.run_jobs(repo, missing_jobs, workers, chunksize, True, shared, with_reachable=True):
+            index = missing[payload.pop('index')]
+            reachable = payload.pop('reachable', None)
+            if reachable is not None:
+                self.put(repo, request_key(jobs[index]), jobs[index].recipe_id, reachable, payload)
+            results[index] = dict(payload)
+        for i, payload in enumerate(results):
+            payload['index'] = i
+        return results
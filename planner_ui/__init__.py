@@ -80,8 +80,9 @@ class Controller(typing.Generic[T], ABC):
                 return
         self.__CB_ENTITIES_CHANGED.append((cb, entity_type))
 
-    def notify_entities_changed(self, entity_type: type):
-        for cb, et in self.__CB_ENTITIES_CHANGED:
+    @classmethod
+    def notify_entities_changed(cls, entity_type: type):
+        for cb, et in cls.__CB_ENTITIES_CHANGED:
             if et is None or et == entity_type:
                 cb()
 
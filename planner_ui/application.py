@@ -1,16 +1,22 @@
+import time
 import tkinter as tk
 import tkinter.ttk as ttk
 import typing
+from collections.abc import Callable
 
 from data import Resource, Recipe
 from config import MainConfig
 from . import Controller, AppGlobals, add_unimplemented_label
 from .entity_select import EntitySelectController
+from plan_cache import PlanCache
 from repository import RecipeRepository
 from .planner import Planner, PlannerController
 from .recipe_edit import RecipeEditController
 from .resource_edit import ResourceEditController
 
+if typing.TYPE_CHECKING:
+    from watcher import RepositoryWatcher
+
 
 class MainButtons(tk.Frame):
 
@@ -20,24 +26,48 @@ class MainButtons(tk.Frame):
         self.btn_quit.grid(row=0, column=1)
 
 
+class StartupTimer:
+    # Times of the startup phases since the GUI was started, printed with --debug
+    __slots__ = ('started', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        self.phases.append((phase, time.perf_counter() - self.started))
+
+    def report(self):
+        print('GUI startup: ' + ', '.join(f'{phase} after {secs * 1000:.1f}ms' for phase, secs in self.phases))
+
+
 class Application(tk.Frame):
 
-    def __init__(self, repo: RecipeRepository, master=None):
+    def __init__(self, repo: RecipeRepository, master=None, plan_cache: typing.Optional[PlanCache] = None,
+                 watcher: typing.Optional['RepositoryWatcher'] = None, timer: typing.Optional[StartupTimer] = None):
         super().__init__(master)
         if master is not None:
             AppGlobals.set('validate_id_fmt', master.register(repo.validate_id_format))
         self.repository = repo
+        self.timer = timer
         self.nb_editor = ttk.Notebook(self)
-        self.resource_edit = ResourceEditController(self.nb_editor, 'res_edit', None, repo)
-
-        self.recipe_editor = RecipeEditController(self.nb_editor, 'recipe_edit', None, repo)
-        self.planner = PlannerController(self.nb_editor, 'planner', None, repo)
-
-        self.nb_editor.add(self.resource_edit.widget(), text='Resources', padding=(10, 10), sticky=tk.NSEW)
-        self.nb_editor.add(self.recipe_editor.widget(), text='Recipes', padding=(10, 10))
-        self.nb_editor.add(self.planner.widget(), text='Planner', padding=(10, 10))
+        # Tabs are created empty, their controllers are built when the tab is selected for the first time and entity
+        # lists are populated when they are shown, so the window appears in the same time for any repository size.
+        self.resource_edit: typing.Optional[ResourceEditController] = None
+        self.recipe_editor: typing.Optional[RecipeEditController] = None
+        self.planner: typing.Optional[PlannerController] = None
+        # tab widget name -> (text, attribute of the controller, factory)
+        self._tabs: dict[str, tuple[str, str, Callable[[tk.Widget], Controller]]] = dict()
+        self.add_tab('Resources', 'resource_edit',
+                     lambda master: ResourceEditController(master, 'res_edit', None, repo))
+        self.add_tab('Recipes', 'recipe_editor',
+                     lambda master: RecipeEditController(master, 'recipe_edit', None, repo))
+        self.add_tab('Planner', 'planner',
+                     lambda master: PlannerController(master, 'planner', None, repo, plan_cache))
+        self.nb_editor.bind('<<NotebookTabChanged>>', self.cb_tab_changed)
         self.nb_editor.grid(row=0, column=0, padx=10, pady=10, sticky=tk.NSEW)
         self.grid(sticky=tk.NSEW)
+        self.build_tab()
 
         self.main_buttons = MainButtons(self)
         self.main_buttons.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW, padx=10, pady=10)
@@ -45,6 +75,57 @@ class Application(tk.Frame):
         self.columnconfigure(index=0, weight=1)
         self.rowconfigure(index=0, weight=1)
 
+        self.watcher = watcher
+        if watcher is not None:
+            self.after(int(watcher.interval * 1000), self.poll_data_files)
+        if timer is not None:
+            self.after_idle(self.cb_started)
+
+    def add_tab(self, text: str, attr: str, factory: Callable[[tk.Widget], Controller]):
+        frame = ttk.Frame(self.nb_editor)
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+        self.nb_editor.add(frame, text=text, padding=(10, 10), sticky=tk.NSEW)
+        self._tabs[str(frame)] = (text, attr, factory)
+
+    def build_tab(self):
+        # builds the selected tab if it was not shown before
+        tab = self.nb_editor.select()
+        entry = self._tabs.pop(tab, None)
+        if entry is None:
+            return
+        text, attr, factory = entry
+        started = time.perf_counter()
+        controller = factory(self.nb_editor.nametowidget(tab))
+        controller.widget().grid(row=0, column=0, sticky=tk.NSEW)
+        setattr(self, attr, controller)
+        if self.timer is not None:
+            print(f'GUI: {text} tab built in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+    def cb_tab_changed(self, event):
+        self.build_tab()
+
+    def cb_started(self):
+        # first idle time after creating the application: the window is drawn, the lists are populated after that
+        self.update_idletasks()
+        self.timer.mark('window shown')
+        self.after_idle(self.cb_populated)
+
+    def cb_populated(self):
+        self.timer.mark('lists populated')
+        self.timer.report()
+
+    def poll_data_files(self):
+        # runs in the Tk event loop, so no view is updated while the repository changes
+        reloaded = self.watcher.poll()
+        if reloaded is not None:
+            print(f'Reloaded changed data files: {reloaded}')
+            if reloaded.changed('resource'):
+                Controller.notify_entities_changed(Resource)
+            if reloaded.changed('recipe'):
+                Controller.notify_entities_changed(Recipe)
+        self.after(int(self.watcher.interval * 1000), self.poll_data_files)
+
     def select_entity(self):
         if self.sub_view is not None:
             print(f'SubView: {self.sub_view.value()}')
@@ -61,6 +142,7 @@ def set_productivity_look(style: ttk.Style):
     style.configure("Treeview", background=tv_bg_name, fieldbackground=tv_bg_name)
 
 def main(config: MainConfig):
+    timer = StartupTimer() if config.debug else None
     root = tk.Tk()
     style = ttk.Style()
     if config.theme in style.theme_names():
@@ -71,6 +153,11 @@ def main(config: MainConfig):
 
     root.columnconfigure(0, weight=1)
     root.rowconfigure(0, weight=1)
-    app = Application(config.repository, master=style.master)
+    if timer is not None:
+        timer.mark('Tk initialized')
+    app = Application(config.repository, master=style.master, plan_cache=config.plan_cache, watcher=config.watcher,
+                      timer=timer)
+    if timer is not None:
+        timer.mark('application created')
     app.master.title(f'Factory Planner {MainConfig.APP_VERSION}')
     root.mainloop()
@@ -9,6 +9,7 @@ from typing import Optional
 
 from data import Entity, Recipe, Resource, ResourceQuantity, ResourceQuantities
 from repository import RecipeRepository
+from search_index import SearchIndex
 from . import T, RootController, View
 
 from .application import Controller
@@ -33,25 +34,45 @@ class RecipeInfoVars:
 class EntitySelectController(RootController[Entity]):
     DUMMY_NAME = '<<new>>'
     DUMMY_ID = '<<dummy_id>>'
+    # rows inserted at once, and the fraction of the loaded rows scrolled past before the next page is inserted
+    PAGE_SIZE = 200
+    PAGE_THRESHOLD = 0.9
+    # delay after the last keystroke before the search is applied
+    SEARCH_DELAY_MS = 150
 
     def __init__(self, master, view_name: str, parent: typing.Optional[Controller], repository: RecipeRepository,
-                 entity_type: type, label_text=None, show_info=False, is_readonly=True, id_filter: typing.Optional[list[str]]=None):
+                 entity_type: type, label_text=None, show_info=False, is_readonly=True, id_filter: typing.Optional[set[str]]=None):
         super().__init__(view_name, parent, repository)
         self.id_filter = id_filter
         self.entity_type = entity_type
-        self.entity_source = self.repository.resources if issubclass(self.entity_type,
-                                                                     Resource) else self.repository.recipes
         self.dummy_entity: typing.Optional[Entity] = None
         self.var_entities = tk.StringVar()
         self.repository = repository
         self.listeners_attr_change = []
         self.listeners_sel_change = []
+        # built on the first search and synced with the repository when its generation changed
+        self.search_index: typing.Optional[SearchIndex] = None
+        self._index_generation = -1
+        self.search_text = ''
+        self._search_job = None
+        self.var_search = tk.StringVar()
+        self.var_search.trace_add('write', self.cb_search_changed)
 
         if label_text is None:
             label_text = 'Resource' if entity_type is Resource else 'Recipe'
 
+        # Rows of the list as (id, text) and the number of them inserted into the Treeview, which always holds
+        # exactly rows[:loaded] in this order. Further rows are inserted page by page when the list is scrolled close
+        # to its end, so large repositories do not block the UI with tens of thousands of inserts.
+        self._rows: list[tuple[str, str]] = []
+        self._row_index: typing.Optional[dict[str, int]] = None
+        self._loaded = 0
+        self._page_pending = False
+        # the list is populated at idle time after it was shown for the first time
+        self._populated = False
+
         self.view = EntitySelect(master, self, label_text)
-        self.update_entities()
+        self.view.bind('<Map>', self.cb_map, add='+')
         self.entity_attr_controller = None
 
         if show_info:
@@ -64,15 +85,119 @@ class EntitySelectController(RootController[Entity]):
 
         self.register_entities_changed(self.update_entities, entity_type)
 
-    def update_entities(self):
-        self.clear_display()
-        for e_id, entity in self.entity_source.items():
-            if self.id_filter is not None:
-                if not e_id in self.id_filter:
-                    continue
-            self.view.tv_entities.insert('', 'end', id=e_id, text=entity.name)
+    @property
+    def entity_source(self) -> dict[str, Entity]:
+        # looked up on every use, the repository replaces its maps when they are modified after a snapshot
+        return self.repository.resources if issubclass(self.entity_type, Resource) else self.repository.recipes
+
+    def matching_ids(self) -> typing.Optional[list[str]]:
+        # IDs matching the search text, best matches first, or None if there is no search text
+        if len(self.search_text.strip()) == 0:
+            return None
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+        if self._index_generation != self.repository.generation:
+            self.search_index.sync(self.entity_source)
+            self._index_generation = self.repository.generation
+        return self.search_index.search(self.search_text)
+
+    def entity_rows(self) -> list[tuple[str, str]]:
+        source = self.entity_source
+        ids = self.matching_ids()
+        if ids is None:
+            return [(e_id, entity.name) for e_id, entity in source.items()
+                    if self.id_filter is None or e_id in self.id_filter]
+        return [(e_id, source[e_id].name) for e_id in ids if self.id_filter is None or e_id in self.id_filter]
+
+    def display_rows(self) -> list[tuple[str, str]]:
+        rows = self.entity_rows()
         if self.dummy_entity is not None:
-            self.view.tv_entities.insert('', 'end', iid=self.dummy_entity.id, text=self.dummy_entity.name)
+            rows.append((self.dummy_entity.id, self.dummy_entity.name))
+        return rows
+
+    def cb_map(self, event):
+        if not self._populated:
+            self.view.after_idle(self.populate)
+
+    def populate(self):
+        if not self._populated:
+            self._populated = True
+            self.update_entities()
+
+    def update_entities(self):
+        if not self._populated:
+            return
+        # Applies the difference between the displayed rows and the current entities: only rows which were added,
+        # removed, renamed or moved within the loaded range are touched, selection and scroll position are kept.
+        rows = self.display_rows()
+        tv = self.view.tv_entities
+        old = self._rows[:self._loaded]
+        loaded = min(len(rows), max(self._loaded, self.PAGE_SIZE))
+        new = rows[:loaded]
+
+        new_ids = {e_id for e_id, _ in new}
+        stale = [e_id for e_id, _ in old if e_id not in new_ids]
+        if len(stale) > 0:
+            tv.delete(*stale)
+        old_text = dict(old)
+        current = [e_id for e_id, _ in old if e_id in new_ids]
+        moved = set()
+        pos = 0
+        for index, (e_id, text) in enumerate(new):
+            while pos < len(current) and current[pos] in moved:
+                pos += 1
+            if pos < len(current) and current[pos] == e_id:
+                pos += 1
+            elif e_id in old_text:
+                tv.move(e_id, '', index)
+                moved.add(e_id)
+            else:
+                tv.insert('', index, iid=e_id, text=text)
+                continue
+            if old_text[e_id] != text:
+                tv.item(e_id, text=text)
+
+        self._rows = rows
+        self._row_index = None
+        self._loaded = loaded
+
+    def load_page(self, count: typing.Optional[int] = None):
+        self._page_pending = False
+        end = min(len(self._rows), self._loaded + (count if count is not None else self.PAGE_SIZE))
+        tv = self.view.tv_entities
+        for e_id, text in self._rows[self._loaded:end]:
+            tv.insert('', 'end', iid=e_id, text=text)
+        self._loaded = max(self._loaded, end)
+
+    def ensure_loaded(self, e_id: str) -> bool:
+        # loads the rows up to the given one (and a page beyond it), returns False if it is not displayed at all
+        if self._row_index is None:
+            self._row_index = {row_id: i for i, (row_id, _) in enumerate(self._rows)}
+        index = self._row_index.get(e_id, None)
+        if index is None:
+            return False
+        if index >= self._loaded:
+            self.load_page(index + 1 - self._loaded + self.PAGE_SIZE)
+        return True
+
+    def cb_search_changed(self, *args):
+        if self._search_job is not None:
+            self.view.after_cancel(self._search_job)
+        self._search_job = self.view.after(self.SEARCH_DELAY_MS, self.apply_search)
+
+    def apply_search(self):
+        self._search_job = None
+        search_text = self.var_search.get()
+        if search_text != self.search_text:
+            self.search_text = search_text
+            self.update_entities()
+
+    def cb_scroll(self, first, last):
+        self.view.sb_entities.set(first, last)
+        # rows are inserted after the scroll event was handled, inserting triggers this callback again
+        if float(last) >= self.PAGE_THRESHOLD and self._loaded < len(self._rows) and not self._page_pending:
+            self._page_pending = True
+            self.view.after_idle(self.load_page)
 
     def add_dummy(self, entity: Entity):
         if self.dummy_entity is None:
@@ -141,8 +266,12 @@ class EntitySelectController(RootController[Entity]):
     def clear_display(self):
         items = self.view.tv_entities.get_children()
         self.view.tv_entities.delete(*items)
+        self._rows = []
+        self._row_index = None
+        self._loaded = 0
 
     def set_value(self, val: Optional[Entity | str]):
+        self.populate()
         if isinstance(val, str):
             sel_id = val
         elif val is None:
@@ -157,7 +286,7 @@ class EntitySelectController(RootController[Entity]):
                 sel_id = val.id
             elif self.dummy_entity is not None and self.dummy_entity.id == val.id:
                 sel_id = self.dummy_entity.id
-        if sel_id is None:
+        if sel_id is None or not self.ensure_loaded(sel_id):
             print(f'WARN: requested item "{val}" is not in repository!')
         else:
             self.view.tv_entities.selection_set(sel_id)
@@ -179,17 +308,33 @@ class EntitySelect(ttk.Labelframe, View):
     def __init__(self, master, controller: EntitySelectController, label_text: str):
         View.__init__(self, controller)
         super().__init__(master=master, text=label_text, padding=(4, 4))
+        self.en_search = ttk.Entry(self, textvariable=controller.var_search)
+        self.en_search.bind('<Escape>', lambda e: controller.var_search.set(''))
+        self.en_search.grid(row=0, column=0, columnspan=2, sticky=tk.EW, padx=10, pady=(10, 0))
         self.tv_entities = ttk.Treeview(self)
+        self.sb_entities = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tv_entities.yview)
+        self.tv_entities.configure(yscrollcommand=self.controller.cb_scroll)
         self.tv_entities.bind('<<TreeviewSelect>>', self.controller.cb_select_entity)
-        self.tv_entities.grid(row=0, column=0, sticky=tk.NSEW, padx=10, pady=10)
+        self.list_row = 1
+        self.tv_entities.grid(row=self.list_row, column=0, sticky=tk.NSEW, padx=(10, 0), pady=10)
+        self.sb_entities.grid(row=self.list_row, column=1, sticky=tk.NS, padx=(0, 10), pady=10)
         self.columnconfigure(0, weight=2)
-        self.rowconfigure(0, weight=2)
+        self.rowconfigure(self.list_row, weight=2)
         self.info_view = None
 
+    def set_list_row(self, row: int):
+        # moves the search field to the given row and the list below it, e.g. to show a text above them
+        self.rowconfigure(self.list_row, weight=0)
+        self.list_row = row + 1
+        self.en_search.grid(row=row)
+        self.tv_entities.grid(row=self.list_row)
+        self.sb_entities.grid(row=self.list_row)
+        self.rowconfigure(self.list_row, weight=2)
+
     def init_info(self, info_view: tk.Widget):
         self.info_view = info_view
-        self.info_view.grid(row=0, column=1, sticky=tk.NSEW, padx=10, pady=10)
-        self.columnconfigure(1, weight=1)
+        self.info_view.grid(row=0, column=2, rowspan=2, sticky=tk.NSEW, padx=10, pady=10)
+        self.columnconfigure(2, weight=1)
 
 
 
@@ -199,21 +344,20 @@ class EntityMultiSelectController(EntitySelectController):
 
     def __init__(self, master, view_name: str, parent: typing.Optional[Controller], repository: RecipeRepository,
                  entity_type: type, label_text=None, is_readonly=True,
-                 id_filter: typing.Optional[list[str]] = None):
+                 id_filter: typing.Optional[set[str]] = None):
 
         super().__init__(master, view_name, parent, repository, entity_type, label_text, False, is_readonly, id_filter)
         self.view.tv_entities.configure(selectmode='extended')
-        self.update_entities()
-        self.view.tv_entities.selection_set((self._NONE_ID,))
 
-    def update_entities(self):
-        self.clear_display()
-        self.view.tv_entities.insert('', 'end', id=self._NONE_ID, text=self._NONE_NAME)
-        for e_id, entity in self.entity_source.items():
-            if self.id_filter is not None:
-                if not e_id in self.id_filter:
-                    continue
-            self.view.tv_entities.insert('', 'end', id=e_id, text=entity.name)
+    def populate(self):
+        if not self._populated:
+            super().populate()
+            self.view.tv_entities.selection_set((self._NONE_ID,))
+
+    def display_rows(self) -> list[tuple[str, str]]:
+        rows = [(self._NONE_ID, self._NONE_NAME)]
+        rows.extend(self.entity_rows())
+        return rows
 
     def selected(self) -> list[Entity]:
         entities = []
@@ -1,30 +1,155 @@
+import threading
+import time
 import tkinter as tk
 import tkinter.ttk as ttk
 import typing
+from collections.abc import Callable
 from tkinter import StringVar, Label
 from typing import Optional
 from tkinter.font import Font
 
 import chaining
-from chaining import ProductionGraph, ProductionTree
+from chaining import GraphNode, ProductionGraph, ProductionTree
 from data import Recipe, Resource
 from . import Controller, RootController, T, View
+import parallel
+from parallel import PlanJob
+from plan_cache import PlanCache
 from repository import RecipeRepository
 from .entity_select import EntitySelectController, EntitySelect, EntityMultiSelectController
 
 
+class _GenerationTask:
+    # Builds a tree with its alternatives and station plan in a background thread, over a snapshot of the repository.
+    # The controller polls it from the Tk event loop; results of tasks which were superseded are never delivered.
+    # If the displayed plan is given as base (tree, job, alternatives, (alt_count, alt_pareto) of the alternatives), the
+    # tree is derived from it when only the RPM or the exclusions changed: rescaled, or patched for the changed
+    # exclusions. The alternatives of the base are only reused if they were searched with the same settings. If
+    # profile_path is given, the work of the thread is profiled into it.
+
+    def __init__(self, snapshot: RecipeRepository, job: PlanJob, tree: typing.Optional[ProductionTree],
+                 alt_count: int, alt_pareto: bool,
+                 base: typing.Optional[tuple[ProductionTree, PlanJob, list[chaining.PlanAlternative],
+                                             tuple[int, bool]]] = None,
+                 profile_path: typing.Optional[str] = None):
+        self.snapshot = snapshot
+        self.job = job
+        self.tree = tree
+        self.base = base
+        # how the tree was obtained: 'cached', 'built', 'rescaled' or 'patched'
+        self.mode = 'cached' if tree is not None else 'built'
+        self.alt_count = alt_count
+        self.alt_pareto = alt_pareto
+        self.profile_path = profile_path
+        self.monitor = chaining.BuildMonitor()
+        self.alternatives: list[chaining.PlanAlternative] = []
+        self.graph: typing.Optional[ProductionGraph] = None
+        self.error: typing.Optional[str] = None
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.done = False
+        self._thread = threading.Thread(target=self._run, name='planner-generate', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self.monitor.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.monitor.cancelled
+
+    @property
+    def is_new_tree(self) -> bool:
+        return self.mode != 'cached'
+
+    def _derive(self):
+        base_tree, base_job, base_alternatives, base_alt_settings = self.base
+        self.tree = parallel.replan_tree(self.snapshot, base_tree, base_job, self.job, self.monitor)
+        if self.tree is None:
+            return
+        if base_job.excluded != self.job.excluded:
+            self.mode = 'patched'
+            return
+        self.mode = 'rescaled'
+        # alternatives are calculated per unit of the root's RPM
+        if base_tree.root.rpm > 0 and base_alt_settings == (self.alt_count, self.alt_pareto):
+            factor = self.tree.root.rpm / base_tree.root.rpm
+            self.alternatives = [alternative.scaled(factor) for alternative in base_alternatives]
+
+    def _run(self):
+        if self.profile_path is None:
+            self._generate()
+        else:
+            import profiling
+            try:
+                with profiling.Profile(self.profile_path, f'generate {self.job.recipe_id}'):
+                    self._generate()
+            except ValueError as e:
+                self.error = str(e)
+                self.profile_path = None
+        self.duration = time.perf_counter() - self.started
+        self.done = True
+
+    def _generate(self):
+        try:
+            if self.tree is None and self.base is not None:
+                self._derive()
+            if self.tree is None:
+                self.mode = 'built'
+                self.tree = parallel.build_tree(self.snapshot, self.job, self.monitor)
+            if self.tree is None:
+                self.error = 'recipe or product does not exist anymore'
+            elif not self.cancelled:
+                # a rescaled tree keeps the scaled alternatives of its base
+                if len(self.alternatives) == 0 and self.alt_pareto:
+                    self.alternatives = chaining.find_alternatives(self.tree, mode='pareto', limit=self.alt_count,
+                                                                   monitor=self.monitor)
+                elif len(self.alternatives) == 0:
+                    self.alternatives = chaining.find_alternatives(self.tree, k=self.alt_count, monitor=self.monitor)
+                self.graph = chaining.convert_to_graph(self.tree, self.tree.root.production.product,
+                                                       monitor=self.monitor)
+                self.graph.integer_scales = True
+                self.graph.update_scales()
+        except chaining.BuildCancelled:
+            pass
+        except Exception as e:
+            self.error = str(e)
+
+
 class PlannerController(RootController):
+    POLL_INTERVAL_MS = 50
+    # delay after the last change of the inputs before re-planning in live mode
+    LIVE_DELAY_MS = 300
 
-    def __init__(self, master, v_id: str, parent: typing.Optional[typing.Self], repository: RecipeRepository):
+    def __init__(self, master, v_id: str, parent: typing.Optional[typing.Self], repository: RecipeRepository,
+                 plan_cache: typing.Optional[PlanCache] = None):
         super().__init__(v_id, parent, repository)
+        self.plan_cache = plan_cache if plan_cache is not None else PlanCache()
         self.var_target_rpm = tk.DoubleVar()
+        self.var_alt_count = tk.IntVar(value=5)
+        self.var_alt_pareto = tk.BooleanVar(value=False)
+        self.tree: typing.Optional[ProductionTree] = None
+        # job of the displayed tree and the repository generation it was planned at
+        self.job: typing.Optional[PlanJob] = None
+        self._tree_generation = -1
+        self.alternatives: list[chaining.PlanAlternative] = []
+        # (alt_count, alt_pareto) the alternatives were searched with
+        self._alt_settings = (0, False)
+        self.var_status = tk.StringVar()
+        self.var_live = tk.BooleanVar(value=False)
+        # profile the next generation
+        self.var_profile = tk.BooleanVar(value=False)
+        self._task: typing.Optional[_GenerationTask] = None
+        self._live_job = None
 
         self.view = Planner(master, self)
         self.ctl_recipe_select = EntitySelectController(self.view, 'recipe_sel', self, repository, Recipe,
                                                         'End Product Recipe', False, True)
 
         self.ctl_product_select = EntitySelectController(self.view, 'product_sel', self, repository, Resource,
-                                                         'Product', False, True, id_filter=[])
+                                                         'Product', False, True, id_filter=set())
         self.ctl_recipe_blacklist = EntityMultiSelectController(self.view, 'recipe_blacklist', self, repository, Recipe, 'Excluded Recipes', True, id_filter=None)
         self.ctl_station_plan = StationPlanViewController(self.view, 'stations', self)
         self.view.init_components(self.ctl_recipe_select.widget(), self.ctl_product_select.widget(),
@@ -32,18 +157,129 @@ class PlannerController(RootController):
                                   self.ctl_station_plan.widget())
         self.ctl_recipe_select.register_cb_sel_change(self.cb_recipe_sel_changed)
         self.ctl_product_select.register_cb_sel_change(self.cb_product_sel_changed)
+        self.ctl_recipe_blacklist.register_cb_sel_change(self.cb_plan_input_changed)
+        self.var_target_rpm.trace_add('write', self.cb_plan_input_changed)
+        self.ctl_station_plan.register_alternative_switch(self.cb_alternative_switch)
 
     def generate_chain(self, recipe: Recipe, product: Resource, rpm: float):
+        # a running generation is superseded, its result is dropped
+        self.cancel_generation()
         excluded_recipes = set(r.id for r in self.ctl_recipe_blacklist.value())
-        tree = ProductionTree(recipe, product, rpm)
-        tree.build(self.repository, excluded_recipes=excluded_recipes)
-        graph = chaining.convert_to_graph(tree, product)
+        job = PlanJob(recipe.id, product.id, rpm, excluded_recipes)
+        # the displayed plan is only a base for the new one if the repository did not change since
+        base = None
+        if self.tree is not None and self._tree_generation == self.repository.generation:
+            base = (self.tree, self.job, self.alternatives, self._alt_settings)
+        profile_path = None
+        if self.var_profile.get():
+            import profiling
+            profile_path = profiling.default_path('generate')
+            self.var_profile.set(False)
+        task = _GenerationTask(self.repository.snapshot(), job, self.plan_cache.cached_tree(self.repository, job),
+                               max(self.var_alt_count.get(), 1), self.var_alt_pareto.get(), base, profile_path)
+        self._task = task
+        task.start()
+        self.var_status.set('Generating...')
+        self.view.pb_generate.start()
+        self.view.btn_cancel.configure(state='normal')
+        self.view.after(self.POLL_INTERVAL_MS, self.poll_generation)
+
+    def poll_generation(self):
+        task = self._task
+        if task is None:
+            return
+        if not task.done:
+            self.var_status.set(f'Generating... {task.monitor.expanded} recipes expanded')
+            self.view.after(self.POLL_INTERVAL_MS, self.poll_generation)
+            return
+        self._task = None
+        self.view.pb_generate.stop()
+        self.view.btn_cancel.configure(state='disabled')
+        if task.error is not None:
+            self.var_status.set(f'Error: {task.error}')
+            return
+        if task.cancelled:
+            self.var_status.set('Cancelled')
+            return
+        # trees built from an outdated snapshot are shown but not cached
+        if task.is_new_tree and task.snapshot.generation == self.repository.generation:
+            self.plan_cache.put_tree(self.repository, task.job, task.tree)
+        self.tree = task.tree
+        self.job = task.job
+        self._tree_generation = task.snapshot.generation
+        self.alternatives = task.alternatives
+        self._alt_settings = (task.alt_count, task.alt_pareto)
+        self.show_alternatives()
+        self.ctl_station_plan.set_plan(task.tree, task.graph)
+        mode = f'{task.monitor.expanded} recipes expanded' if task.mode == 'built' else task.mode
+        profiled = f', profile written to {task.profile_path}' if task.profile_path is not None else ''
+        self.var_status.set(f'Generated in {task.duration:.2f}s ({mode}){profiled}')
+
+    def cb_plan_input_changed(self, *args):
+        # in live mode, the plan is updated shortly after the inputs stopped changing
+        if self._live_job is not None:
+            self.view.after_cancel(self._live_job)
+            self._live_job = None
+        if self.var_live.get():
+            self._live_job = self.view.after(self.LIVE_DELAY_MS, self.replan)
+
+    def replan(self):
+        self._live_job = None
+        recipe = self.ctl_recipe_select.value()
+        product = self.ctl_product_select.selected()
+        if not isinstance(recipe, Recipe) or not isinstance(product, Resource):
+            return
+        try:
+            rpm = self.var_target_rpm.get()
+        except tk.TclError:
+            # not a number (yet)
+            return
+        if rpm > 0:
+            self.generate_chain(recipe, product, rpm)
+
+    def cancel_generation(self, *args):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.view.pb_generate.stop()
+            self.view.btn_cancel.configure(state='disabled')
+            self.var_status.set('Cancelled')
+
+    def update_station_plan(self):
+        graph = chaining.convert_to_graph(self.tree, self.tree.root.production.product)
         graph.integer_scales = True
         graph.update_scales()
-        self.ctl_station_plan.set_value(graph)
+        self.ctl_station_plan.set_plan(self.tree, graph)
+
+    def show_alternatives(self):
+        tv = self.view.tv_alternatives
+        tv.delete(*tv.get_children())
+        for i, alternative in enumerate(self.alternatives):
+            selections = chaining.alternative_selections(self.tree, alternative)
+            tv.insert('', 'end', iid=str(i), values=(
+                f'{alternative.stations:.1f}', f'{alternative.raw_input:.1f}', alternative.recipe_count,
+                ', '.join(selected.name for _, selected in selections)
+            ))
+
+    def cb_alternative_selected(self, *args):
+        selection = self.view.tv_alternatives.selection()
+        # the displayed alternatives are about to be replaced by a running generation
+        if self.tree is None or len(selection) == 0 or self._task is not None:
+            return
+        chaining.apply_alternative(self.tree, self.alternatives[int(selection[0])])
+        self.update_station_plan()
+
+    def cb_alternative_switch(self, product_id: str, recipe_id: str):
+        # switched in the displayed tree, only the replaced part of the station plan is updated
+        if self.tree is None or self._task is not None:
+            return
+        started = time.perf_counter()
+        switched = chaining.switch_alternative(self.tree, self.ctl_station_plan.graph, product_id, recipe_id)
+        self.ctl_station_plan.update_tree()
+        self.view.tv_alternatives.selection_set(())
+        self.var_status.set(f'Switched {switched} alternatives in {(time.perf_counter() - started) * 1000:.1f}ms')
 
     def cb_btn_generate(self, *args):
-        self.ctl_station_plan.clear_display()
         rpm = self.var_target_rpm.get()
         recipe = self.ctl_recipe_select.value()
         if isinstance(recipe, Recipe):
@@ -53,8 +289,7 @@ class PlannerController(RootController):
     def cb_recipe_sel_changed(self, recipe):
         if isinstance(recipe, Recipe):
             self.view.btn_generate.configure(state='disabled')
-            self.ctl_product_select.clear_display()
-            self.ctl_product_select.id_filter = [p_id for p_id in recipe.products.keys()]
+            self.ctl_product_select.id_filter = set(recipe.products.keys())
             self.ctl_product_select.update_entities()
             if len(recipe.products) == 1:
                 self.ctl_product_select.set_value(recipe.nth_product(0))
@@ -94,7 +329,40 @@ class Planner(ttk.Frame, View):
         self.lbl_target_rpm.grid(row=0, column=0, sticky=tk.W, padx=10, pady=10)
         self.sb_target_rpm = ttk.Spinbox(self.rpm_frame, textvariable=controller.var_target_rpm, from_=0, increment=0.1)
         self.sb_target_rpm.grid(row=0, column=1, sticky=tk.W)
+        self.ckb_live = tk.Checkbutton(self.rpm_frame, text='Live', variable=controller.var_live,
+                                       command=controller.cb_plan_input_changed)
+        self.ckb_live.grid(row=0, column=2, sticky=tk.W, padx=10)
+        self.ckb_profile = tk.Checkbutton(self.rpm_frame, text='Profile next', variable=controller.var_profile)
+        self.ckb_profile.grid(row=0, column=3, sticky=tk.W)
         self.btn_generate = tk.Button(self, text='Generate', command=controller.cb_btn_generate, state='disabled')
+        self.generate_frame = tk.Frame(self)
+        self.btn_cancel = tk.Button(self.generate_frame, text='Cancel', command=controller.cancel_generation,
+                                    state='disabled')
+        self.btn_cancel.grid(row=0, column=0, sticky=tk.W)
+        self.pb_generate = ttk.Progressbar(self.generate_frame, mode='indeterminate', length=120)
+        self.pb_generate.grid(row=0, column=1, sticky=tk.W, padx=10)
+        self.lbl_status = tk.Label(self.generate_frame, textvariable=controller.var_status)
+        self.lbl_status.grid(row=0, column=2, sticky=tk.W)
+
+        self.alt_frame = tk.LabelFrame(self, text='Alternatives')
+        self.lbl_alt_count = tk.Label(self.alt_frame, text='Count')
+        self.lbl_alt_count.grid(row=0, column=0, sticky=tk.W, padx=10)
+        self.sb_alt_count = ttk.Spinbox(self.alt_frame, textvariable=controller.var_alt_count, from_=1, to=100, increment=1, width=5)
+        self.sb_alt_count.grid(row=0, column=1, sticky=tk.W)
+        self.ckb_alt_pareto = tk.Checkbutton(self.alt_frame, text='Pareto frontier', variable=controller.var_alt_pareto)
+        self.ckb_alt_pareto.grid(row=0, column=2, sticky=tk.W, padx=10)
+        self.tv_alternatives = ttk.Treeview(self.alt_frame, columns=('stations', 'raw', 'recipes', 'selection'),
+                                            show='headings', height=4, selectmode='browse')
+        self.tv_alternatives.heading('stations', text='Stations')
+        self.tv_alternatives.column('stations', width=80, stretch=False)
+        self.tv_alternatives.heading('raw', text='Raw Input')
+        self.tv_alternatives.column('raw', width=80, stretch=False)
+        self.tv_alternatives.heading('recipes', text='Recipes')
+        self.tv_alternatives.column('recipes', width=60, stretch=False)
+        self.tv_alternatives.heading('selection', text='Selected Alternatives')
+        self.tv_alternatives.grid(row=1, column=0, columnspan=3, sticky=tk.NSEW)
+        self.tv_alternatives.bind('<<TreeviewSelect>>', controller.cb_alternative_selected)
+        self.alt_frame.columnconfigure(2, weight=1)
 
         self.row_components = row
         self.vw_recipe_select: Optional[EntitySelect] = None
@@ -111,18 +379,18 @@ class Planner(ttk.Frame, View):
     def init_components(self, recipe_sel: EntitySelect, product_select: EntitySelect, blacklist_select: EntitySelect, station_plan: 'StationPlanView'):
         row = self.row_components
         self.vw_recipe_select = recipe_sel
-        # hacky but avoids extending EntitySelect
-        recipe_sel.tv_entities.grid(row=1)
+        # the help texts are shown above the lists
+        recipe_sel.set_list_row(1)
         self.lbl_recipe_select = Label(recipe_sel, text=self._HELP_TEXTS['recipe_select'])
         self.lbl_recipe_select.grid(row=0, column=0)
 
         self.vw_product_select = product_select
-        product_select.tv_entities.grid(row=1)
+        product_select.set_list_row(1)
         self.lbl_product_select = Label(product_select, text=self._HELP_TEXTS['product_select'])
         self.lbl_product_select.grid(row=0)
 
         self.vw_blacklist_select = blacklist_select
-        blacklist_select.tv_entities.grid(row=1)
+        blacklist_select.set_list_row(1)
         self.lbl_recipe_blacklist = Label(blacklist_select, text=self._HELP_TEXTS['recipe_blacklist'])
         self.lbl_recipe_blacklist.grid(row=0)
 
@@ -133,6 +401,10 @@ class Planner(ttk.Frame, View):
 
         self.rpm_frame.grid(row=row, column=0, sticky=tk.EW, pady=10)
         self.btn_generate.grid(row=row, column=1, padx=10)
+        self.generate_frame.grid(row=row, column=2, sticky=tk.W, padx=10)
+        row += 1
+
+        self.alt_frame.grid(row=row, column=0, columnspan=3, sticky=tk.NSEW, pady=(0, 10))
         row += 1
 
         self.vw_station_plan = station_plan
@@ -141,60 +413,155 @@ class Planner(ttk.Frame, View):
 
 
 class StationPlanViewController(Controller):
+    # Only the stage rows are inserted when a plan is shown. The I/O rows of a stage are computed and inserted when it
+    # is expanded, until then it has a placeholder child so that it can be expanded. A new plan is applied as a diff of
+    # the stage rows, stages which are still part of it keep their row and open state.
+    _PLACEHOLDER = '_placeholder'
 
     def __init__(self, master, v_id: str, parent: typing.Optional[Controller[T]]):
         super().__init__(v_id, parent)
         self.view = StationPlanView(master, self)
         self.graph: typing.Optional[ProductionGraph] = None
+        # tree the graph was converted from, its alternatives can be switched from the stage rows
+        self.tree: typing.Optional[ProductionTree] = None
+        # active recipe id -> alternatives it is selected in
+        self._alternatives: dict[str, list[chaining.AltNode]] = dict()
+        self.listeners_alternative_switch = []
+        # recipe id -> values of the displayed stage row
+        self._stages: dict[str, tuple] = dict()
+        # stages with inserted I/O rows
+        self._populated: set[str] = set()
+        self.view.tv_recipe_stages.bind('<<TreeviewOpen>>', self.cb_stage_open)
+        self.view.tv_recipe_stages.bind('<Button-3>', self.cb_stage_menu)
+
+    def stage_values(self, stage_node: GraphNode) -> tuple:
+        alternatives = {slot.recipe.id for node in self._alternatives.get(stage_node.recipe_id(), ())
+                        for slot in node.slots}
+        return (f'{int(stage_node.recipe.scale)}', '', stage_node.recipe.recipe.name, '', '', '', '',
+                len(stage_node.consumers), len(alternatives) - 1 if len(alternatives) > 1 else '')
 
     def update_tree(self):
         tv = self.view.tv_recipe_stages
-        for stage_node in self.graph.as_list():
-            recipe = stage_node.recipe.recipe
-            recipe_id = stage_node.recipe_id()
-            id_in = f'{recipe_id}_in'
-            id_out = f'{recipe_id}_out'
-            recipe_consumer_count = len(stage_node.consumers.values())
-            tv.insert('', 'end', iid=stage_node.recipe.recipe_id(), values=(
-                f'{int(stage_node.recipe.scale)}', '', stage_node.recipe.recipe.name, '', '', '', '', recipe_consumer_count
-            ), tags=('row_recipe',))
-            tv.insert(recipe_id, 'end', iid=id_in, values=('', 'IN'), open=True, tags=('row_io',))
-            tv.insert(recipe_id, 'end', iid=id_out, values=('', 'OUT'), open=True, tags=('row_io',))
-            recipe_components = stage_node.recipe.scaled_components()
-            recipe_demands = stage_node.resource_demand()
-
-            if len(recipe.resources) == 0:
-                tv.insert(id_in, 'end', iid=f'{recipe_id}_raw', values=('', '', '', '', recipe.source_name))
+        self._alternatives.clear()
+        if self.tree is not None:
+            for node in chaining.active_alternatives(self.tree):
+                self._alternatives.setdefault(node.active.recipe.id, []).append(node)
+        stages = [(stage_node.recipe_id(), self.stage_values(stage_node)) for stage_node in self.graph.as_list()]
+        new_ids = {recipe_id for recipe_id, _ in stages}
+        stale = [recipe_id for recipe_id in self._stages if recipe_id not in new_ids]
+        if len(stale) > 0:
+            tv.delete(*stale)
+            self._populated.difference_update(stale)
+        # stage rows in their current order, a row is moved if it is not the next one
+        current = [recipe_id for recipe_id in self._stages if recipe_id in new_ids]
+        moved = set()
+        pos = 0
+        for index, (recipe_id, values) in enumerate(stages):
+            old_values = self._stages.get(recipe_id, None)
+            if old_values is None:
+                tv.insert('', index, iid=recipe_id, values=values, tags=('row_recipe',))
+                tv.insert(recipe_id, 'end', iid=recipe_id + self._PLACEHOLDER)
+                continue
+            while pos < len(current) and current[pos] in moved:
+                pos += 1
+            if pos < len(current) and current[pos] == recipe_id:
+                pos += 1
             else:
-                for resource in recipe_components.resources:
-                    in_res_id = f'{recipe_id}_{resource.resource.id}_in'
-                    res_id = resource.resource.id
-                    base_qt = int(stage_node.recipe.recipe.resources[res_id].quantity)
-                    rpm = resource.quantity
-                    tv.insert(id_in, 'end', iid=in_res_id, values=('', '', '', base_qt, resource.resource.name, f'{rpm:.1f}'),
-                              tags=('row_resource',))
-            for resource in recipe_components.products:
-                out_res_id = f'{recipe_id}_{resource.resource.id}_out'
+                tv.move(recipe_id, '', index)
+                moved.add(recipe_id)
+            if old_values != values:
+                tv.item(recipe_id, values=values)
+            # the I/O rows depend on the whole plan, they are refreshed if visible and rebuilt on the next expand
+            if recipe_id in self._populated:
+                if tv.item(recipe_id, 'open'):
+                    tv.delete(*tv.get_children(recipe_id))
+                    self.insert_io_rows(self.graph.nodes[recipe_id])
+                else:
+                    tv.delete(*tv.get_children(recipe_id))
+                    tv.insert(recipe_id, 'end', iid=recipe_id + self._PLACEHOLDER)
+                    self._populated.discard(recipe_id)
+        self._stages = dict(stages)
+
+    def cb_stage_open(self, event):
+        tv = self.view.tv_recipe_stages
+        recipe_id = tv.focus()
+        if recipe_id in self._stages and recipe_id not in self._populated and self.graph is not None:
+            tv.delete(recipe_id + self._PLACEHOLDER)
+            self.insert_io_rows(self.graph.nodes[recipe_id])
+
+    def insert_io_rows(self, stage_node: GraphNode):
+        tv = self.view.tv_recipe_stages
+        recipe = stage_node.recipe.recipe
+        recipe_id = stage_node.recipe_id()
+        id_in = f'{recipe_id}_in'
+        id_out = f'{recipe_id}_out'
+        self._populated.add(recipe_id)
+        tv.insert(recipe_id, 'end', iid=id_in, values=('', 'IN'), open=True, tags=('row_io',))
+        tv.insert(recipe_id, 'end', iid=id_out, values=('', 'OUT'), open=True, tags=('row_io',))
+        recipe_components = stage_node.recipe.scaled_components()
+        recipe_demands = stage_node.resource_demand()
+
+        if len(recipe.resources) == 0:
+            tv.insert(id_in, 'end', iid=f'{recipe_id}_raw', values=('', '', '', '', recipe.source_name))
+        else:
+            for resource in recipe_components.resources:
+                in_res_id = f'{recipe_id}_{resource.resource.id}_in'
                 res_id = resource.resource.id
-                base_qt = int(stage_node.recipe.recipe.products[res_id].quantity)
+                base_qt = int(recipe.resources[res_id].quantity)
                 rpm = resource.quantity
-                overflow = 0
-                res_consumers = []
-                is_excess = False
-                if res_id in recipe_demands:
-                    overflow = rpm - recipe_demands[res_id].quantity
-                    for consumer in stage_node.consumers.values():
-                        if res_id in consumer.recipe.recipe.resources:
-                            res_consumers.append(consumer.recipe.recipe.name)
-                elif res_id != self.graph.root_product.id:
-                    res_consumers.append("<EXCESS PRODUCT>")
-                    is_excess = True
-                consumers = ", ".join(res_consumers)
-                tv.insert(id_out, 'end', iid=out_res_id,
-                          values=('', '', '',
-                                  base_qt, resource.resource.name,
-                                  f'{rpm:.1f}', f'{overflow:.1f}', consumers),
-                          tags=('row_product' if not is_excess else 'row_product_excess',))
+                tv.insert(id_in, 'end', iid=in_res_id, values=('', '', '', base_qt, resource.resource.name, f'{rpm:.1f}'),
+                          tags=('row_resource',))
+        for resource in recipe_components.products:
+            out_res_id = f'{recipe_id}_{resource.resource.id}_out'
+            res_id = resource.resource.id
+            base_qt = int(recipe.products[res_id].quantity)
+            rpm = resource.quantity
+            overflow = 0
+            res_consumers = []
+            is_excess = False
+            if res_id in recipe_demands:
+                overflow = rpm - recipe_demands[res_id].quantity
+                res_consumers = [consumer.recipe.recipe.name for consumer in self.graph.consumers_of(stage_node, res_id)]
+            elif not self.graph.is_target(res_id):
+                res_consumers.append("<EXCESS PRODUCT>")
+                is_excess = True
+            consumers = ", ".join(res_consumers)
+            tv.insert(id_out, 'end', iid=out_res_id,
+                      values=('', '', '',
+                              base_qt, resource.resource.name,
+                              f'{rpm:.1f}', f'{overflow:.1f}', consumers),
+                      tags=('row_product' if not is_excess else 'row_product_excess',))
+
+    def cb_stage_menu(self, event):
+        # context menu of a stage with the alternative recipes of its products, the active ones are marked
+        tv = self.view.tv_recipe_stages
+        recipe_id = tv.identify_row(event.y)
+        nodes = self._alternatives.get(recipe_id, [])
+        if len(nodes) == 0:
+            return
+        tv.selection_set(recipe_id)
+        menu = tk.Menu(tv, tearoff=0)
+        products: dict[str, list[Recipe]] = dict()
+        for node in nodes:
+            recipes = products.setdefault(node.product.id, [])
+            for slot in node.slots:
+                if slot.recipe not in recipes:
+                    recipes.append(slot.recipe)
+        for product_id, recipes in products.items():
+            product = next(node.product for node in nodes if node.product.id == product_id)
+            menu.add_command(label=product.name, state='disabled')
+            for recipe in recipes:
+                mark = '● ' if recipe.id == recipe_id else '   '
+                menu.add_command(label=mark + recipe.name,
+                                 command=lambda p=product_id, r=recipe.id: self.switch_alternative(p, r))
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def switch_alternative(self, product_id: str, recipe_id: str):
+        for listener in self.listeners_alternative_switch:
+            listener(product_id, recipe_id)
+
+    def register_alternative_switch(self, cb: Callable[[str, str], None]):
+        self.listeners_alternative_switch.append(cb)
 
     def widget(self) -> 'StationPlanView':
         return self.view
@@ -206,9 +573,15 @@ class StationPlanViewController(Controller):
         self.graph = val
         self.update_tree()
 
+    def set_plan(self, tree: ProductionTree, graph: ProductionGraph):
+        self.tree = tree
+        self.set_value(graph)
+
     def clear_display(self):
         items = self.view.tv_recipe_stages.get_children()
         self.view.tv_recipe_stages.delete(*items)
+        self._stages.clear()
+        self._populated.clear()
 
 
 class StationPlanView(ttk.Frame, View):
@@ -220,7 +593,8 @@ class StationPlanView(ttk.Frame, View):
         'res_name': 'Name of the resource/product',
         'rpm': 'Demand or production of the resource or product per minute',
         'overflow': 'Difference between total output rate and actual demand. Assuming integer scales of a recipe, this will be a positive number for intermediate recipe executions if dependant recipes do not consume 100% of the output.',
-        'c_count': 'Number of production steps (recipes) consuming products of this recipe.'
+        'c_count': 'Number of production steps (recipes) consuming products of this recipe.',
+        'alts': 'Number of alternative recipes for the products of this recipe. Right-click the recipe to switch to another one.'
     }
 
     def __init__(self, master, controller: StationPlanViewController):
@@ -229,7 +603,7 @@ class StationPlanView(ttk.Frame, View):
         self.var_heading_help = StringVar()
 
         self.tv_recipe_stages = ttk.Treeview(self, columns=(
-        'scale', 'io', 'recipe', 'res_qt', 'res_name', 'rpm', 'overflow', 'c_count'))
+        'scale', 'io', 'recipe', 'res_qt', 'res_name', 'rpm', 'overflow', 'c_count', 'alts'))
         self.tv_recipe_stages.grid(row=0, column=0, sticky=tk.NSEW)
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
@@ -251,6 +625,8 @@ class StationPlanView(ttk.Frame, View):
         self.tv_recipe_stages.heading('rpm', text='RPM', command=lambda: self.set_help('rpm'))
         self.tv_recipe_stages.heading('overflow', text='Overflow', command=lambda: self.set_help('overflow'))
         self.tv_recipe_stages.heading('c_count', text='Consumers', command=lambda: self.set_help('c_count'))
+        self.tv_recipe_stages.heading('alts', text='Alt.', command=lambda: self.set_help('alts'))
+        self.tv_recipe_stages.column('alts', width=50, stretch=False)
 
         self.tv_recipe_stages.bind('<Leave>', self.hide_tooltip)
         self.tv_recipe_stages.tag_configure('row_io', background='#bebebe')
@@ -160,7 +160,7 @@ class ResourceEditView(tk.Frame, View):
         self.vw_resource_select.grid(row=0, column=0, sticky=tk.NSEW, padx=10, pady=10)
 
         self.frm_buttons = tk.Frame(res_sel)
-        self.frm_buttons.grid(row=1, column=0, sticky=tk.NSEW, padx=10, pady=10)
+        self.frm_buttons.grid(row=2, column=0, sticky=tk.NSEW, padx=10, pady=10)
 
         self.btn_add = tk.Button(self.frm_buttons, text='Add', command=self.controller.cb_btn_add)
         self.btn_add.grid(row=1, column=0)
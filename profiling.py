@@ -0,0 +1,105 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+# Profiling of single commands and GUI generations with cProfile, optionally tracing memory allocations with
+# tracemalloc. The statistics are written to a .pstats file (e.g. for snakeviz or "python -m pstats FILE"), a summary
+# of the top functions is printed to stderr and written next to it as .txt. This module is only imported when
+# profiling is requested, nothing is hooked into the planning code otherwise.
+
+DEFAULT_TOP = 20
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+_RX_LABEL = re.compile(r'[^A-Za-z0-9_-]+')
+
+# only one profile at a time: nested cProfile profilers replace each other's hooks
+_lock = threading.Lock()
+_active = False
+
+
+def is_active() -> bool:
+    return _active
+
+
+def default_path(label: str) -> str:
+    label = _RX_LABEL.sub('_', label).strip('_') or 'profile'
+    return f'profile-{label}-{time.strftime("%Y%m%d-%H%M%S")}.pstats'
+
+
+class Profile:
+    # Context manager profiling the code of the current thread within it. Raises ValueError on entering if another
+    # profile is active.
+
+    def __init__(self, path: str, label: str = '', top: int = DEFAULT_TOP, sort: str = 'cumulative',
+                 memory: bool = False):
+        self.path = path
+        self.label = label
+        self.top = top
+        self.sort = sort
+        self.memory = memory
+        self.summary: typing.Optional[str] = None
+        self._profiler: typing.Optional[cProfile.Profile] = None
+        self._trace_memory = False
+        self._started = 0.0
+
+    def __enter__(self) -> 'Profile':
+        global _active
+        with _lock:
+            if _active:
+                raise ValueError('another profile is already running')
+            _active = True
+        # memory is traced by someone else (e.g. PYTHONTRACEMALLOC), it is only read then
+        self._trace_memory = self.memory and not tracemalloc.is_tracing()
+        if self._trace_memory:
+            tracemalloc.start()
+        elif self.memory:
+            tracemalloc.reset_peak()
+        self._profiler = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active
+        self._profiler.disable()
+        wall = time.perf_counter() - self._started
+        try:
+            snapshot = None
+            peak = 0
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                snapshot = tracemalloc.take_snapshot()
+                if self._trace_memory:
+                    tracemalloc.stop()
+            self._profiler.dump_stats(self.path)
+            self.summary = self._summarize(wall, peak, snapshot)
+            with open(os.path.splitext(self.path)[0] + '.txt', 'w') as summary_file:
+                summary_file.write(self.summary)
+            print(self.summary, file=sys.stderr, end='')
+        except OSError as e:
+            print(f'profile: failed to write {self.path}: {e}', file=sys.stderr)
+        finally:
+            self._profiler = None
+            with _lock:
+                _active = False
+        return False
+
+    def _summarize(self, wall: float, peak: int, snapshot: typing.Optional[tracemalloc.Snapshot]) -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        out.write(f'profile: {self.label}\n' if self.label else 'profile:\n')
+        out.write(f'  {wall:.3f}s wall, {stats.total_calls} calls, statistics written to {self.path}\n')
+        if snapshot is not None:
+            out.write(f'  peak memory {peak / 2 ** 20:.1f} MiB, top {self.top} allocations still held by line:\n')
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                out.write(f'    {stat}\n')
+        out.write(f'  top {self.top} functions by {self.sort}:\n')
+        stats.strip_dirs().sort_stats(self.sort).print_stats(self.top)
+        return out.getvalue()
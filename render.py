@@ -0,0 +1,245 @@
+import json
+import os
+import sys
+import typing
+from collections.abc import Iterable, Iterator
+
+import chaining
+from chaining import ProductionTree, ProdNode, AltNode, EndNode, ResourceAggregate
+from data import Resource, Recipe, ResourceQuantity
+
+# Machine-readable output of the CLI. Records are plain dicts written one at a time, either as JSON Lines (every record
+# carries its type in "record") or as one JSON object with an array per section, e.g.
+#   {"nodes": [...], "aggregate": [...], "stages": [...]}
+# Nothing is collected before writing, so output of huge trees starts immediately and memory use stays flat.
+
+FORMATS = ('text', 'json', 'jsonl')
+
+
+class RecordWriter:
+
+    def __init__(self, out: typing.TextIO, fmt: str):
+        self.out = out
+        self.fmt = fmt
+        self._encode = json.JSONEncoder(separators=(',', ':'), check_circular=False).encode
+        self._sections = 0
+
+    def section(self, name: str, records: Iterable[dict]):
+        write = self.out.write
+        encode = self._encode
+        if self.fmt == 'jsonl':
+            for record in records:
+                write(encode(record))
+                write('\n')
+            return
+        write('{' if self._sections == 0 else ',')
+        write(encode(name))
+        write(':[')
+        first = True
+        for record in records:
+            if not first:
+                write(',')
+            write(encode(record))
+            first = False
+        write(']')
+        self._sections += 1
+
+    def close(self):
+        if self.fmt == 'json':
+            self.out.write('{}\n' if self._sections == 0 else '}\n')
+        self.out.flush()
+
+
+def handle_broken_pipe():
+    # The reader went away (e.g. "| head"). Further output, including the implicit flush at exit, is discarded instead
+    # of raising again.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Records                                                                                                            #
+#----------------------------------------------------------------------------------------------------------------------#
+
+def tree_records(tree: ProductionTree, aggregate: typing.Optional[ResourceAggregate] = None) -> Iterator[dict]:
+    # Nodes of the tree in the order they are printed, an alternative node is reported together with its active
+    # recipe. Node ids are assigned in pre-order, the root has parent None. If aggregate is given, the resources of
+    # all visited nodes are added to it on the way.
+    next_id = 0
+    stack: list[tuple[chaining.BaseNode, typing.Optional[int], int]] = [(tree.root, None, 0)]
+    while len(stack) > 0:
+        node, parent, depth = stack.pop()
+        record = {'record': 'node', 'id': next_id, 'parent': parent, 'depth': depth}
+        if isinstance(node, AltNode):
+            record['slot'] = node.active_slot
+            record['alternatives'] = len(node.slots)
+            node = node.active
+        if isinstance(node, ProdNode):
+            record['type'] = 'recipe'
+            record['recipe'] = node.recipe.id
+            record['product'] = node.production.product.id
+            record['rpm'] = node.rpm
+            record['scale'] = node.rpm / node.production.base_rpm
+            if aggregate is not None:
+                aggregate.add(ResourceQuantity(node.production.product, node.rpm), node.recipe)
+            for child in reversed(node.children):
+                stack.append((child, next_id, depth + 1))
+        elif isinstance(node, EndNode):
+            record['type'] = 'end'
+            record['product'] = node.resource.resource.id
+            record['rpm'] = node.resource.quantity
+            if aggregate is not None:
+                aggregate.add(node.resource, None)
+        next_id += 1
+        yield record
+
+
+def aggregate_records(aggregate: ResourceAggregate) -> Iterator[dict]:
+    for rqr in aggregate.recipes.values():
+        production = rqr.recipe.production(rqr.resource)
+        yield {'record': 'aggregate', 'recipe': rqr.recipe.id, 'product': rqr.resource.id, 'rpm': rqr.quantity,
+               'scale': rqr.quantity / production.base_rpm}
+    for rr in aggregate.raw.values():
+        yield {'record': 'aggregate', 'recipe': None, 'product': rr.resource.id, 'rpm': rr.quantity}
+
+
+def stage_records(graph: chaining.ProductionGraph) -> Iterator[dict]:
+    for stage in graph.as_list():
+        yield {'record': 'stage', 'level': stage.level, 'recipe': stage.recipe_id(), 'scale': stage.recipe.scale}
+
+
+def alternative_records(tree: ProductionTree, alternatives: list[chaining.PlanAlternative]) -> Iterator[dict]:
+    for rank, alternative in enumerate(alternatives, 1):
+        yield {'record': 'alternative', 'rank': rank, 'stations': alternative.stations,
+               'raw_input': alternative.raw_input, 'recipes': alternative.recipe_count,
+               'selections': [[product.id, recipe.id]
+                              for product, recipe in chaining.alternative_selections(tree, alternative)]}
+
+
+def stats_record(stats: chaining.PlanStats) -> dict:
+    record = {'record': 'stats'}
+    record.update(stats.as_dict())
+    record['times'] = {phase: seconds * 1000 for phase, seconds in stats.times.items()}
+    return record
+
+
+def resource_record(resource: Resource) -> dict:
+    record = {'record': 'resource'}
+    record.update(resource.as_dict())
+    return record
+
+
+def recipe_record(recipe: Recipe) -> dict:
+    record = {'record': 'recipe'}
+    record.update(recipe.as_dict())
+    return record
+
+
+#----------------------------------------------------------------------------------------------------------------------#
+#   Text                                                                                                               #
+#----------------------------------------------------------------------------------------------------------------------#
+
+_BRANCH = '├── '
+_LAST_BRANCH = '└── '
+_PIPE = '│   '
+_SPACE = '    '
+
+
+class TreeRenderer:
+    # Writes a tree as text, e.g.
+    #   1.0x "A": [...]
+    #   ├── [0] 0.5x "B": [...]
+    #   │   └── C: 1.0
+    #   └── C: 1.0
+    # The tree is walked iteratively and lines are written to out in blocks. Optionally, only max_depth levels below
+    # the root and max_width children per node are shown, and subtrees identical to one already shown are collapsed.
+
+    def __init__(self, out: typing.Optional[typing.TextIO] = None, max_depth: typing.Optional[int] = None,
+                 max_width: typing.Optional[int] = None, collapse: bool = False, buffer_lines: int = 4096):
+        self.out = out
+        self.max_depth = max_depth
+        self.max_width = max_width
+        self.collapse = collapse
+        self.buffer_lines = buffer_lines
+        self._lines: list[str] = []
+
+    def _emit(self, line: str):
+        self._lines.append(line)
+        if len(self._lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if len(self._lines) > 0:
+            out = self.out if self.out is not None else sys.stdout
+            self._lines.append('')
+            out.write('\n'.join(self._lines))
+            self._lines.clear()
+
+    @staticmethod
+    def _signatures(tree: ProductionTree) -> dict[int, int]:
+        # structural signature of every displayed subtree (node id -> interned signature), computed post-order
+        interned: dict[tuple, int] = dict()
+        signatures: dict[int, int] = dict()
+        stack: list[tuple[chaining.BaseNode, bool]] = [(tree.root, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            children = node.display_children()
+            if not expanded and len(children) > 0:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+                continue
+            if isinstance(node, EndNode):
+                key = ('end', node.resource.resource.id, node.resource.quantity)
+            else:
+                prod = node.active if isinstance(node, AltNode) else node
+                key = (node.active_slot if isinstance(node, AltNode) else None,
+                       prod.recipe.id if prod is not None else None, prod.rpm if prod is not None else None,
+                       tuple(signatures[id(child)] for child in children))
+            signatures[id(node)] = interned.setdefault(key, len(interned))
+        return signatures
+
+    def render(self, tree: ProductionTree):
+        signatures = self._signatures(tree) if self.collapse else None
+        shown: set[int] = set()
+        self._emit(tree.root.label())
+        # (node, prefix of its line, prefix of its children, depth)
+        stack: list[tuple[chaining.BaseNode, str, str, int]] = []
+        self._push_children(stack, tree.root, '', 0)
+        while len(stack) > 0:
+            node, line_prefix, child_prefix, depth = stack.pop()
+            if node is None:
+                # placeholder for children cut off by the width limit
+                self._emit(line_prefix)
+                continue
+            children = node.display_children()
+            if signatures is not None and len(children) > 0:
+                signature = signatures[id(node)]
+                if signature in shown:
+                    self._emit(f'{line_prefix}{node.label()} … same as above')
+                    continue
+                shown.add(signature)
+            self._emit(line_prefix + node.label())
+            if len(children) > 0:
+                if self.max_depth is not None and depth >= self.max_depth:
+                    self._emit(f'{child_prefix}{_LAST_BRANCH}…')
+                else:
+                    self._push_children(stack, node, child_prefix, depth)
+        self.flush()
+
+    def _push_children(self, stack: list, node: chaining.BaseNode, prefix: str, depth: int):
+        children = node.display_children()
+        shown = children
+        hidden = 0
+        if self.max_width is not None and len(children) > self.max_width:
+            shown = children[:self.max_width]
+            hidden = len(children) - self.max_width
+        # pushed in reverse so that the first child is popped first
+        if hidden > 0:
+            stack.append((None, f'{prefix}{_LAST_BRANCH}… {hidden} more', '', depth + 1))
+        branch_prefix = prefix + _BRANCH
+        pipe_prefix = prefix + _PIPE
+        for i in range(len(shown) - 1, -1, -1):
+            if i == len(shown) - 1 and hidden == 0:
+                stack.append((shown[i], prefix + _LAST_BRANCH, prefix + _SPACE, depth + 1))
+            else:
+                stack.append((shown[i], branch_prefix, pipe_prefix, depth + 1))
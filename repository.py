@@ -1,14 +1,31 @@
+import functools
+import itertools
 import json
 import re
 import sys
+import threading
 import typing
 from argparse import ArgumentError
+from contextlib import contextmanager
 from datetime import timedelta
 from typing import Self
 
 from data import Resource, Recipe, ResourceQuantity, Entity
 
 
+def generate_id(name: str) -> str:
+    return name.lower().replace(' ', '_') \
+        .replace('(', '') \
+        .replace(')', '') \
+        .replace('[', '') \
+        .replace(']', '') \
+        .replace('{', '') \
+        .replace('}', '') \
+        .replace('"', '') \
+        .replace("'", '') \
+        .replace('__', '_')
+
+
 class DuplicateKeyError(BaseException):
 
     def __init__(self, msg: str):
@@ -21,17 +38,105 @@ class InvalidDataError(BaseException):
         self.part = part
 
 
+class ReadOnlyError(BaseException):
+
+    def __init__(self, msg: str):
+        super().__init__(msg)
+
+
+def _writer(method):
+    # modifications are serialized by the repository lock and rejected on snapshots
+    @functools.wraps(method)
+    def locked(self: 'RecipeRepository', *args, **kwargs):
+        with self._lock:
+            if self._frozen:
+                raise ReadOnlyError(f'cannot modify a repository snapshot')
+            return method(self, *args, **kwargs)
+    return locked
+
+
+# tokens of repositories, unlike id() never reused
+_tokens = itertools.count(1)
+
+
 class RecipeRepository:
     __RX_ID = re.compile('([a-z0-9]+([a-z0-9]|_)*)')
 
-    __slots__=('resources', 'recipes', 'mod_recipes', 'mod_resources')
+    __slots__=('_resources', '_recipes', 'mod_recipes', 'mod_resources', 'token', 'generation', '_product_index',
+               '_resource_names', '_recipe_names', '_lock', '_frozen', '_shared_resources', '_shared_recipes',
+               '_snapshot')
 
     def __init__(self):
-        self.resources: dict[str, Resource] = dict()
-        self.recipes: dict[str, Recipe] = dict()
+        self._resources: dict[str, Resource] = dict()
+        self._recipes: dict[str, Recipe] = dict()
         self.mod_recipes = False
         self.mod_resources = False
-
+        # (token, generation) identifies the state of the repository, e.g. for caches
+        self.token = next(_tokens)
+        # incremented on every change of resources or recipes
+        self.generation = 0
+        # product id -> recipes producing it, rebuilt lazily after recipes were changed
+        self._product_index: typing.Optional[dict[str, list[Recipe]]] = None
+        # lower case name -> first entity with that name, extended on add and rebuilt lazily after other changes
+        self._resource_names: typing.Optional[dict[str, Resource]] = None
+        self._recipe_names: typing.Optional[dict[str, Recipe]] = None
+        # Copy-on-write: entity maps referenced by a snapshot (or a transaction) are marked shared and copied before the
+        # next modification, so snapshots never change and taking one does not copy anything.
+        self._lock = threading.RLock()
+        self._frozen = False
+        self._shared_resources = False
+        self._shared_recipes = False
+        self._snapshot: typing.Optional[RecipeRepository] = None
+
+    @property
+    def resources(self) -> dict[str, Resource]:
+        # must not be modified directly, use the methods of the repository
+        return self._resources
+
+    @property
+    def recipes(self) -> dict[str, Recipe]:
+        return self._recipes
+
+    def _own_resources(self) -> dict[str, Resource]:
+        if self._shared_resources:
+            self._resources = dict(self._resources)
+            self._shared_resources = False
+        return self._resources
+
+    def _own_recipes(self) -> dict[str, Recipe]:
+        if self._shared_recipes:
+            self._recipes = dict(self._recipes)
+            self._shared_recipes = False
+        return self._recipes
+
+    @property
+    def is_snapshot(self) -> bool:
+        return self._frozen
+
+    def snapshot(self) -> 'RecipeRepository':
+        # Read-only repository with the current state. It shares all entities and maps with this repository and is
+        # reused until the repository is modified, so it is cheap to take one for every planning run. Modification
+        # flags are not part of a snapshot.
+        with self._lock:
+            if self._frozen:
+                return self
+            if self._snapshot is not None and self._snapshot.generation == self.generation:
+                return self._snapshot
+            snapshot = RecipeRepository()
+            snapshot._resources = self._resources
+            snapshot._recipes = self._recipes
+            # same state as this repository at this generation
+            snapshot.token = self.token
+            snapshot.generation = self.generation
+            # the product index is replaced rather than modified, name indexes are extended in place
+            snapshot._product_index = self._product_index
+            snapshot._frozen = True
+            self._shared_resources = True
+            self._shared_recipes = True
+            self._snapshot = snapshot
+            return snapshot
+
+    @_writer
     def add_resource(self, resource: Resource, is_load=False):
         if len(resource.name) == 0:
             raise InvalidDataError(f'resource name must not be empty', 'name')
@@ -41,12 +146,16 @@ class RecipeRepository:
         if self.resources.get(resource.id, None) is None:
             if not self.validate_id_format(resource.id):
                 raise InvalidDataError(f'invalid resource id: "{resource.id}"', 'id')
-            self.resources[resource.id] = resource
+            self._own_resources()[resource.id] = resource
+            if self._resource_names is not None:
+                self._resource_names.setdefault(resource.name.lower(), resource)
+            self.generation += 1
             if not is_load:
                 self.mod_resources = True
         else:
             raise DuplicateKeyError(f'duplicate resource id: {resource.id}')
 
+    @_writer
     def add_recipe(self, recipe: Recipe, is_load=False):
         if len(recipe.name) == 0:
             raise InvalidDataError(f'recipe name must not be empty')
@@ -56,44 +165,64 @@ class RecipeRepository:
         if self.recipes.get(recipe.id, None) is None:
             if not self.validate_id_format(recipe.id):
                 raise InvalidDataError(f'invalid recipe id: "{recipe.id}"')
-            self.recipes[recipe.id] = recipe
+            self._own_recipes()[recipe.id] = recipe
+            self._product_index = None
+            if self._recipe_names is not None:
+                self._recipe_names.setdefault(recipe.name.lower(), recipe)
+            self.generation += 1
             if not is_load:
                 self.mod_recipes = True
         else:
             raise DuplicateKeyError(f'duplicate recipe id: {recipe.id}')
 
-    def load_resource(self, d: dict):
-        resource = Resource(d['name'], d['id'], d.get('raw', False))
-        self.add_resource(resource, True)
-
-    def load_recipe(self, d: dict):
-        name = d['name']
-        id = d['id']
-        cycle_time = d['cycle_secs']
-        products = [ResourceQuantity(self.resource(res['id']), res['quantity']) for res in d['products']]
-        resources = [ResourceQuantity(self.resource(res['id']), res['quantity']) for res in d['resources']]
+    @staticmethod
+    def resource_from_dict(d: dict) -> Resource:
+        return Resource(d['name'], d['id'], d.get('raw', False))
+
+    def recipe_from_dict(self, d: dict) -> Recipe:
+        # resolves the resources of a recipe as stored in recipes.json
+        quantities = {'products': [], 'resources': []}
+        for key, target in quantities.items():
+            for res in d[key]:
+                resource = self.resource(res['id'])
+                if resource is None:
+                    raise InvalidDataError(f'recipe "{d["id"]}" references unknown resource "{res["id"]}"', key)
+                target.append(ResourceQuantity(resource, res['quantity']))
         recipe = Recipe(
-            name,
-            id,
-            resources,
-            products,
-            timedelta(seconds=cycle_time)
+            d['name'],
+            d['id'],
+            quantities['resources'],
+            quantities['products'],
+            timedelta(seconds=d['cycle_secs'])
         )
         if 'source_name' in d:
             recipe.source_name = d['source_name']
-        self.add_recipe(recipe, True)
+        return recipe
 
+    def load_resource(self, d: dict):
+        self.add_resource(self.resource_from_dict(d), True)
+
+    def load_recipe(self, d: dict):
+        self.add_recipe(self.recipe_from_dict(d), True)
+
+    @_writer
     def delete_resource(self, resource_id: str) -> bool:
         if resource_id in self.resources:
-            self.resources.pop(resource_id)
+            self._own_resources().pop(resource_id)
+            self._resource_names = None
+            self.generation += 1
             self.mod_resources = True
             return True
         else:
             return False
 
+    @_writer
     def delete_recipe(self, recipe_id: str) -> bool:
         if recipe_id in self.recipes:
-            self.recipes.pop(recipe_id)
+            self._own_recipes().pop(recipe_id)
+            self._product_index = None
+            self._recipe_names = None
+            self.generation += 1
             self.mod_recipes = True
             return True
         else:
@@ -106,38 +235,45 @@ class RecipeRepository:
         return self.recipes.get(rec_id, None)
 
     def resource_by_name(self, name: str) -> typing.Optional[Resource]:
-        name_lc = name.lower()
-        for resource in self.resources.values():
-            if resource.name.lower() == name_lc:
-                return resource
-        return None
+        if self._resource_names is None:
+            self._resource_names = dict()
+            for resource in self.resources.values():
+                self._resource_names.setdefault(resource.name.lower(), resource)
+        return self._resource_names.get(name.lower(), None)
 
     def recipe_by_name(self, name: str) -> typing.Optional[Recipe]:
-        name_lc = name.lower()
-        for recipe in self.recipes.values():
-            if recipe.name.lower() == name_lc:
-                return recipe
-        return None
+        if self._recipe_names is None:
+            self._recipe_names = dict()
+            for recipe in self.recipes.values():
+                self._recipe_names.setdefault(recipe.name.lower(), recipe)
+        return self._recipe_names.get(name.lower(), None)
 
     def find_recipes_by_product(self, product: Resource) -> list[Recipe]:
-        results = []
-        for recipe in self.recipes.values():
-            if product.id in recipe.products:
-                results.append(recipe)
+        if self._product_index is None:
+            index: dict[str, list[Recipe]] = dict()
+            for recipe in self.recipes.values():
+                for product_id in recipe.products.keys():
+                    index.setdefault(product_id, []).append(recipe)
+            self._product_index = index
 
-        return results
+        return list(self._product_index.get(product.id, ()))
 
+    @_writer
     def update_recipe(self, recipe: Recipe):
         old = self.recipe(recipe.id)
         if old is None:
             self.add_recipe(recipe, False)
         elif not old.is_equal(recipe):
             for resource in list(recipe.products.values()) + list( recipe.resources.values()):
-                if resource not in self.resources:
-                    raise ArgumentError(resource, 'resource does not exist in repository!')
-            self.recipes[recipe.id] = recipe
+                if resource.resource.id not in self.resources:
+                    raise ArgumentError(None, f'resource {resource.resource.id} does not exist in repository!')
+            self._own_recipes()[recipe.id] = recipe
+            self._product_index = None
+            self._recipe_names = None
+            self.generation += 1
             self.mod_recipes = True
 
+    @_writer
     def update_entity(self, entity_id: str, entity: Entity) -> bool:
         if isinstance(entity, Resource):
             old = self.resources.get(entity_id, None)
@@ -147,14 +283,18 @@ class RecipeRepository:
             if old.id != entity.id:
                 if entity.id not in self.resources:
                     self.add_resource(entity, False)
-                    self.resources.pop(entity_id)
+                    self._own_resources().pop(entity_id)
+                    self._resource_names = None
+                    self.generation += 1
                     self.mod_resources = True
                 else:
                     print(f'Cannot change resource_id from {entity_id} to {entity.id}: id exists ')
                     return False
             else:
                 if old.name != entity.name or old.is_raw != entity.is_raw:
-                    self.resources[entity_id] = entity
+                    self._own_resources()[entity_id] = entity
+                    self._resource_names = None
+                    self.generation += 1
                     self.mod_resources = True
         elif isinstance(entity, Recipe):
             old = self.recipes.get(entity_id, None)
@@ -164,7 +304,10 @@ class RecipeRepository:
             if old.id != entity.id:
                 if entity.id not in self.recipes:
                     self.add_recipe(entity, False)
-                    self.recipes.pop(entity_id)
+                    self._own_recipes().pop(entity_id)
+                    self._product_index = None
+                    self._recipe_names = None
+                    self.generation += 1
                     self.mod_recipes = True
                 else:
                     print(f'Cannot change recipe_id from {entity_id} to {entity.id}: id exists')
@@ -177,6 +320,30 @@ class RecipeRepository:
                     return False
         return True
 
+    @contextmanager
+    def transaction(self):
+        # All changes made within the block are reverted if it raises. Entities are never modified in place, so keeping
+        # the entity maps (copied on the first change) is sufficient to restore the previous state. The lock is held
+        # for the whole block, snapshots taken by other threads see either none or all of the changes.
+        with self._lock:
+            if self._frozen:
+                raise ReadOnlyError(f'cannot modify a repository snapshot')
+            state = (self._resources, self._recipes, self.mod_resources, self.mod_recipes)
+            self._shared_resources = True
+            self._shared_recipes = True
+            try:
+                yield self
+            except BaseException:
+                self._resources, self._recipes, self.mod_resources, self.mod_recipes = state
+                self._shared_resources = True
+                self._shared_recipes = True
+                self._product_index = None
+                self._resource_names = None
+                self._recipe_names = None
+                # the generation is never reset, caches only see another modification
+                self.generation += 1
+                raise
+
     @staticmethod
     def validate_id_format(id_str: str) -> bool:
         return RecipeRepository.__RX_ID.fullmatch(id_str) is not None
@@ -202,10 +369,12 @@ def load_repository(resources_path: str, recipes_path: str):
     return repo
 
 def save_repository(repo: RecipeRepository, resources_path: typing.Optional[str], recipes_path: typing.Optional[str], force=False):
+    # other threads may keep modifying the repository while it is written
+    snapshot = repo.snapshot()
     if repo.mod_recipes or force:
         if recipes_path is not None:
             j_rec_arr = []
-            vals_sorted = sorted(repo.recipes.values(), key=Recipe.get_id)
+            vals_sorted = sorted(snapshot.recipes.values(), key=Recipe.get_id)
             for recipe in vals_sorted:
                 j_rec_arr.append(recipe.as_dict())
 
@@ -221,7 +390,7 @@ def save_repository(repo: RecipeRepository, resources_path: typing.Optional[str]
     if repo.mod_resources or force:
         if resources_path is not None:
             j_res_arr = []
-            vals_sorted = sorted(repo.resources.values(), key=Resource.get_id)
+            vals_sorted = sorted(snapshot.resources.values(), key=Resource.get_id)
             for resource in vals_sorted:
                 j_res_arr.append(resource.as_dict())
 
@@ -0,0 +1,137 @@
+import bisect
+import heapq
+import re
+import typing
+from collections.abc import Mapping
+
+from data import Entity
+
+# Index for searching entities by name and ID while typing. Matches are ranked by quality:
+#   EXACT        the name or ID equals the query
+#   PREFIX       the name or ID starts with the query
+#   WORD_PREFIX  a word of the name or ID starts with the query
+#   SUBSTRING    the query occurs anywhere in the name or ID
+# Prefixes are found by bisecting a sorted list of keys (full names, IDs and their words), substrings by intersecting
+# the posting sets of the query's trigrams, so a query does not scan all entities. Queries shorter than a trigram only
+# find prefix matches. Entities are compared by ID and name on sync(), only changed ones are re-indexed.
+
+EXACT = 0
+PREFIX = 1
+WORD_PREFIX = 2
+SUBSTRING = 3
+
+_RX_WORD_SEP = re.compile(r'[^a-z0-9]+')
+_RX_SPACE = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    return _RX_SPACE.sub(' ', text.strip().lower())
+
+
+def _keys(entity_id: str, name: str) -> set[tuple[str, int]]:
+    # (key, rank of a prefix match on it)
+    keys = {(name, PREFIX), (entity_id, PREFIX)}
+    for text in (name, entity_id):
+        keys.update((word, WORD_PREFIX) for word in _RX_WORD_SEP.split(text) if len(word) > 0)
+    return keys
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    __slots__ = ('_names', '_keys', '_trigrams')
+
+    def __init__(self, entities: typing.Optional[Mapping[str, Entity]] = None):
+        # entity id -> normalized name
+        self._names: dict[str, str] = dict()
+        # sorted (key, rank, entity id)
+        self._keys: list[tuple[str, int, str]] = []
+        # trigram -> ids of entities whose name or ID contains it
+        self._trigrams: dict[str, set[str]] = dict()
+        if entities is not None:
+            self._build(entities)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _build(self, entities: Mapping[str, Entity]):
+        self._names = {e_id: normalize(entity.name) for e_id, entity in entities.items()}
+        keys = []
+        for e_id, name in self._names.items():
+            keys.extend((key, rank, e_id) for key, rank in _keys(e_id, name))
+            for trigram in _trigrams(name) | _trigrams(e_id):
+                self._trigrams.setdefault(trigram, set()).add(e_id)
+        keys.sort()
+        self._keys = keys
+
+    def add(self, entity_id: str, name: str):
+        if entity_id in self._names:
+            self.remove(entity_id)
+        name = normalize(name)
+        self._names[entity_id] = name
+        for key, rank in _keys(entity_id, name):
+            bisect.insort(self._keys, (key, rank, entity_id))
+        for trigram in _trigrams(name) | _trigrams(entity_id):
+            self._trigrams.setdefault(trigram, set()).add(entity_id)
+
+    def remove(self, entity_id: str):
+        name = self._names.pop(entity_id, None)
+        if name is None:
+            return
+        for key, rank in _keys(entity_id, name):
+            i = bisect.bisect_left(self._keys, (key, rank, entity_id))
+            if i < len(self._keys) and self._keys[i] == (key, rank, entity_id):
+                del self._keys[i]
+        for trigram in _trigrams(name) | _trigrams(entity_id):
+            postings = self._trigrams.get(trigram, None)
+            if postings is not None:
+                postings.discard(entity_id)
+                if len(postings) == 0:
+                    del self._trigrams[trigram]
+
+    def sync(self, entities: Mapping[str, Entity]) -> int:
+        # makes the index match the given entities, returns the number of entities re-indexed
+        if len(self._names) == 0:
+            self._build(entities)
+            return len(entities)
+        changed = 0
+        for e_id in [e_id for e_id in self._names if e_id not in entities]:
+            self.remove(e_id)
+            changed += 1
+        for e_id, entity in entities.items():
+            if self._names.get(e_id, None) != normalize(entity.name):
+                self.add(e_id, entity.name)
+                changed += 1
+        return changed
+
+    def search(self, query: str, limit: typing.Optional[int] = None) -> list[str]:
+        # IDs of matching entities, best matches first and by name within the same rank
+        query = normalize(query)
+        if len(query) == 0:
+            return []
+        ranks: dict[str, int] = dict()
+        keys = self._keys
+        lo = bisect.bisect_left(keys, (query,))
+        hi = bisect.bisect_left(keys, (query + '\uffff',), lo)
+        for key, rank, e_id in keys[lo:hi]:
+            if rank == PREFIX and key == query:
+                rank = EXACT
+            if rank < ranks.get(e_id, SUBSTRING + 1):
+                ranks[e_id] = rank
+
+        names = self._names
+        if len(query) >= 3:
+            postings = sorted((self._trigrams.get(trigram, ()) for trigram in _trigrams(query)), key=len)
+            if len(postings[0]) > 0:
+                for e_id in postings[0].intersection(*postings[1:]).difference(ranks):
+                    if query in names[e_id] or query in e_id:
+                        ranks[e_id] = SUBSTRING
+
+        ranked = [(rank, names[e_id], e_id) for e_id, rank in ranks.items()]
+        if limit is not None and limit < len(ranked):
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            ranked.sort()
+        return [e_id for _, _, e_id in ranked]
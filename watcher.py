@@ -0,0 +1,150 @@
+import json
+import os
+import typing
+
+from repository import RecipeRepository, InvalidDataError, DuplicateKeyError
+
+# Reloads resources.json and recipes.json while the application is running, e.g. after they were regenerated by an
+# importer or changed by a git checkout. The files are polled (os.stat of both files, which is negligible compared to
+# a command or a GUI refresh), and a changed pair is diffed against the repository by ID: only entities which were
+# added, changed or removed are applied, so indexes, caches and selections of unchanged entities stay valid.
+
+DEFAULT_INTERVAL = 1.0
+
+
+class ReloadResult:
+    __slots__ = ('added', 'updated', 'removed')
+
+    def __init__(self):
+        # per entity type ('resource', 'recipe')
+        self.added = {'resource': 0, 'recipe': 0}
+        self.updated = {'resource': 0, 'recipe': 0}
+        self.removed = {'resource': 0, 'recipe': 0}
+
+    def changed(self, kind: str) -> bool:
+        return self.added[kind] + self.updated[kind] + self.removed[kind] > 0
+
+    def __bool__(self):
+        return self.changed('resource') or self.changed('recipe')
+
+    def __str__(self):
+        return ', '.join(f'{kind}s: {self.added[kind]} added, {self.updated[kind]} updated, '
+                         f'{self.removed[kind]} removed' for kind in ('resource', 'recipe'))
+
+
+def _signature(path: str) -> typing.Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def apply_changes(repo: RecipeRepository, resource_dicts: list[dict], recipe_dicts: list[dict]) -> ReloadResult:
+    # Makes the repository equal to the given entities, in one transaction. The modification flags are not changed as
+    # the repository matches the files afterwards.
+    result = ReloadResult()
+    mod_flags = (repo.mod_resources, repo.mod_recipes)
+    with repo.transaction():
+        new_resources = {d['id']: RecipeRepository.resource_from_dict(d) for d in resource_dicts}
+        replaced = set()
+        for resource_id, resource in new_resources.items():
+            old = repo.resource(resource_id)
+            if old is None:
+                repo.add_resource(resource)
+                result.added['resource'] += 1
+            elif old.name != resource.name or old.is_raw != resource.is_raw:
+                repo.update_entity(resource_id, resource)
+                replaced.add(resource_id)
+                result.updated['resource'] += 1
+
+        recipe_ids = set()
+        for d in recipe_dicts:
+            recipe = repo.recipe_from_dict(d)
+            recipe_ids.add(recipe.id)
+            old = repo.recipe(recipe.id)
+            if old is None:
+                repo.add_recipe(recipe)
+                result.added['recipe'] += 1
+            elif not old.is_equal(recipe):
+                repo.update_recipe(recipe)
+                result.updated['recipe'] += 1
+            elif any(rq.resource.id in replaced for rq in list(old.resources.values()) + list(old.products.values())):
+                # unchanged, but still referencing the replaced resource objects
+                repo.delete_recipe(recipe.id)
+                repo.add_recipe(recipe)
+
+        for recipe_id in [r for r in repo.recipes if r not in recipe_ids]:
+            repo.delete_recipe(recipe_id)
+            result.removed['recipe'] += 1
+        for resource_id in [r for r in repo.resources if r not in new_resources]:
+            repo.delete_resource(resource_id)
+            result.removed['resource'] += 1
+        repo.mod_resources, repo.mod_recipes = mod_flags
+    return result
+
+
+class RepositoryWatcher:
+
+    def __init__(self, repo: RecipeRepository, resources_file: str, recipes_file: str,
+                 interval: float = DEFAULT_INTERVAL):
+        self.repository = repo
+        self.resources_file = resources_file
+        self.recipes_file = recipes_file
+        self.interval = interval
+        # signatures of the files the repository currently matches
+        self._signatures = self._current_signatures()
+        self._reported: typing.Optional[tuple] = None
+
+    def _current_signatures(self) -> tuple:
+        return _signature(self.resources_file), _signature(self.recipes_file)
+
+    def poll(self) -> typing.Optional[ReloadResult]:
+        # Checks the files and applies their changes, returns None if nothing changed. Files which cannot be read (e.g.
+        # while they are being written) are tried again on the next poll.
+        return self.apply(self.load())
+
+    def load(self) -> typing.Optional[tuple]:
+        # First half of poll: reads the changed files without touching the repository, so it can run without holding
+        # the repository's lock. None if nothing changed or the files cannot be read.
+        signatures = self._current_signatures()
+        if signatures == self._signatures or None in signatures:
+            return None
+        try:
+            with open(self.resources_file, 'r') as res_file:
+                resource_dicts = json.load(res_file)
+            with open(self.recipes_file, 'r') as rec_file:
+                recipe_dicts = json.load(rec_file)
+        except (OSError, ValueError) as e:
+            self._report(signatures, f'failed to reload data files: {e}')
+            return None
+        return signatures, resource_dicts, recipe_dicts
+
+    def apply(self, loaded: typing.Optional[tuple]) -> typing.Optional[ReloadResult]:
+        # Second half of poll: applies the files returned by load to the repository.
+        if loaded is None:
+            return None
+        signatures, resource_dicts, recipe_dicts = loaded
+        if signatures == self._signatures:
+            # applied by another poll meanwhile
+            return None
+        if self.repository.mod_resources or self.repository.mod_recipes:
+            self._report(signatures, 'data files changed on disk, not reloading because of unsaved changes')
+            return None
+        try:
+            result = apply_changes(self.repository, resource_dicts, recipe_dicts)
+        except (ValueError, KeyError, TypeError, InvalidDataError, DuplicateKeyError) as e:
+            self._report(signatures, f'failed to reload data files: {e}')
+            return None
+        self._signatures = signatures
+        return result if result else None
+
+    def _report(self, signatures: tuple, message: str):
+        # reported once per state of the files
+        if self._reported != signatures:
+            self._reported = signatures
+            print(f'watch: {message}')
+
+    def mark_saved(self):
+        # the repository was written to the files, this is not a change to reload
+        self._signatures = self._current_signatures()